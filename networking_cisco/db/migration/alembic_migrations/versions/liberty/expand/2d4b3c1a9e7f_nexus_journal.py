@@ -0,0 +1,46 @@
+# Copyright 2016 Cisco Systems, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Add Nexus switch config journal
+
+Revision ID: 2d4b3c1a9e7f
+Revises: 8f5b6a4f0b3e
+Create Date: 2016-02-11 15:40:07.531862
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2d4b3c1a9e7f'
+down_revision = '8f5b6a4f0b3e'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('cisco_ml2_nexus_journal',
+        sa.Column('id', sa.Integer(), nullable=False, autoincrement=True),
+        sa.Column('switch_ip', sa.String(length=255), nullable=False),
+        sa.Column('operation', sa.String(length=64), nullable=False),
+        sa.Column('data', sa.Text(), nullable=False),
+        sa.Column('state', sa.String(length=16), nullable=False),
+        sa.Column('retry_count', sa.Integer(), nullable=False),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_cisco_ml2_nexus_journal_switch_id',
+                    'cisco_ml2_nexus_journal', ['switch_ip', 'id'],
+                    unique=False)
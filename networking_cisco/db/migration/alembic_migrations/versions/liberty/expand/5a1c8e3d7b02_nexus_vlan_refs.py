@@ -0,0 +1,53 @@
+# Copyright 2016 Cisco Systems, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Add Nexus VLAN reference counts
+
+Revision ID: 5a1c8e3d7b02
+Revises: 2d4b3c1a9e7f
+Create Date: 2016-02-18 10:12:44.204611
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5a1c8e3d7b02'
+down_revision = '2d4b3c1a9e7f'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('cisco_ml2_nexus_vlan_refs',
+        sa.Column('switch_ip', sa.String(length=255), nullable=False),
+        sa.Column('vlan_id', sa.Integer(), nullable=False,
+                  autoincrement=False),
+        sa.Column('port_id', sa.String(length=255), nullable=False),
+        sa.Column('ref_count', sa.Integer(), nullable=False),
+        sa.Column('instance_id', sa.String(length=255), nullable=True),
+        sa.PrimaryKeyConstraint('switch_ip', 'vlan_id', 'port_id')
+    )
+    # Seed the counts from the existing port bindings.
+    op.execute("INSERT INTO cisco_ml2_nexus_vlan_refs "
+               "(switch_ip, vlan_id, port_id, ref_count) "
+               "SELECT switch_ip, vlan_id, port_id, COUNT(*) "
+               "FROM cisco_ml2_nexusport_bindings "
+               "WHERE switch_ip IS NOT NULL AND port_id IS NOT NULL "
+               "GROUP BY switch_ip, vlan_id, port_id")
+    op.execute("INSERT INTO cisco_ml2_nexus_vlan_refs "
+               "(switch_ip, vlan_id, port_id, ref_count) "
+               "SELECT switch_ip, vlan_id, '', COUNT(*) "
+               "FROM cisco_ml2_nexusport_bindings "
+               "WHERE switch_ip IS NOT NULL AND port_id IS NOT NULL "
+               "GROUP BY switch_ip, vlan_id")
@@ -0,0 +1,43 @@
+# Copyright 2016 Cisco Systems, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Add Nexus VXLAN free VNI ranges
+
+Revision ID: 7e2f4d9a1c36
+Revises: 5a1c8e3d7b02
+Create Date: 2016-02-24 09:31:52.771438
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7e2f4d9a1c36'
+down_revision = '5a1c8e3d7b02'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('ml2_nexus_vxlan_free_ranges',
+        sa.Column('id', sa.Integer(), nullable=False, autoincrement=True),
+        sa.Column('first_vni', sa.Integer(), nullable=False),
+        sa.Column('last_vni', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_ml2_nexus_vxlan_free_ranges_first_vni',
+                    'ml2_nexus_vxlan_free_ranges', ['first_vni'],
+                    unique=False)
+    op.create_index('ix_ml2_nexus_vxlan_free_ranges_last_vni',
+                    'ml2_nexus_vxlan_free_ranges', ['last_vni'],
+                    unique=False)
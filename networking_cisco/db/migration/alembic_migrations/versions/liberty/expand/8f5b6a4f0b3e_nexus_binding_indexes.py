@@ -0,0 +1,42 @@
+# Copyright 2016 Cisco Systems, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Add Nexus binding lookup indexes
+
+Revision ID: 8f5b6a4f0b3e
+Revises: 11ba2d65c8de
+Create Date: 2016-02-04 10:12:31.204518
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8f5b6a4f0b3e'
+down_revision = '11ba2d65c8de'
+
+from alembic import op
+
+
+def upgrade():
+    op.create_index('ix_cisco_ml2_nexusport_bindings_switch_vlan_port',
+                    'cisco_ml2_nexusport_bindings',
+                    ['switch_ip', 'vlan_id', 'port_id'], unique=False)
+    op.create_index('ix_cisco_ml2_nexusport_bindings_instance_vlan',
+                    'cisco_ml2_nexusport_bindings',
+                    ['instance_id', 'vlan_id'], unique=False)
+    op.create_index('ix_cisco_ml2_nexusport_bindings_port_switch',
+                    'cisco_ml2_nexusport_bindings',
+                    ['port_id', 'switch_ip'], unique=False)
+    op.create_index('ix_cisco_ml2_nexus_nve_switch_vni',
+                    'cisco_ml2_nexus_nve',
+                    ['switch_ip', 'vni'], unique=False)
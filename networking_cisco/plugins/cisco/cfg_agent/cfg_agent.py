@@ -276,7 +276,9 @@ class CiscoCfgAgent(manager.Manager):
         :return: None
         """
         driver_mgr = self.get_routing_service_helper().driver_manager
-        res = self._dev_status.check_backlogged_hosting_devices(driver_mgr)
+        # Finish before the next run of the backlog task is due.
+        res = self._dev_status.check_backlogged_hosting_devices(
+            driver_mgr, time_limit=self.conf.cfg_agent.heartbeat_interval)
         if res['reachable']:
             self.process_services(device_ids=res['reachable'])
         if res['revived']:
@@ -162,7 +162,12 @@ class ASR1kRoutingDriver(iosxe_driver.IosXeRoutingDriver):
         cfg_syncer = asr1k_cfg_syncer.ConfigSyncer(routers,
                                                    self,
                                                    hd)
-        cfg_syncer.delete_invalid_cfg()
+        try:
+            cfg_syncer.delete_invalid_cfg()
+        finally:
+            # The syncer edits the device directly, so the cached running
+            # config no longer matches it.
+            self._invalidate_running_config()
 
     def get_configuration(self):
         return self._get_running_config(split=False)
@@ -29,9 +29,10 @@ from networking_cisco.plugins.cisco.cfg_agent.device_drivers import (
     devicedriver_api)
 from networking_cisco.plugins.cisco.cfg_agent.device_drivers.csr1kv import (
     cisco_csr1kv_snippets as snippets)
+from networking_cisco.plugins.cisco.cfg_agent.device_drivers.csr1kv import (
+    iosxe_running_config)
 from networking_cisco.plugins.cisco.extensions import ha
 
-ciscoconfparse = importutils.try_import('ciscoconfparse')
 ncclient = importutils.try_import('ncclient')
 manager = importutils.try_import('ncclient.manager')
 
@@ -42,6 +43,17 @@ LOG = logging.getLogger(__name__)
 T1_PORT_NAME_PREFIX = 't1_p:'  # T1 port/network is for VXLAN
 T2_PORT_NAME_PREFIX = 't2_p:'  # T2 port/network is for VLAN
 
+IOSXE_DRIVER_OPTS = [
+    cfg.IntOpt('running_config_cache_max_age', default=10,
+               help=_("Time in seconds the routing driver reuses a running "
+                      "config fetched from a hosting device. The cached "
+                      "config is discarded whenever the driver modifies the "
+                      "configuration of the hosting device. 0 disables "
+                      "caching.")),
+]
+
+cfg.CONF.register_opts(IOSXE_DRIVER_OPTS, "cfg_agent")
+
 
 class IosXeRoutingDriver(devicedriver_api.RoutingDriverBase):
     """Generic IOS XE Routing Driver.
@@ -53,6 +65,8 @@ class IosXeRoutingDriver(devicedriver_api.RoutingDriverBase):
     """
 
     DEV_NAME_LEN = 14
+    # Snippets which do not modify the running config
+    CFG_UNCHANGED_SNIPPETS = ('CLEAR_DYN_NAT_TRANS',)
 
     def __init__(self, **device_params):
         try:
@@ -65,6 +79,11 @@ class IosXeRoutingDriver(devicedriver_api.RoutingDriverBase):
                              cfg.CONF.cfg_agent.device_connection_timeout)
             self._ncc_connection = None
             self._itfcs_enabled = False
+            self._running_cfg = None
+            self._running_cfg_ts = 0
+            self._running_cfg_index = None
+            self.running_cfg_fetches = 0
+            self.running_cfg_fetches_avoided = 0
         except KeyError as e:
             LOG.error(_LE("Missing device parameter:%s. Aborting "
                           "IosXeRoutingDriver initialization"), e)
@@ -113,6 +132,7 @@ class IosXeRoutingDriver(devicedriver_api.RoutingDriverBase):
 
     def clear_connection(self):
         self._ncc_connection = None
+        self._invalidate_running_config()
 
     def cleanup_invalid_cfg(self, hd, routers):
         # at this point nothing to be done for CSR
@@ -205,7 +225,7 @@ class IosXeRoutingDriver(devicedriver_api.RoutingDriverBase):
         if ext_gw_ip:
             vrf_name = self._get_vrf_name(ri)
             conf_str = snippets.DEFAULT_ROUTE_CFG % (vrf_name, ext_gw_ip)
-            if not self._cfg_exists(conf_str):
+            if not self._static_route_exists(vrf_name, conf_str):
                 conf_str = snippets.SET_DEFAULT_ROUTE % (vrf_name, ext_gw_ip)
                 self._edit_running_config(conf_str, 'SET_DEFAULT_ROUTE')
 
@@ -214,7 +234,7 @@ class IosXeRoutingDriver(devicedriver_api.RoutingDriverBase):
         if ext_gw_ip:
             vrf_name = self._get_vrf_name(ri)
             conf_str = snippets.DEFAULT_ROUTE_CFG % (vrf_name, ext_gw_ip)
-            if self._cfg_exists(conf_str):
+            if self._static_route_exists(vrf_name, conf_str):
                 conf_str = snippets.REMOVE_DEFAULT_ROUTE % (vrf_name,
                                                             ext_gw_ip)
                 self._edit_running_config(conf_str, 'REMOVE_DEFAULT_ROUTE')
@@ -280,6 +300,7 @@ class IosXeRoutingDriver(devicedriver_api.RoutingDriverBase):
                 if not self._itfcs_enabled:
                     self._itfcs_enabled = self._enable_itfcs(
                         self._ncc_connection)
+                self._invalidate_running_config()
             return self._ncc_connection
         except Exception as e:
             conn_params = {'host': self._host_ip, 'port': self._host_ssh_port,
@@ -332,10 +353,9 @@ class IosXeRoutingDriver(devicedriver_api.RoutingDriverBase):
 
         :return: List of the interfaces
         """
-        ios_cfg = self._get_running_config()
-        parse = ciscoconfparse.CiscoConfParse(ios_cfg)
-        itfcs_raw = parse.find_lines("^interface GigabitEthernet")
-        itfcs = [raw_if.strip().split(' ')[1] for raw_if in itfcs_raw]
+        cfg_index = self._get_running_config_index()
+        itfcs = [itfc for itfc in cfg_index.interfaces
+                 if itfc.startswith('GigabitEthernet')]
         LOG.debug("Interfaces on hosting device: %s", itfcs)
         return itfcs
 
@@ -345,23 +365,17 @@ class IosXeRoutingDriver(devicedriver_api.RoutingDriverBase):
         :param interface_name: interface_name as a string
         :return: ip address of interface as a string
         """
-        ios_cfg = self._get_running_config()
-        parse = ciscoconfparse.CiscoConfParse(ios_cfg)
-        children = parse.find_children("^interface %s" % interface_name)
-        for line in children:
-            if 'ip address' in line:
-                ip_address = line.strip().split(' ')[2]
-                LOG.debug("IP Address:%s", ip_address)
-                return ip_address
+        cfg_index = self._get_running_config_index()
+        ip_address = cfg_index.get_interface_ip(interface_name)
+        if ip_address:
+            LOG.debug("IP Address:%s", ip_address)
+            return ip_address
         LOG.warning(_LW("Cannot find interface: %s"), interface_name)
         return None
 
     def _interface_exists(self, interface):
         """Check whether interface exists."""
-        ios_cfg = self._get_running_config()
-        parse = ciscoconfparse.CiscoConfParse(ios_cfg)
-        itfcs_raw = parse.find_lines("^interface " + interface)
-        return len(itfcs_raw) > 0
+        return self._get_running_config_index().has_interface(interface)
 
     def _enable_itfcs(self, conn):
         """Enable the interfaces of a CSR1kv Virtual Router.
@@ -399,14 +413,7 @@ class IosXeRoutingDriver(devicedriver_api.RoutingDriverBase):
 
         :return: A list of vrf names as string
         """
-        vrfs = []
-        ios_cfg = self._get_running_config()
-        parse = ciscoconfparse.CiscoConfParse(ios_cfg)
-        vrfs_raw = parse.find_lines("^vrf definition")
-        for line in vrfs_raw:
-            #  raw format ['ip vrf <vrf-name>',....]
-            vrf_name = line.strip().split(' ')[2]
-            vrfs.append(vrf_name)
+        vrfs = list(self._get_running_config_index().vrfs)
         LOG.info(_LI("VRFs:%s"), vrfs)
         return vrfs
 
@@ -425,19 +432,57 @@ class IosXeRoutingDriver(devicedriver_api.RoutingDriverBase):
     def _get_running_config(self, split=True):
         """Get the CSR's current running config.
 
+        The running config is reused for running_config_cache_max_age
+        seconds or until the driver next modifies the configuration.
         :return: Current IOS running config as multiline string
         """
+        max_age = cfg.CONF.cfg_agent.running_config_cache_max_age
+        if (self._running_cfg is not None and
+                time.time() - self._running_cfg_ts < max_age):
+            self.running_cfg_fetches_avoided += 1
+            running_config = self._running_cfg
+        else:
+            self._invalidate_running_config()
+            running_config = self._fetch_running_config()
+            self.running_cfg_fetches += 1
+            if running_config is None:
+                return
+            if max_age > 0:
+                self._running_cfg = running_config
+                self._running_cfg_ts = time.time()
+        if split is True:
+            rgx = re.compile("\r*\n+")
+            return rgx.split(running_config)
+        return running_config
+
+    def _fetch_running_config(self):
         conn = self._get_connection()
         config = conn.get_config(source="running")
         if config:
             root = ET.fromstring(config._raw)
-            running_config = root[0][0]
-            if split is True:
-                rgx = re.compile("\r*\n+")
-                ioscfg = rgx.split(running_config.text)
-            else:
-                ioscfg = running_config.text
-            return ioscfg
+            return root[0][0].text
+
+    def _get_running_config_index(self):
+        """Get an indexed view of the CSR's current running config.
+
+        The index is kept along with the cached running config.
+        :return: iosxe_running_config.IosXeRunningConfig
+        """
+        ios_cfg = self._get_running_config()
+        if self._running_cfg is None:
+            return iosxe_running_config.IosXeRunningConfig(ios_cfg or [])
+        if self._running_cfg_index is None:
+            self._running_cfg_index = (
+                iosxe_running_config.IosXeRunningConfig(ios_cfg))
+        return self._running_cfg_index
+
+    def _invalidate_running_config(self):
+        self._running_cfg = None
+        self._running_cfg_index = None
+
+    def get_running_config_cache_stats(self):
+        return {'fetches': self.running_cfg_fetches,
+                'fetches_avoided': self.running_cfg_fetches_avoided}
 
     def _check_acl(self, acl_no, network, netmask):
         """Check a ACL config exists in the running config.
@@ -447,30 +492,31 @@ class IosXeRoutingDriver(devicedriver_api.RoutingDriverBase):
         :param netmask: netmask of the network
         :return:
         """
-        exp_cfg_lines = ['ip access-list standard ' + str(acl_no),
-                         ' permit ' + str(network) + ' ' + str(netmask)]
-        ios_cfg = self._get_running_config()
-        parse = ciscoconfparse.CiscoConfParse(ios_cfg)
-        acls_raw = parse.find_children(exp_cfg_lines[0])
-        if acls_raw:
-            if exp_cfg_lines[1] in acls_raw:
+        exp_cfg_line = ' permit ' + str(network) + ' ' + str(netmask)
+        acl_entries = self._get_running_config_index().get_acl(acl_no)
+        if acl_entries:
+            if exp_cfg_line in acl_entries:
                 return True
             LOG.error(_LE("Mismatch in ACL configuration for %s"), acl_no)
             return False
         LOG.debug("%s is not present in config", acl_no)
         return False
 
+    def _static_route_exists(self, vrf_name, route_cfg):
+        """Checks whether a static route of a VRF starts with route_cfg."""
+        routes = self._get_running_config_index().get_static_routes(vrf_name)
+        return any(route.startswith(route_cfg) for route in routes)
+
     def _cfg_exists(self, cfg_str):
         """Check a partial config string exists in the running config.
 
         :param cfg_str: config string to check
         :return : True or False
         """
-        ios_cfg = self._get_running_config()
-        parse = ciscoconfparse.CiscoConfParse(ios_cfg)
-        cfg_raw = parse.find_lines("^" + cfg_str)
-        LOG.debug("_cfg_exists(): Found lines %s", cfg_raw)
-        return len(cfg_raw) > 0
+        cfg_exists = self._get_running_config_index().cfg_exists(cfg_str)
+        LOG.debug("_cfg_exists(): %(cfg)s found: %(exists)s",
+                  {'cfg': cfg_str, 'exists': cfg_exists})
+        return cfg_exists
 
     def _set_interface(self, name, ip_address, mask):
         conf_str = snippets.SET_INTC % (name, ip_address, mask)
@@ -514,9 +560,7 @@ class IosXeRoutingDriver(devicedriver_api.RoutingDriverBase):
         self._edit_running_config(conf_str, action)
 
     def _get_interface_cfg(self, interface):
-        ios_cfg = self._get_running_config()
-        parse = ciscoconfparse.CiscoConfParse(ios_cfg)
-        return parse.find_children('interface ' + interface)
+        return self._get_running_config_index().get_interface_cfg(interface)
 
     def _nat_rules_for_internet_access(self, acl_no, network,
                                        netmask,
@@ -570,7 +614,9 @@ class IosXeRoutingDriver(devicedriver_api.RoutingDriverBase):
 
     def _remove_dyn_nat_rule(self, acl_no, outer_itfc_name, vrf_name):
         conf_str = snippets.SNAT_CFG % (acl_no, outer_itfc_name, vrf_name)
-        if self._cfg_exists(conf_str):
+        nat_rule = self._get_running_config_index().get_nat_rule(acl_no,
+                                                                 vrf_name)
+        if nat_rule is not None and nat_rule.startswith(conf_str):
             conf_str = snippets.REMOVE_DYN_SRC_TRL_INTFC % (
                 acl_no, outer_itfc_name, vrf_name)
             self._edit_running_config(conf_str, 'REMOVE_DYN_SRC_TRL_INTFC')
@@ -591,10 +637,7 @@ class IosXeRoutingDriver(devicedriver_api.RoutingDriverBase):
         self._edit_running_config(conf_str, 'REMOVE_STATIC_SRC_TRL')
 
     def _get_floating_ip_cfg(self):
-        ios_cfg = self._get_running_config()
-        parse = ciscoconfparse.CiscoConfParse(ios_cfg)
-        res = parse.find_lines('ip nat inside source static')
-        return res
+        return list(self._get_running_config_index().static_nats)
 
     def _add_static_route(self, dest, dest_mask, next_hop, vrf):
         conf_str = snippets.SET_IP_ROUTE % (vrf, dest, dest_mask, next_hop)
@@ -605,9 +648,7 @@ class IosXeRoutingDriver(devicedriver_api.RoutingDriverBase):
         self._edit_running_config(conf_str, 'REMOVE_IP_ROUTE')
 
     def _get_static_route_cfg(self):
-        ios_cfg = self._get_running_config()
-        parse = ciscoconfparse.CiscoConfParse(ios_cfg)
-        return parse.find_lines('ip route')
+        return self._get_running_config_index().get_static_routes()
 
     def caller_name(self, skip=2):
         """
@@ -677,6 +718,9 @@ class IosXeRoutingDriver(devicedriver_api.RoutingDriverBase):
                           'dev_id': self.hosting_device['id'],
                           'ip': self._host_ip, 'confstr': conf_str}
                 raise cfg_exc.CSR1kvConfigException(**params)
+        finally:
+            if snippet not in self.CFG_UNCHANGED_SNIPPETS:
+                self._invalidate_running_config()
 
     def _check_response(self, rpc_obj, snippet_name, conf_str=None):
         """This function checks the rpc response object for status.
@@ -0,0 +1,121 @@
+# Copyright 2016 Cisco Systems, Inc.  All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import re
+
+import six
+
+INTERFACE_PREFIX = 'interface '
+VRF_PREFIX = 'vrf definition '
+ACL_RE = re.compile(r'^ip access-list (?:standard|extended) (\S+)')
+NAT_RULE_PREFIX = 'ip nat inside source list '
+STATIC_NAT_PREFIX = 'ip nat inside source static '
+STATIC_ROUTE_RE = re.compile(r'^ip route (?:vrf (\S+) )?')
+
+
+class IosXeRunningConfig(object):
+    """Indexed view of an IOS XE running config.
+
+    The running config is scanned once and the parts queried by the
+    routing drivers are kept in dictionaries:
+
+    interfaces     interface name -> list of its (indented) config lines
+    vrfs           VRF names in config order
+    acls           ACL name -> list of its (indented) config lines
+    nat_rules      (ACL name, VRF name) -> dynamic NAT rule line
+    static_nats    static NAT (floating IP) lines
+    static_routes  VRF name (None for the global table) -> route lines
+    """
+
+    def __init__(self, ios_cfg):
+        if isinstance(ios_cfg, six.string_types):
+            ios_cfg = re.split("\r*\n+", ios_cfg)
+        self.lines = [line.rstrip() for line in ios_cfg]
+        self.interfaces = {}
+        self.vrfs = []
+        self.acls = {}
+        self.nat_rules = {}
+        self.static_nats = []
+        self.static_routes = {}
+        self._line_set = set(self.lines)
+        self._index()
+
+    def _index(self):
+        children = None
+        for line in self.lines:
+            if line.startswith(' '):
+                if children is not None:
+                    children.append(line)
+                continue
+            children = None
+            if line.startswith(INTERFACE_PREFIX):
+                name = line.split()[1]
+                children = self.interfaces.setdefault(name, [])
+                continue
+            if line.startswith(VRF_PREFIX):
+                self.vrfs.append(line.split()[2])
+                continue
+            match = ACL_RE.match(line)
+            if match:
+                children = self.acls.setdefault(match.group(1), [])
+                continue
+            if line.startswith(NAT_RULE_PREFIX):
+                tokens = line.split()
+                if 'vrf' in tokens[:-1]:
+                    vrf = tokens[tokens.index('vrf') + 1]
+                else:
+                    vrf = None
+                self.nat_rules[(tokens[5], vrf)] = line
+                continue
+            if line.startswith(STATIC_NAT_PREFIX):
+                self.static_nats.append(line)
+                continue
+            match = STATIC_ROUTE_RE.match(line)
+            if match:
+                self.static_routes.setdefault(match.group(1), []).append(line)
+
+    def has_interface(self, name):
+        return name in self.interfaces
+
+    def get_interface_cfg(self, name):
+        """Returns the config lines of an interface including its header."""
+        if name not in self.interfaces:
+            return []
+        return [INTERFACE_PREFIX + name] + self.interfaces[name]
+
+    def get_interface_ip(self, name):
+        for line in self.interfaces.get(name, []):
+            tokens = line.split()
+            if tokens[:2] == ['ip', 'address'] and len(tokens) > 2:
+                return tokens[2]
+
+    def get_acl(self, name):
+        """Returns the entries of an ACL, None if there is no such ACL."""
+        return self.acls.get(str(name))
+
+    def get_nat_rule(self, acl, vrf):
+        return self.nat_rules.get((str(acl), vrf))
+
+    def get_static_routes(self, vrf=None):
+        """Returns static routes of a VRF, or of all VRFs if vrf is None."""
+        if vrf is not None:
+            return list(self.static_routes.get(vrf, []))
+        return [route for routes in six.itervalues(self.static_routes)
+                for route in routes]
+
+    def cfg_exists(self, cfg_str):
+        """Checks whether a config line starts with the given string."""
+        if cfg_str in self._line_set:
+            return True
+        return any(line.startswith(cfg_str) for line in self.lines)
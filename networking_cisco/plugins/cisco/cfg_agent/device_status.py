@@ -13,7 +13,16 @@
 #    under the License.
 
 import datetime
-
+import errno
+import math
+import random
+import re
+import struct
+import time
+
+import eventlet
+from eventlet.green import socket
+import netaddr
 from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_utils import timeutils
@@ -38,31 +47,265 @@ STATUS_OPTS = [
                       "is presumed dead. This value should be set up high "
                       "enough to recover from a period of connectivity loss "
                       "or high load when the device may not be responding.")),
+    cfg.IntOpt('ping_count', default=5,
+               help=_("Number of ICMP echo requests sent to a hosting device "
+                      "when checking its reachability")),
+    cfg.IntOpt('ping_timeout', default=1,
+               help=_("Time in seconds to wait for each ICMP echo reply")),
+    cfg.FloatOpt('ping_interval', default=0.2,
+                 help=_("Time in seconds between successive ICMP echo "
+                        "requests to a hosting device")),
+    cfg.IntOpt('reachable_cache_ttl', default=30,
+               help=_("Time in seconds a hosting device found reachable is "
+                      "considered reachable without pinging it again. Any "
+                      "failure to configure the hosting device invalidates "
+                      "it. 0 disables caching.")),
+    cfg.IntOpt('unreachable_cache_ttl', default=10,
+               help=_("Time in seconds a hosting device found unreachable "
+                      "is considered unreachable without pinging it again. "
+                      "0 disables caching.")),
+    cfg.IntOpt('backlog_check_pool_size', default=16,
+               help=_("Maximum number of dead hosting devices whose "
+                      "NETCONF readiness is checked concurrently")),
+    cfg.IntOpt('backlog_check_timeout', default=30,
+               help=_("Time in seconds allowed for checking the NETCONF "
+                      "readiness of a dead hosting device which answers "
+                      "pings again. The whole backlog check is also "
+                      "limited to heartbeat_interval seconds.")),
+    cfg.IntOpt('dead_device_max_probe_interval', default=60,
+               help=_("Maximum time in seconds between NETCONF readiness "
+                      "checks of a dead hosting device which answers pings. "
+                      "The time between checks doubles each time such a "
+                      "device is found not ready, up to this value. 0 checks "
+                      "them on every backlog check. Dead hosting devices are "
+                      "pinged on every backlog check regardless.")),
 ]
 
 cfg.CONF.register_opts(STATUS_OPTS, "cfg_agent")
 
 
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+ICMP_HEADER = '!BBHHH'
+ICMP_PAYLOAD = b'networking-cisco'
+# Errors raised when the agent is not allowed to open ICMP sockets
+ICMP_PERMISSION_ERRORS = (errno.EPERM, errno.EACCES, errno.EPROTONOSUPPORT)
+# Number of ping subprocesses run in parallel when native probing
+# is not possible
+PING_FALLBACK_POOL_SIZE = 16
+PING_RECEIVED_RE = re.compile(r'(\d+) (?:packets )?received')
+PING_RTT_RE = re.compile(r'= ([\d.]+)/([\d.]+)/([\d.]+)')
+
+
+def _icmp_checksum(data):
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack('!%dH' % (len(data) // 2), data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+def _icmp_echo_packet(ident, seq):
+    header = struct.pack(ICMP_HEADER, ICMP_ECHO_REQUEST, 0, 0, ident, seq)
+    checksum = _icmp_checksum(header + ICMP_PAYLOAD)
+    return struct.pack(ICMP_HEADER, ICMP_ECHO_REQUEST, 0, checksum,
+                       ident, seq) + ICMP_PAYLOAD
+
+
+def _parse_echo_reply(data, raw):
+    """Returns (ident, seq) of an ICMP echo reply, None for anything else.
+
+    Raw sockets deliver the IP header in front of the ICMP message,
+    datagram (ping) sockets only the ICMP message.
+    """
+    if raw:
+        ihl = (struct.unpack('!B', data[:1])[0] & 0x0f) * 4
+        data = data[ihl:]
+    if len(data) < struct.calcsize(ICMP_HEADER):
+        return None
+    icmp_type, _code, _checksum, ident, seq = struct.unpack(
+        ICMP_HEADER, data[:struct.calcsize(ICMP_HEADER)])
+    if icmp_type != ICMP_ECHO_REPLY:
+        return None
+    return ident, seq
+
+
+def _open_icmp_socket():
+    """Opens an ICMP socket, preferring unprivileged ping sockets.
+
+    :return: tuple of (socket, raw) or (None, False) if the agent lacks
+             the privileges to open any ICMP socket.
+    """
+    for sock_type in (socket.SOCK_DGRAM, socket.SOCK_RAW):
+        try:
+            sock = socket.socket(socket.AF_INET, sock_type,
+                                 socket.IPPROTO_ICMP)
+            return sock, sock_type == socket.SOCK_RAW
+        except socket.error as e:
+            if e.errno not in ICMP_PERMISSION_ERRORS:
+                raise
+    return None, False
+
+
+def _probe_stats(sent, received, rtt_min=None, rtt_avg=None, rtt_max=None):
+    loss = 100.0 * (sent - received) / sent if sent else 100.0
+    return {'sent': sent,
+            'received': received,
+            'loss': loss,
+            'rtt_min': rtt_min,
+            'rtt_avg': rtt_avg,
+            'rtt_max': rtt_max}
+
+
+def _icmp_probe(sock, raw, targets, count, timeout, interval):
+    """Pings all targets in one pass over a single ICMP socket.
+
+    Echo requests go out to every target once per round, rounds being
+    interval seconds apart. Replies are matched on source address and
+    sequence number and are counted if they arrive within timeout seconds
+    of their request. The pass ends when all requests are answered or the
+    last round has timed out.
+    :return: dict of target ip to probe statistics (rtt in milliseconds)
+    """
+    # Ping sockets get their identifier from the kernel and only see their
+    # own replies, raw sockets see every reply so the identifier is checked.
+    ident = random.randint(0, 0xffff)
+    sent = dict((ip, 0) for ip in targets)
+    rtts = dict((ip, []) for ip in targets)
+    pending = {}
+
+    def receive(wait):
+        sock.settimeout(wait)
+        try:
+            data, addr = sock.recvfrom(2048)
+        except socket.timeout:
+            return False
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return False
+            raise
+        received_at = time.time()
+        reply = _parse_echo_reply(data, raw)
+        if reply is None or (raw and reply[0] != ident):
+            return True
+        sent_at = pending.pop((addr[0], reply[1]), None)
+        if sent_at is not None and received_at - sent_at <= timeout:
+            rtts[addr[0]].append((received_at - sent_at) * 1000.0)
+        return True
+
+    seq = 0
+    next_round = time.time()
+    deadline = next_round + timeout
+    while True:
+        now = time.time()
+        if seq < count and now >= next_round:
+            for ip in targets:
+                sent[ip] += 1
+                try:
+                    sock.sendto(_icmp_echo_packet(ident, seq), (ip, 0))
+                except socket.error as e:
+                    LOG.debug("Cannot send ICMP echo request to %(ip)s: "
+                              "%(err)s", {'ip': ip, 'err': e})
+                    continue
+                pending[(ip, seq)] = time.time()
+                # Drain replies already queued so that the socket receive
+                # buffer does not overflow when probing many targets
+                while receive(0):
+                    pass
+            seq += 1
+            next_round += interval
+            deadline = time.time() + timeout
+            continue
+        if seq >= count and (not pending or now >= deadline):
+            break
+        wait = (next_round if seq < count else deadline) - now
+        receive(max(wait, 0.001))
+    result = {}
+    for ip in targets:
+        if rtts[ip]:
+            result[ip] = _probe_stats(sent[ip], len(rtts[ip]), min(rtts[ip]),
+                                      sum(rtts[ip]) / len(rtts[ip]),
+                                      max(rtts[ip]))
+        else:
+            result[ip] = _probe_stats(sent[ip], 0)
+    return result
+
+
+def _ping_probe(ip, count, timeout, interval):
+    """Pings an IP address with a ping subprocess through linux utils."""
+    ping_cmd = ['ping',
+                '-c', str(count),
+                '-W', str(int(math.ceil(timeout))),
+                '-i', str(interval),
+                ip]
+    try:
+        output = linux_utils.execute(ping_cmd, check_exit_code=True)
+    except RuntimeError:
+        return _probe_stats(count, 0)
+    match = PING_RECEIVED_RE.search(output or '')
+    received = int(match.group(1)) if match else count
+    match = PING_RTT_RE.search(output or '')
+    if match:
+        return _probe_stats(count, received, *map(float, match.groups()))
+    return _probe_stats(count, received)
+
+
+def probe_hosts(ips, count=None, timeout=None, interval=None):
+    """Checks reachability of a number of IP addresses in one pass.
+
+    IPv4 addresses are pinged in-process over an ICMP socket. Addresses
+    which cannot be pinged that way, because they are not IPv4 or because
+    the agent is not allowed to open ICMP sockets, are pinged with ping
+    subprocesses instead.
+    :param ips: IP addresses to check
+    :param count: number of echo requests per address
+    :param timeout: time in seconds to wait for each echo reply
+    :param interval: time in seconds between echo requests
+    :return: dict of ip to statistics with keys sent, received, loss (in
+             percent) and rtt_min, rtt_avg, rtt_max (in milliseconds, None
+             if nothing was received)
+    """
+    conf = cfg.CONF.cfg_agent
+    count = count or conf.ping_count
+    timeout = timeout or conf.ping_timeout
+    interval = interval or conf.ping_interval
+    targets = set(ips)
+    result = {}
+    native_targets = [ip for ip in targets if netaddr.valid_ipv4(ip)]
+    if native_targets:
+        sock, raw = _open_icmp_socket()
+        if sock is None:
+            LOG.debug("Not permitted to open ICMP sockets, falling back to "
+                      "ping subprocesses")
+        else:
+            try:
+                result.update(_icmp_probe(sock, raw, native_targets, count,
+                                          timeout, interval))
+            finally:
+                sock.close()
+    remaining = [ip for ip in targets if ip not in result]
+    if remaining:
+        pool = eventlet.GreenPool(PING_FALLBACK_POOL_SIZE)
+        probes = pool.imap(lambda ip: _ping_probe(ip, count, timeout,
+                                                  interval), remaining)
+        result.update(zip(remaining, probes))
+    return result
+
+
 def _is_pingable(ip):
     """Checks whether an IP address is reachable by pinging.
 
-    Use linux utils to execute the ping (ICMP ECHO) command.
-    Sends 5 packets with an interval of 0.2 seconds and timeout of 1
-    seconds. Runtime error implies unreachability else IP is pingable.
+    Sends ping_count ICMP echo requests ping_interval seconds apart and
+    waits ping_timeout seconds for each reply. The address is pingable if
+    any reply is received.
     :param ip: IP to check
     :return: bool - True or False depending on pingability.
     """
-    ping_cmd = ['ping',
-                '-c', '5',
-                '-W', '1',
-                '-i', '0.2',
-                ip]
-    try:
-        linux_utils.execute(ping_cmd, check_exit_code=True)
+    if probe_hosts([ip])[ip]['received']:
         return True
-    except RuntimeError:
-        LOG.warning(_LW("Cannot ping ip address: %s"), ip)
-        return False
+    LOG.warning(_LW("Cannot ping ip address: %s"), ip)
+    return False
 
 
 class DeviceStatus(object):
@@ -78,10 +321,66 @@ class DeviceStatus(object):
     def __init__(self):
         self.backlog_hosting_devices = {}
         self.enable_heartbeat = False
+        # hosting device id -> (reachable, expiry time)
+        self._reachability = {}
+        # hosting device id -> (created_at as received, created_at, booted_at)
+        self._boot_times = {}
+        self.reachability_cache_hits = 0
+        self.reachability_cache_misses = 0
 
     def get_backlogged_hosting_devices(self):
         return self.backlog_hosting_devices.keys()
 
+    def get_reachability_cache_stats(self):
+        return {'hits': self.reachability_cache_hits,
+                'misses': self.reachability_cache_misses}
+
+    def invalidate_reachability(self, hd_id):
+        """Forgets the cached reachability of a hosting device.
+
+        Called when communicating with the hosting device failed, so that
+        the next reachability check pings it again.
+        """
+        self._reachability.pop(hd_id, None)
+
+    def _get_cached_reachability(self, hd_id):
+        cached = self._reachability.get(hd_id)
+        if cached is not None and cached[1] > time.time():
+            self.reachability_cache_hits += 1
+            return cached[0]
+        self.reachability_cache_misses += 1
+        return None
+
+    def _cache_reachability(self, hd_id, reachable):
+        if reachable:
+            ttl = cfg.CONF.cfg_agent.reachable_cache_ttl
+        else:
+            ttl = cfg.CONF.cfg_agent.unreachable_cache_ttl
+        if ttl > 0:
+            self._reachability[hd_id] = (reachable, time.time() + ttl)
+        else:
+            self._reachability.pop(hd_id, None)
+
+    def _get_boot_times(self, hd):
+        """Returns the creation and estimated boot time of a hosting device.
+
+        The 'created_at' of hosting devices received from the plugin is a
+        string, so it is parsed once per hosting device and reused for the
+        hosting device dicts of all its routers.
+        """
+        cached = self._boot_times.get(hd['id'])
+        if cached is not None and cached[0] == hd['created_at']:
+            return cached[1], cached[2]
+        created_at = hd['created_at']
+        if not isinstance(created_at, datetime.datetime):
+            created_at = datetime.datetime.strptime(created_at,
+                                                    '%Y-%m-%d %H:%M:%S')
+        booted_at = created_at + datetime.timedelta(
+            seconds=hd['booting_time'])
+        self._boot_times[hd['id']] = (hd['created_at'], created_at,
+                                      booted_at)
+        return created_at, booted_at
+
     def get_backlogged_hosting_devices_info(self):
         resp = self.get_monitored_hosting_devices_info(hd_state_filter='Dead')
         return resp
@@ -137,6 +436,9 @@ class DeviceStatus(object):
         """Check the hosting device which hosts this resource is reachable.
 
         If the resource is not reachable, it is added to the backlog.
+        The outcome of pinging the hosting device is cached for
+        reachable_cache_ttl or unreachable_cache_ttl seconds so that all
+        routers on a hosting device are served by a single ping.
 
         * heartbeat revision
         We want to enqueue all hosting-devices into the backlog for
@@ -166,11 +468,14 @@ class DeviceStatus(object):
             return False
 
         # Modifying the 'created_at' to a date time object if it is not
-        if not isinstance(hd['created_at'], datetime.datetime):
-            hd['created_at'] = datetime.datetime.strptime(hd['created_at'],
-                                                          '%Y-%m-%d %H:%M:%S')
+        hd['created_at'], booted_at = self._get_boot_times(hd)
+
+        reachable = self._get_cached_reachability(hd_id)
+        if reachable is None:
+            reachable = _is_pingable(hd_mgmt_ip)
+            self._cache_reachability(hd_id, reachable)
 
-        if _is_pingable(hd_mgmt_ip):
+        if reachable:
             LOG.debug("Hosting device: %(hd_id)s@%(ip)s is reachable.",
                       {'hd_id': hd_id, 'ip': hd_mgmt_ip})
             hd['hd_state'] = cc.HD_ACTIVE
@@ -184,10 +489,8 @@ class DeviceStatus(object):
         if (self.enable_heartbeat is True or ret_val is False):
 
             if hd_id not in self.backlog_hosting_devices:
-                hd['backlog_insertion_ts'] = max(
-                    timeutils.utcnow(),
-                    hd['created_at'] +
-                    datetime.timedelta(seconds=hd['booting_time']))
+                hd['backlog_insertion_ts'] = max(timeutils.utcnow(),
+                                                 booted_at)
 
                 self.backlog_hosting_devices[hd_id] = {'hd': hd}
                 LOG.debug("Hosting device: %(hd_id)s @ %(ip)s is now added "
@@ -195,7 +498,7 @@ class DeviceStatus(object):
 
         return ret_val
 
-    def check_backlogged_hosting_devices(self, driver_mgr):
+    def check_backlogged_hosting_devices(self, driver_mgr, time_limit=None):
         """"Checks the status of backlogged hosting devices.
 
         Skips newly spun up instances during their booting time as specified
@@ -209,6 +512,14 @@ class DeviceStatus(object):
         is performed to determine the current state.  If the current state
         differs, hd_state is updated.
 
+        All hosting devices are pinged in one pass. Dead hosting devices
+        which answer are then checked for NETCONF readiness concurrently,
+        at most backlog_check_pool_size at a time, each check being given
+        backlog_check_timeout seconds, but no more than what is left of
+        time_limit. Dead hosting devices which answer pings but are not
+        NETCONF ready are checked again with exponentially increasing
+        spacing, up to dead_device_max_probe_interval seconds.
+
         The hd_state transitions/actions are represented by the following
         table.
 
@@ -228,6 +539,8 @@ class DeviceStatus(object):
                                             elapsed.         No state
                                             Notify plugin    change.
 
+        :param time_limit: time in seconds the check may take, None for
+                           no limit
         :return A dict of the format:
         {'reachable': [<hd_id>,..],'dead':[<hd_id>,..],'revived':[<hd_id>,..]}
         reachable - a list of hosting devices that are now reachable
@@ -237,8 +550,11 @@ class DeviceStatus(object):
         response_dict = {'reachable': [], 'revived': [], 'dead': []}
         LOG.debug("Current Backlogged hosting devices: \n%s\n",
                   self.backlog_hosting_devices.keys())
+        now = time.time()
+        hd_ids = []
         for hd_id in self.backlog_hosting_devices.keys():
-            hd = self.backlog_hosting_devices[hd_id]['hd']
+            backlog_entry = self.backlog_hosting_devices[hd_id]
+            hd = backlog_entry['hd']
 
             if not timeutils.is_older_than(hd['created_at'],
                                            hd['booting_time']):
@@ -249,60 +565,147 @@ class DeviceStatus(object):
             LOG.info(_LI("Checking hosting device: %(hd_id)s @ %(ip)s for "
                          "reachability."), {'hd_id': hd_id,
                                             'ip': hd['management_ip_address']})
-            hd_state = hd['hd_state']
-            if _is_pingable(hd['management_ip_address']):
-                if hd_state == cc.HD_NOT_RESPONDING:
-                    LOG.debug("hosting devices revived & reachable, %s" %
-                              (pprint.pformat(hd)))
-                    hd['hd_state'] = cc.HD_ACTIVE
-                    # hosting device state
-                    response_dict['reachable'].append(hd_id)
-                elif hd_state == cc.HD_DEAD:
-                    # test if netconf is actually ready
-                    driver = driver_mgr.get_driver_for_hosting_device(hd_id)
-                    try:
-                        driver.send_empty_cfg()
-                        LOG.debug("Dead hosting devices revived %s" %
-                              (pprint.pformat(hd)))
-                        hd['hd_state'] = cc.HD_ACTIVE
-                        response_dict['revived'].append(hd_id)
-                    except cfg_exceptions.DriverException as e:
-                        LOG.debug("netconf not ready on device yet."
-                                  "Error is %(e)s", {'e': e})
-                else:
-                    LOG.debug("No-op."
-                              "_is_pingable is True and current"
-                              " hd['hd_state']=%s" % (hd_state))
-
-                LOG.info(_LI("Hosting device: %(hd_id)s @ %(ip)s is now "
-                             "reachable. Adding it to response"),
-                         {'hd_id': hd_id, 'ip': hd['management_ip_address']})
+            hd_ids.append(hd_id)
+
+        if not hd_ids:
+            LOG.debug("Response: %s", response_dict)
+            return response_dict
+
+        deadline = now + time_limit if time_limit else None
+        probes = probe_hosts([
+            self.backlog_hosting_devices[hd_id]['hd']['management_ip_address']
+            for hd_id in hd_ids])
+        pool = eventlet.GreenPool(cfg.CONF.cfg_agent.backlog_check_pool_size)
+        for hd_id in hd_ids:
+            backlog_entry = self.backlog_hosting_devices[hd_id]
+            hd = backlog_entry['hd']
+            ip = hd['management_ip_address']
+            pingable = bool(probes[ip]['received'])
+            if not pingable:
+                LOG.warning(_LW("Cannot ping ip address: %s"), ip)
+            if pingable and hd['hd_state'] == cc.HD_DEAD:
+                if backlog_entry.get('next_probe', 0) > now:
+                    LOG.debug("Hosting device: %(hd_id)s @ %(ip)s is dead. "
+                              "Skipping its NETCONF check until its next "
+                              "check in %(time)d seconds.",
+                              {'hd_id': hd_id, 'ip': ip,
+                               'time': backlog_entry['next_probe'] - now})
+                    self._update_backlogged_hosting_device(
+                        hd_id, pingable, False, response_dict, now)
+                    continue
+                # The result is applied as soon as the check completes.
+                pool.spawn_n(self._check_netconf_ready, hd_id, driver_mgr,
+                             deadline, response_dict, now)
             else:
-                LOG.info(_LI("Hosting device: %(hd_id)s %(hd_state)s"
-                             " @ %(ip)s not reachable "),
-                         {'hd_id': hd_id,
-                          'hd_state': hd['hd_state'],
-                          'ip': hd['management_ip_address']})
-                if hd_state == cc.HD_ACTIVE:
-                    LOG.debug("hosting device lost connectivity, %s" %
-                              (pprint.pformat(hd)))
-                    hd['backlog_insertion_ts'] = timeutils.utcnow()
-                    hd['hd_state'] = cc.HD_NOT_RESPONDING
-
-                elif hd_state == cc.HD_NOT_RESPONDING:
-                    if timeutils.is_older_than(
-                            hd['backlog_insertion_ts'],
-                            cfg.CONF.cfg_agent.hosting_device_dead_timeout):
-                        # current hd_state is now dead, previous state: Unknown
-                        hd['hd_state'] = cc.HD_DEAD
-                        LOG.debug("Hosting device: %(hd_id)s @ %(ip)s hasn't "
-                                  "been reachable for the "
-                                  "last %(time)d seconds. "
-                                  "Marking it dead.",
-                                  {'hd_id': hd_id,
-                                   'ip': hd['management_ip_address'],
-                                   'time': cfg.CONF.cfg_agent.
-                                   hosting_device_dead_timeout})
-                        response_dict['dead'].append(hd_id)
+                self._update_backlogged_hosting_device(
+                    hd_id, pingable, False, response_dict, now)
+        pool.waitall()
         LOG.debug("Response: %s", response_dict)
         return response_dict
+
+    def _update_backlogged_hosting_device(self, hd_id, pingable,
+                                          netconf_ready, response_dict, now):
+        """Applies the outcome of checking a backlogged hosting device."""
+        backlog_entry = self.backlog_hosting_devices[hd_id]
+        hd = backlog_entry['hd']
+        hd_state = hd['hd_state']
+        self._cache_reachability(hd_id, pingable)
+        if pingable:
+            if hd_state == cc.HD_NOT_RESPONDING:
+                LOG.debug("hosting devices revived & reachable, %s" %
+                          (pprint.pformat(hd)))
+                hd['hd_state'] = cc.HD_ACTIVE
+                # hosting device state
+                response_dict['reachable'].append(hd_id)
+            elif hd_state == cc.HD_DEAD:
+                if netconf_ready:
+                    LOG.debug("Dead hosting devices revived %s" %
+                          (pprint.pformat(hd)))
+                    hd['hd_state'] = cc.HD_ACTIVE
+                    backlog_entry.pop('dead_probes', None)
+                    backlog_entry.pop('next_probe', None)
+                    response_dict['revived'].append(hd_id)
+                else:
+                    self.invalidate_reachability(hd_id)
+            else:
+                LOG.debug("No-op."
+                          "_is_pingable is True and current"
+                          " hd['hd_state']=%s" % (hd_state))
+
+            LOG.info(_LI("Hosting device: %(hd_id)s @ %(ip)s is now "
+                         "reachable. Adding it to response"),
+                     {'hd_id': hd_id, 'ip': hd['management_ip_address']})
+        else:
+            LOG.info(_LI("Hosting device: %(hd_id)s %(hd_state)s"
+                         " @ %(ip)s not reachable "),
+                     {'hd_id': hd_id,
+                      'hd_state': hd['hd_state'],
+                      'ip': hd['management_ip_address']})
+            if hd_state == cc.HD_ACTIVE:
+                LOG.debug("hosting device lost connectivity, %s" %
+                          (pprint.pformat(hd)))
+                hd['backlog_insertion_ts'] = timeutils.utcnow()
+                hd['hd_state'] = cc.HD_NOT_RESPONDING
+
+            elif hd_state == cc.HD_NOT_RESPONDING:
+                if timeutils.is_older_than(
+                        hd['backlog_insertion_ts'],
+                        cfg.CONF.cfg_agent.hosting_device_dead_timeout):
+                    # current hd_state is now dead, previous state: Unknown
+                    hd['hd_state'] = cc.HD_DEAD
+                    LOG.debug("Hosting device: %(hd_id)s @ %(ip)s hasn't "
+                              "been reachable for the "
+                              "last %(time)d seconds. "
+                              "Marking it dead.",
+                              {'hd_id': hd_id,
+                               'ip': hd['management_ip_address'],
+                               'time': cfg.CONF.cfg_agent.
+                               hosting_device_dead_timeout})
+                    response_dict['dead'].append(hd_id)
+            elif hd_state == cc.HD_DEAD:
+                # Check it for NETCONF readiness as soon as it answers.
+                backlog_entry.pop('dead_probes', None)
+                backlog_entry.pop('next_probe', None)
+
+    def _check_netconf_ready(self, hd_id, driver_mgr, deadline,
+                             response_dict, now):
+        """Checks whether a pingable dead hosting device is NETCONF ready.
+
+        The check is abandoned once it has taken backlog_check_timeout
+        seconds or the deadline has passed.
+        """
+        hd = self.backlog_hosting_devices[hd_id]['hd']
+        wait = cfg.CONF.cfg_agent.backlog_check_timeout
+        if deadline is not None:
+            wait = min(wait, deadline - time.time())
+        netconf_ready = False
+        timeout = eventlet.Timeout(max(wait, 0))
+        try:
+            driver = driver_mgr.get_driver_for_hosting_device(hd_id)
+            try:
+                driver.send_empty_cfg()
+                netconf_ready = True
+            except cfg_exceptions.DriverException as e:
+                LOG.debug("netconf not ready on device yet."
+                          "Error is %(e)s", {'e': e})
+        except eventlet.Timeout as t:
+            if t is not timeout:
+                raise
+            LOG.warning(_LW("Checking hosting device: %(hd_id)s @ %(ip)s "
+                            "did not complete within %(time).1f seconds"),
+                        {'hd_id': hd_id, 'ip': hd['management_ip_address'],
+                         'time': max(wait, 0)})
+        finally:
+            timeout.cancel()
+        if not netconf_ready:
+            self._space_dead_probes(self.backlog_hosting_devices[hd_id], now)
+        self._update_backlogged_hosting_device(hd_id, True, netconf_ready,
+                                               response_dict, now)
+
+    def _space_dead_probes(self, backlog_entry, now):
+        """Doubles the time until a dead hosting device's NETCONF check."""
+        max_interval = cfg.CONF.cfg_agent.dead_device_max_probe_interval
+        dead_probes = backlog_entry.get('dead_probes', 0) + 1
+        backlog_entry['dead_probes'] = dead_probes
+        backlog_entry['next_probe'] = now + min(2 ** dead_probes,
+                                                max_interval)
@@ -555,6 +555,8 @@ class RoutingServiceHelper(object):
                 except ncc_errors.SessionCloseError as e:
                     LOG.exception(
                         _LE("ncclient Unexpected session close %s"), e)
+                    self._dev_status.invalidate_reachability(
+                        r['hosting_device']['id'])
                     if not self._dev_status.is_hosting_device_reachable(
                         r['hosting_device']):
                         LOG.debug("Lost connectivity to Hosting Device %s" % (
@@ -575,6 +577,8 @@ class RoutingServiceHelper(object):
                     LOG.exception(_LE("Driver Exception on router:%(id)s. "
                                       "Error is %(e)s"), {'id': r['id'],
                                                           'e': e})
+                    self._dev_status.invalidate_reachability(
+                        r['hosting_device']['id'])
                     self.updated_routers.update([r['id']])
                     continue
                 LOG.debug("Done processing router[id:%(id)s, role:%(role)s]",
@@ -850,6 +854,7 @@ class RoutingServiceHelper(object):
             LOG.warning(_LW("Router remove for router_id: %s was incomplete. "
                             "Adding the router to removed_routers list"),
                         router_id)
+            self._dev_status.invalidate_reachability(hd['id'])
             self.removed_routers.add(router_id)
             # remove this router from updated_routers if it is there. It might
             # end up there too if exception was thrown earlier inside
@@ -858,6 +863,7 @@ class RoutingServiceHelper(object):
         except ncc_errors.SessionCloseError as e:
             LOG.exception(_LE("ncclient Unexpected session close %s"
                               " while attempting to remove router"), e)
+            self._dev_status.invalidate_reachability(hd['id'])
             if not self._dev_status.is_hosting_device_reachable(hd):
                 LOG.debug("Lost connectivity to Hosting Device"
                           "%s" % (hd['id']))
@@ -27,10 +27,96 @@ ml2_cisco_opts = [
         help=_("VLAN Name prefix for provider vlans")),
     cfg.BoolOpt('persistent_switch_config', default=False,
                 help=_("To make Nexus configuration persistent")),
+    cfg.IntOpt('switch_config_save_delay', default=0,
+        help=_("With persistent_switch_config, save the Nexus config "
+               "once no change has been made for this many seconds "
+               "instead of after every change. (0=save every change)")),
+    cfg.IntOpt('switch_config_save_max_delay', default=60,
+        help=_("Maximum seconds a Nexus config change is left unsaved "
+               "when switch_config_save_delay is set")),
+    cfg.BoolOpt('batch_switch_config', default=False,
+                help=_("Send multi-command Nexus configuration changes, "
+                       "such as VLAN create and trunk, in a single "
+                       "NETCONF edit_config")),
+    cfg.BoolOpt('cache_trunk_allowed_vlans', default=True,
+                help=_("Remember which Nexus trunk interfaces have "
+                       "'switchport trunk allowed vlan' configured instead "
+                       "of reading the interface before every VLAN add")),
+    cfg.BoolOpt('cache_nexus_bindings', default=False,
+                help=_("Keep an in-process index of the Nexus port "
+                       "bindings and serve binding lookups from it")),
+    cfg.IntOpt('nexus_binding_cache_refresh', default=60,
+        help=_("Seconds after which the Nexus port binding index is "
+               "reloaded from the database")),
     cfg.BoolOpt('never_cache_ssh_connection', default=False,
                 help=_("Prevent caching ssh connections to Nexus device")),
+    cfg.IntOpt('switch_session_pool_size', default=0,
+        help=_("Maximum number of NETCONF sessions this process keeps "
+               "open to each Nexus switch. (0=share the switch session "
+               "limit evenly across api and rpc workers)")),
+    cfg.IntOpt('switch_session_checkout_timeout', default=60,
+        help=_("Seconds a request waits for a NETCONF session to a Nexus "
+               "switch when all sessions of the pool are in use. "
+               "(0=wait indefinitely)")),
+    cfg.IntOpt('switch_session_idle_timeout', default=300,
+        help=_("Seconds an idle NETCONF session to a Nexus switch is kept "
+               "open for reuse. (0=never closed while idle)")),
+    cfg.BoolOpt('switch_session_prewarm', default=False,
+                help=_("Open a NETCONF session to every Nexus switch in "
+                       "the background on the first port event of each "
+                       "neutron-server process, instead of on the first "
+                       "port event for each switch")),
+    cfg.IntOpt('switch_retry_count', default=2,
+        help=_("Number of attempts made for a NETCONF request to a Nexus "
+               "switch before it is failed")),
+    cfg.FloatOpt('switch_retry_interval', default=0.0,
+        help=_("Base delay in seconds before retrying a failed NETCONF "
+               "request. The delay doubles on each further attempt and "
+               "is randomized. (0=retry immediately)")),
+    cfg.FloatOpt('switch_retry_max_interval', default=5.0,
+        help=_("Maximum delay in seconds between NETCONF request "
+               "retries")),
+    cfg.IntOpt('switch_failure_threshold', default=0,
+        help=_("Number of consecutive failed requests after which "
+               "requests to a Nexus switch fail immediately for "
+               "switch_failure_cooldown seconds. (0=disabled)")),
+    cfg.IntOpt('switch_failure_cooldown', default=30,
+        help=_("Seconds requests to a failing Nexus switch are failed "
+               "immediately before the switch is tried again")),
+    cfg.BoolOpt('async_switch_config', default=False,
+                help=_("Record Nexus switch configuration changes of port "
+                       "events in a journal and apply them in the "
+                       "background instead of during the API request. "
+                       "Requires switch_heartbeat_time to be set")),
+    cfg.IntOpt('switch_journal_retries', default=3,
+        help=_("Number of attempts made to apply a journaled Nexus "
+               "configuration change")),
+    cfg.IntOpt('switch_journal_retry_interval', default=5,
+        help=_("Seconds between attempts to apply a journaled Nexus "
+               "configuration change")),
+    cfg.IntOpt('switch_journal_timeout', default=300,
+        help=_("Seconds after which a journaled change being applied by "
+               "another neutron server is taken over")),
     cfg.IntOpt('switch_heartbeat_time', default=0,
         help=_("Periodic time to check switch connection. (0=disabled)")),
+    cfg.BoolOpt('replay_vlan_ranges', default=False,
+                help=_("Replay the VLANs of a reconnected Nexus switch "
+                       "using VLAN range lists rather than one command "
+                       "per port binding")),
+    cfg.BoolOpt('replay_reconcile', default=False,
+                help=_("Compare the running config of a reconnected Nexus "
+                       "switch with the port bindings and only push the "
+                       "missing VLAN, trunk and NVE member config")),
+    cfg.BoolOpt('replay_reconcile_remove_stale', default=False,
+                help=_("When reconciling a reconnected Nexus switch, also "
+                       "remove the VLANs named by this driver, and the NVE "
+                       "members, which no port binding uses")),
+    cfg.BoolOpt('skip_redundant_vlan_create', default=False,
+                help=_("Only create a VLAN on a Nexus switch when the "
+                       "first port binding on the switch starts using it")),
+    cfg.IntOpt('switch_replay_concurrency', default=10,
+        help=_("Maximum number of Nexus switches checked and replayed "
+               "concurrently by the switch heartbeat")),
     cfg.BoolOpt('provider_vlan_auto_create', default=True,
         help=_('Provider VLANs are automatically created as needed '
                'on the Nexus switch')),
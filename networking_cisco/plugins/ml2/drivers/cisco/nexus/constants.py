@@ -20,6 +20,12 @@ CREDENTIAL_PASSWORD = 'password'
 
 USERNAME = 'username'
 PASSWORD = 'password'
+SSH_PORT = 'ssh_port'
+NVE_SRC_INTF = 'nve_src_intf'
+PHYSNET = 'physnet'
+
+# Keywords of a Nexus switch section which are not host names.
+SWITCH_ATTRIBUTES = (SSH_PORT, USERNAME, PASSWORD, NVE_SRC_INTF, PHYSNET)
 
 NETWORK_ADMIN = 'network_admin'
 
@@ -30,6 +36,10 @@ PROVIDER_SEGMENT = 'provider_segment'
 
 NVE_INT_NUM = '1'
 NEXUS_MAX_VLAN_NAME_LEN = 32
+# Longest VLAN range list, e.g. '10-40,55', sent in one command.
+NEXUS_MAX_VLAN_RANGE_LEN = 256
+# Most VLANs named in one edit_config.
+NEXUS_MAX_VLANS_PER_EDIT = 100
 
 NO_DUPLICATE = 0
 DUPLICATE_VLAN = 1
@@ -44,5 +54,12 @@ NEXUS_9K = 9
 MAX_NEXUS_SSH_SESSIONS = 8
 
 REPLAY_FAILURES = '_replay_failures'
+REPLAY_PROGRESS = '_replay_progress'
+PROBE_LATENCY = '_probe_latency'
+SESSION_PREWARM = '_session_prewarm'
 FAIL_CONTACT = '_contact'
 FAIL_CONFIG = '_config'
+
+JOURNAL_PENDING = 'pending'
+JOURNAL_PROCESSING = 'processing'
+JOURNAL_FAILED = 'failed'
@@ -45,6 +45,19 @@ class NexusConfigFailed(exceptions.NeutronException):
                 "XML: %(config)s. Reason: %(exc)s.")
 
 
+class NexusConfigFragmentFailed(NexusConfigFailed):
+    """Failed to configure one fragment of a Nexus config transaction."""
+    message = _("Failed to configure Nexus switch: %(nexus_host)s "
+                "fragment: %(fragment)s XML: %(config)s. Reason: %(exc)s.")
+
+
+class NexusSwitchUnavailable(NexusConfigFailed):
+    """Nexus switch requests are failed fast after repeated failures."""
+    message = _("Nexus switch %(nexus_host)s is unavailable after "
+                "%(failures)s consecutive failed requests. Retrying in "
+                "%(retry_after)d seconds.")
+
+
 class NexusPortBindingNotFound(exceptions.NeutronException):
     """NexusPort Binding is not present."""
     message = _("Nexus Port Binding (%(filters)s) is not present")
@@ -17,13 +17,19 @@
 ML2 Mechanism Driver for Cisco Nexus platforms.
 """
 
+import collections
+import contextlib
+import datetime
 import eventlet
+import functools
 import os
 import threading
+import time
 
 from oslo_concurrency import lockutils
 from oslo_config import cfg
 from oslo_log import log as logging
+from oslo_utils import timeutils
 
 from networking_cisco.plugins.ml2.drivers.cisco.nexus import (
     config as conf)
@@ -54,6 +60,60 @@ HOST_NOT_FOUND = _LW("Host %s not defined in switch configuration section.")
 # database.
 DELAY_MONITOR_THREAD = 30
 
+PORT_LOCK_PREFIX = 'cisco-nexus-portlock-'
+
+# Postcommit operations which can be journaled, with the position of
+# the host_id in their arguments.
+JOURNAL_OPERATIONS = {
+    'configure_host_entries': 2,
+    'delete_switch_entry': 2,
+    'configure_nve_member': 3,
+    'delete_nve_member': 3,
+}
+
+
+@contextlib.contextmanager
+def nexus_locks(lock_names):
+    """Acquire a set of named locks in sorted order.
+
+    Every caller takes its locks in the same (sorted) order so that
+    port events touching overlapping switch resources cannot deadlock.
+    """
+    lock_names = sorted(set(lock_names))
+    if not lock_names:
+        yield
+        return
+    with lockutils.lock(lock_names[0]):
+        with nexus_locks(lock_names[1:]):
+            yield
+
+
+def nexus_port_lock(include_original=False):
+    """Serialize a port event against events using the same switch resources.
+
+    Replaces a single global lock with locks per (switch, interface),
+    (switch, VLAN) and (switch, NVE interface), so events on unrelated
+    switches or interfaces proceed concurrently.
+
+    :param include_original: also lock the resources of the port's
+                             original binding (update events).
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(self, context):
+            lock_names = self._get_port_lock_names(
+                context.current, context.top_bound_segment,
+                context.bottom_bound_segment)
+            if include_original and getattr(context, 'original', None):
+                lock_names |= self._get_port_lock_names(
+                    context.original, context.original_top_bound_segment,
+                    context.original_bottom_bound_segment)
+            self._check_session_prewarm()
+            with nexus_locks(lock_names):
+                return f(self, context)
+        return wrapper
+    return decorator
+
 
 class CiscoNexusCfgMonitor(object):
     """Replay config on communication failure between Openstack to Nexus."""
@@ -82,6 +142,17 @@ class CiscoNexusCfgMonitor(object):
         LOG.debug("Replaying config for switch ip %(switch_ip)s",
                   {'switch_ip': switch_ip})
 
+        # Trunk state is re-read from the switch as it is replayed.
+        self._driver.invalidate_trunk_vlans(switch_ip)
+
+        # Deletes are decided from the VLAN reference counts, so repair
+        # any drift from the bindings before the switch is used again.
+        nxos_db.reconcile_vlan_refs(switch_ip)
+
+        if conf.cfg.CONF.ml2_cisco.replay_reconcile:
+            self._mdriver.reconcile_switch_entries(switch_ip)
+            return
+
         nve_bindings = nxos_db.get_nve_switch_bindings(switch_ip)
 
         for x in nve_bindings:
@@ -110,61 +181,95 @@ class CiscoNexusCfgMonitor(object):
             port_bindings)
 
     def check_connections(self):
-        """Check connection between Openstack to Nexus device."""
+        """Check connection between Openstack to Nexus device.
+
+        Switches are checked and, if needed, replayed concurrently on a
+        bounded pool of green threads so that one slow switch does not
+        hold up the recovery of the others.
+        """
         switch_connections = self._mdriver.get_switch_state()
 
+        pool = eventlet.GreenPool(
+            max(1, conf.cfg.CONF.ml2_cisco.switch_replay_concurrency))
         for switch_ip in switch_connections:
-            state = self._mdriver.get_switch_ip_and_active_state(switch_ip)
-            config_failure = self._mdriver.get_switch_replay_failure(
-                const.FAIL_CONFIG, switch_ip)
-            contact_failure = self._mdriver.get_switch_replay_failure(
-                const.FAIL_CONTACT, switch_ip)
-            LOG.debug("check_connections() switch "
-                      "%(switch_ip)s state %(state)d "
-                      "contact_failure %(contact_failure)d "
-                      "config_failure %(config_failure)d ",
-                      {'switch_ip': switch_ip, 'state': state,
-                       'contact_failure': contact_failure,
-                       'config_failure': config_failure})
-            try:
+            pool.spawn_n(self._check_switch_connection, switch_ip)
+        pool.waitall()
+
+    def _check_switch_connection(self, switch_ip):
+        """Check connection to one Nexus device and replay if restored."""
+        try:
+            self.check_switch_connection(switch_ip)
+        except Exception:
+            LOG.exception(_LE("Unexpected failure checking connection to "
+                              "switch ip %(switch_ip)s"),
+                          {'switch_ip': switch_ip})
+
+    def check_switch_connection(self, switch_ip):
+        """Check one Nexus device and replay its config if reconnected."""
+        state = self._mdriver.get_switch_ip_and_active_state(switch_ip)
+        config_failure = self._mdriver.get_switch_replay_failure(
+            const.FAIL_CONFIG, switch_ip)
+        contact_failure = self._mdriver.get_switch_replay_failure(
+            const.FAIL_CONTACT, switch_ip)
+        LOG.debug("check_connections() switch "
+                  "%(switch_ip)s state %(state)d "
+                  "contact_failure %(contact_failure)d "
+                  "config_failure %(config_failure)d ",
+                  {'switch_ip': switch_ip, 'state': state,
+                   'contact_failure': contact_failure,
+                   'config_failure': config_failure})
+        # The type of an active switch is already known, so a small get
+        # is enough to check it is still reachable.
+        nexus_type = self._mdriver.get_switch_nexus_type(switch_ip)
+        probe_start = time.time()
+        try:
+            if state is True and nexus_type != const.NEXUS_TYPE_INVALID:
+                self._driver.ping(switch_ip)
+            else:
                 nexus_type = self._driver.get_nexus_type(switch_ip)
-            except Exception:
-                if state is True:
-                    LOG.error(_LE("Lost connection to switch ip "
-                        "%(switch_ip)s"), {'switch_ip': switch_ip})
-                    self._mdriver.set_switch_ip_and_active_state(
-                        switch_ip, False)
-                else:
-                    self._mdriver.incr_switch_replay_failure(
-                        const.FAIL_CONTACT, switch_ip)
+        except Exception:
+            if state is True:
+                LOG.error(_LE("Lost connection to switch ip "
+                    "%(switch_ip)s"), {'switch_ip': switch_ip})
+                self._mdriver.set_switch_ip_and_active_state(
+                    switch_ip, False)
             else:
-                if state is False:
-                    self._configure_nexus_type(switch_ip, nexus_type)
-                    LOG.info(_LI("Re-established connection to switch "
+                self._mdriver.incr_switch_replay_failure(
+                    const.FAIL_CONTACT, switch_ip)
+        else:
+            self._mdriver.set_switch_probe_latency(
+                switch_ip, time.time() - probe_start)
+            if state is False:
+                self._configure_nexus_type(switch_ip, nexus_type)
+                LOG.info(_LI("Re-established connection to switch "
+                    "ip %(switch_ip)s"),
+                    {'switch_ip': switch_ip})
+                self._mdriver.set_switch_ip_and_active_state(
+                    switch_ip, True)
+                start_time = time.time()
+                self.replay_config(switch_ip)
+                # If replay failed, it stops trying to configure db entries
+                # and sets switch state to False so this caller knows
+                # it failed.  If it did fail, we increment the
+                # retry counter else reset it to 0.
+                if self._mdriver.get_switch_ip_and_active_state(
+                    switch_ip) is False:
+                    self._mdriver.incr_switch_replay_failure(
+                        const.FAIL_CONFIG, switch_ip)
+                    LOG.warn(_LW("Replay config failed for "
                         "ip %(switch_ip)s"),
                         {'switch_ip': switch_ip})
-                    self._mdriver.set_switch_ip_and_active_state(
-                        switch_ip, True)
-                    self.replay_config(switch_ip)
-                    # If replay failed, it stops trying to configure db entries
-                    # and sets switch state to False so this caller knows
-                    # it failed.  If it did fail, we increment the
-                    # retry counter else reset it to 0.
-                    if self._mdriver.get_switch_ip_and_active_state(
-                        switch_ip) is False:
-                        self._mdriver.incr_switch_replay_failure(
-                            const.FAIL_CONFIG, switch_ip)
-                        LOG.warn(_LW("Replay config failed for "
-                            "ip %(switch_ip)s"),
-                            {'switch_ip': switch_ip})
-                    else:
-                        self._mdriver.reset_switch_replay_failure(
-                            const.FAIL_CONFIG, switch_ip)
-                        self._mdriver.reset_switch_replay_failure(
-                            const.FAIL_CONTACT, switch_ip)
-                        LOG.info(_LI("Replay config successful for "
-                            "ip %(switch_ip)s"),
-                            {'switch_ip': switch_ip})
+                else:
+                    self._mdriver.reset_switch_replay_failure(
+                        const.FAIL_CONFIG, switch_ip)
+                    self._mdriver.reset_switch_replay_failure(
+                        const.FAIL_CONTACT, switch_ip)
+                    LOG.info(_LI("Replay config successful for "
+                        "ip %(switch_ip)s in %(duration).2f seconds"),
+                        {'switch_ip': switch_ip,
+                         'duration': time.time() - start_time})
+                    if nxos_db.retry_failed_journal_entries(switch_ip):
+                        self._mdriver._start_journal_worker(switch_ip)
 
 
 class CiscoNexusMechanismDriver(api.MechanismDriver):
@@ -172,16 +277,35 @@ class CiscoNexusMechanismDriver(api.MechanismDriver):
     """Cisco Nexus ML2 Mechanism Driver."""
 
     def initialize(self):
+        # A journal entry which failed is only retried once the switch
+        # monitor has replayed the switch, so without the monitor the
+        # journal of the switch would stop for good.
+        if (conf.cfg.CONF.ml2_cisco.async_switch_config and
+                conf.cfg.CONF.ml2_cisco.switch_heartbeat_time <= 0):
+            raise cfg.Error(_("Cisco Nexus ML2 driver config: "
+                              "async_switch_config requires "
+                              "switch_heartbeat_time to be set"))
+
         # Create ML2 device dictionary from ml2_conf.ini entries.
         conf.ML2MechCiscoConfig()
 
         # Extract configuration parameters from the configuration file.
         self._nexus_switches = conf.ML2MechCiscoConfig.nexus_dict
         LOG.debug("nexus_switches found = %s", self._nexus_switches)
+        self._build_host_index()
         # Save dynamic switch information
         self._switch_state = {}
 
         self.driver = nexus_network_driver.CiscoNexusDriver()
+        if self.driver.save_scheduler:
+            # Workers exit without running any shutdown hook, so saves
+            # they deferred may be lost.  Save every switch once on start.
+            for switch_ip in self.get_switch_ips():
+                self.driver.save_scheduler.mark_dirty(switch_ip)
+
+        if conf.cfg.CONF.ml2_cisco.cache_nexus_bindings:
+            nxos_db.enable_binding_cache(
+                conf.cfg.CONF.ml2_cisco.nexus_binding_cache_refresh)
 
         # This method is only called once regardless of number of
         # api/rpc workers defined.
@@ -195,8 +319,20 @@ class CiscoNexusMechanismDriver(api.MechanismDriver):
         if self.monitor_timeout > 0:
             eventlet.spawn_after(DELAY_MONITOR_THREAD, self._monitor_thread)
 
+        # Sessions are opened by the process using them, see
+        # _check_session_prewarm.
+        self._prewarm_pid = None
+
+        self._journal_workers = {}
+        if conf.cfg.CONF.ml2_cisco.async_switch_config:
+            eventlet.spawn_after(DELAY_MONITOR_THREAD,
+                                 self._start_journal_workers)
+
     def set_switch_ip_and_active_state(self, switch_ip, state):
         self._switch_state[switch_ip, '_connect_active'] = state
+        if not state:
+            # Switch config may change while unreachable (e.g. reload).
+            self.driver.invalidate_trunk_vlans(switch_ip)
 
     def get_switch_ip_and_active_state(self, switch_ip):
         if (switch_ip, '_connect_active') in self._switch_state:
@@ -243,6 +379,67 @@ class CiscoNexusMechanismDriver(api.MechanismDriver):
         else:
             return 0
 
+    def set_switch_replay_progress(self, switch_ip, done, total):
+        self._switch_state[switch_ip, const.REPLAY_PROGRESS] = (done, total)
+
+    def get_switch_replay_progress(self, switch_ip):
+        """Return (bindings replayed, bindings to replay) for a switch."""
+        return self._switch_state.get((switch_ip, const.REPLAY_PROGRESS),
+                                      (0, 0))
+
+    def set_switch_probe_latency(self, switch_ip, latency):
+        self._switch_state[switch_ip, const.PROBE_LATENCY] = latency
+
+    def get_switch_probe_latency(self, switch_ip):
+        """Return the duration in seconds of the last successful probe."""
+        return self._switch_state.get((switch_ip, const.PROBE_LATENCY))
+
+    def get_switch_prewarm_time(self, switch_ip):
+        """Return the seconds taken to open the first switch session."""
+        return self._switch_state.get((switch_ip, const.SESSION_PREWARM))
+
+    def _prewarm_switch_session(self, switch_ip):
+        try:
+            duration = self.driver.prewarm_session(switch_ip)
+        except Exception as e:
+            LOG.warn(_LW("Failed to open session to switch ip "
+                         "%(switch_ip)s: %(reason)s"),
+                     {'switch_ip': switch_ip, 'reason': e})
+            return
+        self._switch_state[switch_ip, const.SESSION_PREWARM] = duration
+        LOG.debug("Opened session to switch ip %(switch_ip)s in "
+                  "%(duration).2f seconds",
+                  {'switch_ip': switch_ip, 'duration': duration})
+
+    def _check_session_prewarm(self):
+        """Open the switch sessions of this process in the background.
+
+        Sessions and timers do not survive the fork of the api and rpc
+        workers, so each process starts opening its sessions on its first
+        port event rather than at initialize.  Sessions which then stay
+        unused are closed after switch_session_idle_timeout.
+        """
+        if (conf.cfg.CONF.ml2_cisco.switch_session_prewarm and
+                getattr(self, '_prewarm_pid', None) != os.getpid()):
+            self._prewarm_pid = os.getpid()
+            eventlet.spawn_n(self._prewarm_switch_sessions)
+
+    def _prewarm_switch_sessions(self):
+        """Open sessions to all switches concurrently."""
+        switch_ips = self.get_switch_ips()
+        start_time = time.time()
+        pool = eventlet.GreenPool(
+            max(1, conf.cfg.CONF.ml2_cisco.switch_replay_concurrency))
+        for switch_ip in switch_ips:
+            pool.spawn_n(self._prewarm_switch_session, switch_ip)
+        pool.waitall()
+        opened = [switch_ip for switch_ip in switch_ips
+                  if self.get_switch_prewarm_time(switch_ip) is not None]
+        LOG.info(_LI("Opened sessions to %(opened)d of %(total)d Nexus "
+                     "switches in %(duration).2f seconds"),
+                 {'opened': len(opened), 'total': len(switch_ips),
+                  'duration': time.time() - start_time})
+
     def get_switch_state(self):
         switch_connections = []
         for switch_ip, attr in self._switch_state:
@@ -263,35 +460,104 @@ class CiscoNexusMechanismDriver(api.MechanismDriver):
     def _is_status_active(self, port):
         return port['status'] == n_const.PORT_STATUS_ACTIVE
 
+    def _get_port_lock_names(self, port, top_segment, bottom_segment):
+        """Return the names of the locks covering a port's switch config."""
+        vlan_ids = set()
+        has_vni = False
+        for segment in (top_segment, bottom_segment):
+            if not segment:
+                continue
+            if self._is_segment_nexus_vxlan(segment):
+                has_vni = True
+            else:
+                vlan_ids.add(segment.get(api.SEGMENTATION_ID))
+        return self._get_lock_names(port.get(portbindings.HOST_ID),
+                                    vlan_ids, has_vni)
+
+    def _get_lock_names(self, host_id, vlan_ids, has_vni, switch_ip=None):
+        """Return the names of the locks covering a host's switch config.
+
+        :param switch_ip: only the locks of this switch if not None
+        """
+        lock_names = set()
+        host_connections = self._filter_connections(
+            self._get_host_connections(host_id), switch_ip)
+        for switch_ip, intf_type, nexus_port in host_connections:
+            lock_names.add('%sport-%s-%s:%s' % (
+                PORT_LOCK_PREFIX, switch_ip, intf_type, nexus_port))
+            for vlan_id in vlan_ids:
+                lock_names.add('%svlan-%s-%s' % (
+                    PORT_LOCK_PREFIX, switch_ip, vlan_id))
+            if has_vni:
+                lock_names.add('%snve-%s' % (PORT_LOCK_PREFIX, switch_ip))
+        return lock_names
+
     def _get_switch_info(self, host_id):
-        host_connections = []
-        for switch_ip, attr in self._nexus_switches:
-            if str(attr) == str(host_id):
-                for port_id in (
-                    self._nexus_switches[switch_ip, attr].split(',')):
-                    if ':' in port_id:
-                        intf_type, port = port_id.split(':')
-                    else:
-                        intf_type, port = 'ethernet', port_id
-                    host_connections.append((switch_ip, intf_type, port))
+        host_connections = self._get_host_connections(host_id)
 
         if not host_connections:
             LOG.warn(HOST_NOT_FOUND, host_id)
 
         return host_connections
 
+    def _build_host_index(self):
+        """Index the switch configuration by host and by switch.
+
+        Port events look up the connections of a host, so the
+        (switch_ip, attribute) keyed switch configuration is inverted
+        once instead of being scanned on every event.
+        """
+        host_index = collections.defaultdict(list)
+        switch_hosts = collections.defaultdict(list)
+        switch_ips = []
+        for (switch_ip, attr), value in self._nexus_switches.items():
+            if str(attr) == const.USERNAME:
+                switch_ips.append(switch_ip)
+            # Only host entries map to switch ports; switch attributes
+            # such as the password may contain any character.
+            if (str(attr) in const.SWITCH_ATTRIBUTES or
+                    not isinstance(value, basestring)):
+                continue
+            connections = host_index[str(attr)]
+            for port_id in value.split(','):
+                if ':' in port_id:
+                    intf_type, port = port_id.split(':')
+                else:
+                    intf_type, port = 'ethernet', port_id
+                connections.append((switch_ip, intf_type, port))
+            switch_hosts[switch_ip].append(str(attr))
+
+        self._host_index = dict(host_index)
+        self._switch_hosts = dict(switch_hosts)
+        self._switch_ips = switch_ips
+        self._host_index_source = (self._nexus_switches,
+                                   len(self._nexus_switches))
+
+    def _check_host_index(self):
+        # Rebuild if the switch configuration was replaced or extended.
+        if (getattr(self, '_host_index_source', None) !=
+                (self._nexus_switches, len(self._nexus_switches))):
+            self._build_host_index()
+
+    def _get_host_connections(self, host_id):
+        self._check_host_index()
+        return list(self._host_index.get(str(host_id), []))
+
     def get_switch_ips(self):
-        switch_connections = []
-        for switch_ip, attr in self._nexus_switches:
-            if str(attr) == 'username':
-                switch_connections.append(switch_ip)
+        self._check_host_index()
+        return list(self._switch_ips)
 
-        return switch_connections
+    def get_switch_hosts(self, switch_ip):
+        """Return the hosts connected to a Nexus switch."""
+        self._check_host_index()
+        return list(self._switch_hosts.get(switch_ip, []))
 
     def _get_switch_nve_info(self, host_id):
+        self._check_host_index()
         host_nve_connections = []
-        for switch_ip, attr in self._nexus_switches:
-            if str(attr) == str(host_id):
+        for switch_ip, intf_type, port in self._host_index.get(
+                str(host_id), []):
+            if switch_ip not in host_nve_connections:
                 host_nve_connections.append(switch_ip)
 
         if not host_nve_connections:
@@ -299,24 +565,148 @@ class CiscoNexusMechanismDriver(api.MechanismDriver):
 
         return host_nve_connections
 
+    def _filter_switches(self, switch_ips, switch_ip):
+        if switch_ip is None:
+            return switch_ips
+        return [ip for ip in switch_ips if ip == switch_ip]
+
+    def _filter_connections(self, host_connections, switch_ip):
+        if switch_ip is None:
+            return host_connections
+        return [connection for connection in host_connections
+                if connection[0] == switch_ip]
+
+    def _postcommit_action(self, operation):
+        """Return the function performing a postcommit switch operation.
+
+        In asynchronous mode the operation is recorded in the switch config
+        journal, one entry per switch of the host, and performed later by
+        the switch's journal worker.
+        """
+        func = getattr(self, '_' + operation)
+        if not conf.cfg.CONF.ml2_cisco.async_switch_config:
+            return func
+
+        def enqueue(*args):
+            host_id = args[JOURNAL_OPERATIONS[operation]]
+            switch_ips = []
+            for switch_ip, intf_type, port in self._get_switch_info(host_id):
+                if switch_ip not in switch_ips:
+                    switch_ips.append(switch_ip)
+            if switch_ips:
+                nxos_db.add_journal_entries(operation, switch_ips, args)
+                for switch_ip in switch_ips:
+                    self._start_journal_worker(switch_ip)
+        return enqueue
+
+    def _start_journal_worker(self, switch_ip):
+        if switch_ip not in self._journal_workers:
+            self._journal_workers[switch_ip] = eventlet.spawn(
+                self._run_journal, switch_ip)
+
+    def _start_journal_workers(self):
+        """Resume the journal left unfinished by a previous run."""
+        for switch_ip in nxos_db.get_journal_switches():
+            self._start_journal_worker(switch_ip)
+
+    def _run_journal(self, switch_ip):
+        """Perform the journaled operations of a switch in order."""
+        try:
+            while self._process_journal_entry(switch_ip):
+                pass
+        except Exception:
+            LOG.exception(_LE("Journal worker of switch %(switch_ip)s "
+                              "failed"), {'switch_ip': switch_ip})
+            return
+        finally:
+            self._journal_workers.pop(switch_ip, None)
+        # An entry added after the last check found no worker to pick it
+        # up before this one was unregistered.
+        entry = nxos_db.get_next_journal_entry(switch_ip)
+        if entry is not None and entry.state != const.JOURNAL_FAILED:
+            self._start_journal_worker(switch_ip)
+
+    def _get_journal_lock_names(self, switch_ip, operation, args):
+        """Return the port locks covering a journaled operation."""
+        host_id = args[JOURNAL_OPERATIONS[operation]]
+        if operation in ('configure_nve_member', 'delete_nve_member'):
+            return self._get_lock_names(host_id, set(), True, switch_ip)
+        vlan_id, vni = args[0], args[3]
+        return self._get_lock_names(host_id, set([vlan_id]), bool(vni),
+                                    switch_ip)
+
+    def _process_journal_entry(self, switch_ip):
+        """Perform the oldest journaled operation of a switch.
+
+        A failed entry blocks the entries after it, so that the switch
+        never gets them out of order, until the switch config has been
+        replayed.
+
+        :return: False once the switch has no more entries it can perform
+        """
+        ml2_cisco = conf.cfg.CONF.ml2_cisco
+        entry = nxos_db.get_next_journal_entry(switch_ip)
+        if entry is None or entry.state == const.JOURNAL_FAILED:
+            return False
+
+        # Entries of a switch are performed strictly in order, also across
+        # neutron servers, so wait while another server works on one.
+        stale_before = timeutils.utcnow() - datetime.timedelta(
+            seconds=ml2_cisco.switch_journal_timeout)
+        if not nxos_db.claim_journal_entry(entry, stale_before):
+            eventlet.sleep(ml2_cisco.switch_journal_retry_interval)
+            return True
+
+        args = nxos_db.get_journal_args(entry)
+        try:
+            with nexus_locks(self._get_journal_lock_names(
+                    switch_ip, entry.operation, args)):
+                getattr(self, '_' + entry.operation)(*args,
+                                                     switch_ip=switch_ip)
+        except Exception as e:
+            if nxos_db.fail_journal_entry(entry, unicode(e),
+                                          ml2_cisco.switch_journal_retries):
+                LOG.error(_LE("Giving up journaled %(operation)s%(args)s "
+                              "on switch %(switch_ip)s until its config "
+                              "is replayed. Reason: %(reason)s"),
+                          {'operation': entry.operation, 'args': args,
+                           'switch_ip': switch_ip, 'reason': e})
+                # The replay restores the switch config from the database
+                # and then retries the failed entry.
+                self.set_switch_ip_and_active_state(switch_ip, False)
+                return False
+            eventlet.sleep(ml2_cisco.switch_journal_retry_interval)
+        else:
+            nxos_db.complete_journal_entry(entry)
+        return True
+
+    def get_journal_status(self):
+        """Return the journal entry count per switch and state."""
+        return nxos_db.get_journal_summary()
+
     def _configure_nve_db(self, vni, device_id, mcast_group, host_id):
         """Create the nexus NVE database entry.
 
         Called during update precommit port event.
         """
         host_nve_connections = self._get_switch_nve_info(host_id)
-        for switch_ip in host_nve_connections:
-            if not nxos_db.get_nve_vni_member_bindings(vni, switch_ip,
-                                                       device_id):
-                nxos_db.add_nexusnve_binding(vni, switch_ip, device_id,
-                                             mcast_group)
-
-    def _configure_nve_member(self, vni, device_id, mcast_group, host_id):
+        switch_ips = [switch_ip for switch_ip in host_nve_connections
+                      if not nxos_db.get_nve_vni_member_bindings(
+                          vni, switch_ip, device_id)]
+        if switch_ips:
+            nxos_db.add_nexusnve_bindings(vni, switch_ips, device_id,
+                                          mcast_group)
+
+    def _configure_nve_member(self, vni, device_id, mcast_group, host_id,
+                              switch_ip=None):
         """Add "member vni" configuration to the NVE interface.
 
         Called during update postcommit port event.
+
+        :param switch_ip: only configure this switch of the host
         """
-        host_nve_connections = self._get_switch_nve_info(host_id)
+        host_nve_connections = self._filter_switches(
+            self._get_switch_nve_info(host_id), switch_ip)
 
         for switch_ip in host_nve_connections:
 
@@ -346,16 +736,18 @@ class CiscoNexusMechanismDriver(api.MechanismDriver):
 
         Called during delete precommit port event.
         """
-        rows = nxos_db.get_nve_vni_deviceid_bindings(vni, device_id)
-        for row in rows:
-            nxos_db.remove_nexusnve_binding(vni, row.switch_ip, device_id)
+        nxos_db.remove_nexusnve_bindings(vni, device_id)
 
-    def _delete_nve_member(self, vni, device_id, mcast_group, host_id):
+    def _delete_nve_member(self, vni, device_id, mcast_group, host_id,
+                           switch_ip=None):
         """Remove "member vni" configuration from the NVE interface.
 
         Called during delete postcommit port event.
+
+        :param switch_ip: only configure this switch of the host
         """
-        host_nve_connections = self._get_switch_nve_info(host_id)
+        host_nve_connections = self._filter_switches(
+            self._get_switch_nve_info(host_id), switch_ip)
         for switch_ip in host_nve_connections:
             if not nxos_db.get_nve_vni_switch_bindings(vni, switch_ip):
                 self.driver.delete_nve_member(switch_ip,
@@ -371,26 +763,24 @@ class CiscoNexusMechanismDriver(api.MechanismDriver):
         Called during update precommit port event.
         """
         host_connections = self._get_switch_info(host_id)
+        new_bindings = []
         for switch_ip, intf_type, nexus_port in host_connections:
             port_id = '%s:%s' % (intf_type, nexus_port)
             try:
                 nxos_db.get_nexusport_binding(port_id, vlan_id, switch_ip,
                                               device_id)
             except excep.NexusPortBindingNotFound:
-                nxos_db.add_nexusport_binding(port_id, str(vlan_id), str(vni),
-                                              switch_ip, device_id,
-                                              is_provider_vlan)
-
-    def _configure_port_binding(self, is_provider_vlan, duplicate_type,
-                                switch_ip, vlan_id,
-                                intf_type, nexus_port, vni):
-        """Conditionally calls vlan and port Nexus drivers."""
-
-        # This implies VLAN, VNI, and Port are all duplicate.
-        # Then there is nothing to configure in Nexus.
-        if duplicate_type == const.DUPLICATE_PORT:
-            return
-
+                new_bindings.append({'port_id': port_id,
+                                     'vlan_id': str(vlan_id),
+                                     'vni': str(vni),
+                                     'switch_ip': switch_ip,
+                                     'instance_id': device_id,
+                                     'is_provider_vlan': is_provider_vlan})
+        if new_bindings:
+            nxos_db.add_nexusport_bindings(new_bindings)
+
+    def _get_vlan_settings(self, vlan_id, is_provider_vlan):
+        """Return the VLAN name and whether to create and trunk the VLAN."""
         if is_provider_vlan:
             vlan_name = cfg.CONF.ml2_cisco.provider_vlan_name_prefix
             auto_create = cfg.CONF.ml2_cisco.provider_vlan_auto_create
@@ -403,7 +793,20 @@ class CiscoNexusMechanismDriver(api.MechanismDriver):
         if len(vlan_name) > vlan_name_max_len:
             vlan_name = vlan_name[:vlan_name_max_len]
             LOG.warn(_LW("Nexus: truncating vlan name to %s"), vlan_name)
-        vlan_name = vlan_name + str(vlan_id)
+        return vlan_name + str(vlan_id), auto_create, auto_trunk
+
+    def _configure_port_binding(self, is_provider_vlan, duplicate_type,
+                                switch_ip, vlan_id,
+                                intf_type, nexus_port, vni):
+        """Conditionally calls vlan and port Nexus drivers."""
+
+        # This implies VLAN, VNI, and Port are all duplicate.
+        # Then there is nothing to configure in Nexus.
+        if duplicate_type == const.DUPLICATE_PORT:
+            return
+
+        vlan_name, auto_create, auto_trunk = self._get_vlan_settings(
+            vlan_id, is_provider_vlan)
 
         # if type DUPLICATE_VLAN, don't create vlan
         if duplicate_type == const.DUPLICATE_VLAN:
@@ -423,15 +826,25 @@ class CiscoNexusMechanismDriver(api.MechanismDriver):
                 intf_type, nexus_port)
 
     def _configure_host_entries(self, vlan_id, device_id, host_id, vni,
-                                is_provider_vlan):
+                                is_provider_vlan, switch_ip=None):
         """Create a nexus switch entry.
 
         if needed, create a VLAN in the appropriate switch or port and
         configure the appropriate interfaces for this VLAN.
 
         Called during update postcommit port event.
+
+        :param switch_ip: only configure this switch of the host
         """
-        host_connections = self._get_switch_info(host_id)
+        all_connections = self._get_switch_info(host_id)
+        host_connections = self._filter_connections(all_connections,
+                                                    switch_ip)
+        skip_redundant = cfg.CONF.ml2_cisco.skip_redundant_vlan_create
+
+        # The bindings of this device were added by the precommit event:
+        # one per host connection.
+        own_bindings = collections.Counter(
+            connection[0] for connection in all_connections)
 
         # (nexus_port,switch_ip) will be unique in each iteration.
         # But switch_ip will repeat if host has >1 connection to same switch.
@@ -441,19 +854,24 @@ class CiscoNexusMechanismDriver(api.MechanismDriver):
 
             # The VLAN needs to be created on the switch if no other
             # instance has been placed in this VLAN on a different host
-            # attached to this switch.  Search the existing bindings in the
-            # database.  If all the instance_id in the database match the
-            # current device_id, then create the VLAN, but only once per
-            # switch_ip.  Otherwise, just trunk.
-            all_bindings = nxos_db.get_nexusvlan_binding(vlan_id, switch_ip)
-            previous_bindings = [row for row in all_bindings
-                    if row.instance_id != device_id]
-            duplicate_port = [row for row in all_bindings
-                    if row.instance_id != device_id and
-                    row.port_id == intf_type + ':' + nexus_port]
-            if duplicate_port:
+            # attached to this switch.  The VLAN reference counts kept
+            # with the bindings tell whether other instances use the VLAN
+            # on this switch or on this switch interface.
+            port_id = '%s:%s' % (intf_type, nexus_port)
+            port_refs = nxos_db.get_vlan_ref_count(switch_ip, vlan_id,
+                                                   port_id)
+            if port_refs > 1:
                 duplicate_type = const.DUPLICATE_PORT
-            elif previous_bindings and (switch_ip in vlan_already_created):
+            elif skip_redundant and (
+                    switch_ip in vlan_already_created or
+                    nxos_db.get_vlan_ref_owner(switch_ip,
+                                               vlan_id) != device_id):
+                # Only the instance whose binding took the first
+                # reference to the VLAN on this switch creates it.
+                duplicate_type = const.DUPLICATE_VLAN
+            elif (switch_ip in vlan_already_created and
+                  nxos_db.get_vlan_ref_count(switch_ip, vlan_id) >
+                  own_bindings[switch_ip]):
                 duplicate_type = const.DUPLICATE_VLAN
             else:
                 vlan_already_created.append(switch_ip)
@@ -475,11 +893,17 @@ class CiscoNexusMechanismDriver(api.MechanismDriver):
 
         Called during switch replay event.
         """
+        if conf.cfg.CONF.ml2_cisco.replay_vlan_ranges:
+            self._configure_switch_vlan_ranges(switch_ip, port_bindings)
+            return
+
         prev_vlan = -1
         prev_vni = -1
         prev_port = None
         port_bindings.sort(key=lambda x: (x.vlan_id, x.vni, x.port_id))
-        for port in port_bindings:
+        total = len(port_bindings)
+        self.set_switch_replay_progress(switch_ip, 0, total)
+        for done, port in enumerate(port_bindings, 1):
             if ':' in port.port_id:
                 intf_type, nexus_port = port.port_id.split(':')
             else:
@@ -512,6 +936,206 @@ class CiscoNexusMechanismDriver(api.MechanismDriver):
             prev_vlan = port.vlan_id
             prev_vni = port.vni
             prev_port = port.port_id
+            self.set_switch_replay_progress(switch_ip, done, total)
+
+    def _get_switch_vlan_config(self, port_bindings):
+        """Return the VLAN and trunk config needed by port bindings.
+
+        :returns: ({vlan_id: vlan_name} of the VLANs to create,
+                   {vlan_id: (vlan_name, vni)} of the VN segment VLANs
+                   to create,
+                   {(intf_type, nexus_port): set of trunked vlan_ids})
+        """
+        vlans = {}
+        vni_vlans = {}
+        trunks = collections.OrderedDict()
+        for port in sorted(port_bindings,
+                           key=lambda x: (x.port_id, x.vlan_id)):
+            vlan_name, auto_create, auto_trunk = self._get_vlan_settings(
+                port.vlan_id, port.is_provider_vlan)
+            if auto_create:
+                if port.vni:
+                    vni_vlans[port.vlan_id] = (vlan_name, port.vni)
+                else:
+                    vlans[port.vlan_id] = vlan_name
+            if auto_trunk:
+                if ':' in port.port_id:
+                    intf_type, nexus_port = port.port_id.split(':')
+                else:
+                    intf_type, nexus_port = 'ethernet', port.port_id
+                trunks.setdefault((intf_type, nexus_port), set()).add(
+                    port.vlan_id)
+        return vlans, vni_vlans, trunks
+
+    def _is_owned_vlan(self, vlan_id, vlan_name):
+        """Check whether a switch VLAN has a name given by this driver."""
+        return vlan_name in (self._get_vlan_settings(vlan_id, False)[0],
+                             self._get_vlan_settings(vlan_id, True)[0])
+
+    def _get_switch_host_interfaces(self, switch_ip):
+        """Return the (intf_type, port) of a switch connected to hosts."""
+        return set((intf_type, nexus_port)
+                   for host_id in self.get_switch_hosts(switch_ip)
+                   for host_switch_ip, intf_type, nexus_port in
+                   self._get_host_connections(host_id)
+                   if host_switch_ip == switch_ip)
+
+    def reconcile_switch_entries(self, switch_ip):
+        """Push only the config a reconnected switch is missing.
+
+        The VLAN, trunk and NVE member config of the switch is read in a
+        few requests and compared with the database bindings.  With
+        replay_reconcile_remove_stale, VLANs named by this driver which
+        no binding uses any more are removed from the trunks of the host
+        interfaces and deleted, as are NVE members without binding when
+        the driver owns the NVE interface.
+
+        The switch is read before the bindings.  The binding of a port is
+        committed before its config is pushed, so config found on the
+        switch is never removed for a binding which is not visible yet,
+        and the VLAN reference counts are checked again before each
+        removal for bindings added meanwhile.
+
+        Called during switch replay event.
+        """
+        remove_stale = conf.cfg.CONF.ml2_cisco.replay_reconcile_remove_stale
+        remove_members = (remove_stale and
+                          cfg.CONF.ml2_cisco.vxlan_global_config)
+        added = removed = 0
+        try:
+            members = set()
+            if remove_members:
+                members = self.driver.get_nve_members(switch_ip,
+                                                      const.NVE_INT_NUM)
+            switch_vlans = self.driver.get_switch_vlans(switch_ip)
+            # Interfaces are named like port-channel2 in the running
+            # config and portchannel:2 in the host mapping.
+            switch_trunks = dict(
+                ((intf_type.replace('-', ''), nexus_port), vlan_ids)
+                for (intf_type, nexus_port), vlan_ids in
+                self.driver.get_switch_trunk_vlans(switch_ip).items())
+
+            nve_bindings = nxos_db.get_nve_switch_bindings(switch_ip) or []
+            try:
+                port_bindings = nxos_db.get_nexusport_switch_bindings(
+                    switch_ip)
+            except excep.NexusPortBindingNotFound:
+                port_bindings = []
+            vlans, vni_vlans, trunks = self._get_switch_vlan_config(
+                port_bindings)
+            total = len(port_bindings) + len(nve_bindings)
+            self.set_switch_replay_progress(switch_ip, 0, total)
+
+            if nve_bindings and not remove_members:
+                members = self.driver.get_nve_members(switch_ip,
+                                                      const.NVE_INT_NUM)
+            nve_vnis = {}
+            for binding in nve_bindings:
+                nve_vnis.setdefault(binding.vni, binding.mcast_group)
+            for vni, mcast_group in sorted(nve_vnis.items()):
+                if vni not in members:
+                    self.driver.create_nve_member(switch_ip,
+                        const.NVE_INT_NUM, vni, mcast_group)
+                    added += 1
+
+            for vlan_id, (vlan_name, vni) in sorted(vni_vlans.items()):
+                if vlan_id not in switch_vlans:
+                    self.driver.create_vlan(switch_ip, vlan_id, vlan_name,
+                                            vni)
+                    added += 1
+            missing_vlans = sorted((vlan_id, vlan_name)
+                                   for vlan_id, vlan_name in vlans.items()
+                                   if vlan_id not in switch_vlans)
+            if missing_vlans:
+                self.driver.create_vlans(switch_ip, missing_vlans)
+                added += len(missing_vlans)
+            for (intf_type, nexus_port), vlan_ids in trunks.items():
+                missing = vlan_ids - switch_trunks.get(
+                    (intf_type, nexus_port), set())
+                for vlan_range in nexus_network_driver.format_vlan_ranges(
+                        missing):
+                    self.driver.enable_vlan_on_trunk_int(
+                        switch_ip, vlan_range, intf_type, nexus_port)
+                added += len(missing)
+
+            if remove_stale:
+                bound_vlans = set(port.vlan_id for port in port_bindings)
+                owned_vlans = set(
+                    vlan_id for vlan_id, vlan_name in switch_vlans.items()
+                    if self._is_owned_vlan(vlan_id, vlan_name))
+                # Uplinks and peer-links are never bound to a port, so
+                # only the trunks of the host interfaces are cleaned up.
+                host_interfaces = self._get_switch_host_interfaces(
+                    switch_ip)
+                for (intf_type, nexus_port), vlan_ids in sorted(
+                        switch_trunks.items()):
+                    if (intf_type, nexus_port) not in host_interfaces:
+                        continue
+                    port_id = '%s:%s' % (intf_type, nexus_port)
+                    stale = set(
+                        vlan_id for vlan_id in (vlan_ids & owned_vlans) -
+                        trunks.get((intf_type, nexus_port), set())
+                        if not nxos_db.get_vlan_ref_count(
+                            switch_ip, vlan_id, port_id))
+                    for vlan_range in (
+                            nexus_network_driver.format_vlan_ranges(stale)):
+                        self.driver.disable_vlan_on_trunk_int(
+                            switch_ip, vlan_range, intf_type, nexus_port)
+                    removed += len(stale)
+                for vlan_id in sorted(owned_vlans - bound_vlans):
+                    # Recheck for a binding added since they were read.
+                    if nxos_db.get_vlan_ref_count(switch_ip, vlan_id):
+                        continue
+                    self.driver.delete_vlan(switch_ip, vlan_id)
+                    removed += 1
+                if remove_members:
+                    for vni in sorted(members - set(nve_vnis)):
+                        self.driver.delete_nve_member(switch_ip,
+                            const.NVE_INT_NUM, vni)
+                        removed += 1
+        except Exception as e:
+            self.register_switch_as_inactive(
+                switch_ip, 'replay reconcile_switch_entries')
+            LOG.error(_LE("Failed to reconcile config of switch "
+                "%(switch_ip)s, reason %(reason)s"),
+                {'switch_ip': switch_ip, 'reason': e})
+            return
+        self.set_switch_replay_progress(switch_ip, total, total)
+        LOG.info(_LI("Reconciled config of switch %(switch_ip)s: "
+                     "%(added)d items added, %(removed)d removed"),
+                 {'switch_ip': switch_ip, 'added': added,
+                  'removed': removed})
+
+    def _configure_switch_vlan_ranges(self, switch_ip, port_bindings):
+        """Replay the port bindings of a switch using VLAN ranges.
+
+        VLANs without VN segment are created in batches and each
+        interface gets its VLANs in one trunk command per range list,
+        instead of one command per binding.
+        """
+        vlans, vni_vlans, trunks = self._get_switch_vlan_config(
+            port_bindings)
+
+        total = len(port_bindings)
+        self.set_switch_replay_progress(switch_ip, 0, total)
+        try:
+            for vlan_id, (vlan_name, vni) in sorted(vni_vlans.items()):
+                self.driver.create_vlan(switch_ip, vlan_id, vlan_name, vni)
+            if vlans:
+                self.driver.create_vlans(switch_ip, sorted(vlans.items()))
+            for (intf_type, nexus_port), vlan_ids in trunks.items():
+                for vlan_range in nexus_network_driver.format_vlan_ranges(
+                        vlan_ids):
+                    self.driver.enable_vlan_on_trunk_int(
+                        switch_ip, vlan_range, intf_type, nexus_port)
+        except Exception as e:
+            self.register_switch_as_inactive(
+                switch_ip, 'replay _configure_switch_vlan_ranges')
+            LOG.error(_LE("Failed to replay VLAN ranges for switch "
+                "%(switch_ip)s, reason %(reason)s"),
+                {'switch_ip': switch_ip, 'reason': e})
+            return
+        self.set_switch_replay_progress(switch_ip, total, total)
 
     def _delete_nxos_db(self, vlan_id, device_id, host_id, vni,
                         is_provider_vlan):
@@ -521,23 +1145,23 @@ class CiscoNexusMechanismDriver(api.MechanismDriver):
         """
         try:
             rows = nxos_db.get_nexusvm_bindings(vlan_id, device_id)
-            for row in rows:
-                nxos_db.remove_nexusport_binding(row.port_id, row.vlan_id,
-                                    row.vni, row.switch_ip, row.instance_id,
-                                    row.is_provider_vlan)
         except excep.NexusPortBindingNotFound:
             return
+        nxos_db.remove_nexusport_bindings(rows)
 
     def _delete_switch_entry(self, vlan_id, device_id, host_id, vni,
-                             is_provider_vlan):
+                             is_provider_vlan, switch_ip=None):
         """Delete the nexus switch entry.
 
         By accessing the current db entries determine if switch
         configuration can be removed.
 
         Called during delete postcommit port event.
+
+        :param switch_ip: only configure this switch of the host
         """
-        host_connections = self._get_switch_info(host_id)
+        host_connections = self._filter_connections(
+            self._get_switch_info(host_id), switch_ip)
 
         # (nexus_port,switch_ip) will be unique in each iteration.
         # But switch_ip will repeat if host has >1 connection to same switch.
@@ -554,12 +1178,7 @@ class CiscoNexusMechanismDriver(api.MechanismDriver):
                 auto_create = cfg.CONF.ml2_cisco.provider_vlan_auto_create
                 auto_trunk = cfg.CONF.ml2_cisco.provider_vlan_auto_trunk
 
-            try:
-                nxos_db.get_port_vlan_switch_binding(port_id, vlan_id,
-                                                     switch_ip)
-            except excep.NexusPortBindingNotFound:
-                pass
-            else:
+            if nxos_db.get_vlan_ref_count(switch_ip, vlan_id, port_id):
                 continue
 
             if auto_trunk:
@@ -568,14 +1187,12 @@ class CiscoNexusMechanismDriver(api.MechanismDriver):
 
             # if there are no remaining db entries using this vlan on this
             # nexus switch then remove the vlan.
-            if auto_create:
-                try:
-                    nxos_db.get_nexusvlan_binding(vlan_id, switch_ip)
-                except excep.NexusPortBindingNotFound:
-                    # Do not perform a second time on same switch
-                    if switch_ip not in vlan_already_removed:
-                        self.driver.delete_vlan(switch_ip, vlan_id)
-                        vlan_already_removed.append(switch_ip)
+            if (auto_create and
+                not nxos_db.get_vlan_ref_count(switch_ip, vlan_id) and
+                # Do not perform a second time on same switch
+                switch_ip not in vlan_already_removed):
+                self.driver.delete_vlan(switch_ip, vlan_id)
+                vlan_already_removed.append(switch_ip)
 
     def _is_segment_nexus_vxlan(self, segment):
         return segment[api.NETWORK_TYPE] == const.TYPE_NEXUS_VXLAN
@@ -677,7 +1294,7 @@ class CiscoNexusMechanismDriver(api.MechanismDriver):
             self.timer.cancel()
             self.timer = None
 
-    @lockutils.synchronized('cisco-nexus-portlock')
+    @nexus_port_lock()
     def create_port_postcommit(self, context):
         """Create port non-database commit event."""
 
@@ -694,7 +1311,7 @@ class CiscoNexusMechanismDriver(api.MechanismDriver):
                     self.driver.get_nexus_type(switch_ip)
                     verified.append(switch_ip)
 
-    @lockutils.synchronized('cisco-nexus-portlock')
+    @nexus_port_lock(include_original=True)
     def update_port_precommit(self, context):
         """Update port pre-database transaction commit event."""
         vlan_segment, vxlan_segment = self._get_segments(
@@ -719,7 +1336,7 @@ class CiscoNexusMechanismDriver(api.MechanismDriver):
                 self._port_action_vlan(context.current, vlan_segment,
                                        self._configure_nxos_db, vni)
 
-    @lockutils.synchronized('cisco-nexus-portlock')
+    @nexus_port_lock(include_original=True)
     def update_port_postcommit(self, context):
         """Update port non-database commit event."""
         vlan_segment, vxlan_segment = self._get_segments(
@@ -732,19 +1349,23 @@ class CiscoNexusMechanismDriver(api.MechanismDriver):
         # if VM migration is occurring then remove previous nexus switch entry
         # else process update event.
         if self._is_vm_migrating(context, vlan_segment, orig_vlan_segment):
+            delete_nve_member = self._postcommit_action('delete_nve_member')
             vni = self._port_action_vxlan(context.original, orig_vxlan_segment,
-                        self._delete_nve_member) if orig_vxlan_segment else 0
+                        delete_nve_member) if orig_vxlan_segment else 0
             self._port_action_vlan(context.original, orig_vlan_segment,
-                                   self._delete_switch_entry, vni)
+                        self._postcommit_action('delete_switch_entry'), vni)
         else:
             if (self._is_supported_deviceowner(context.current) and
                 self._is_status_active(context.current)):
+                configure_nve_member = self._postcommit_action(
+                    'configure_nve_member')
                 vni = self._port_action_vxlan(context.current, vxlan_segment,
-                            self._configure_nve_member) if vxlan_segment else 0
+                            configure_nve_member) if vxlan_segment else 0
                 self._port_action_vlan(context.current, vlan_segment,
-                                       self._configure_host_entries, vni)
+                        self._postcommit_action('configure_host_entries'),
+                        vni)
 
-    @lockutils.synchronized('cisco-nexus-portlock')
+    @nexus_port_lock()
     def delete_port_precommit(self, context):
         """Delete port pre-database commit event."""
         if self._is_supported_deviceowner(context.current):
@@ -756,17 +1377,18 @@ class CiscoNexusMechanismDriver(api.MechanismDriver):
             self._port_action_vlan(context.current, vlan_segment,
                                    self._delete_nxos_db, vni)
 
-    @lockutils.synchronized('cisco-nexus-portlock')
+    @nexus_port_lock()
     def delete_port_postcommit(self, context):
         """Delete port non-database commit event."""
         if self._is_supported_deviceowner(context.current):
             vlan_segment, vxlan_segment = self._get_segments(
                                                 context.top_bound_segment,
                                                 context.bottom_bound_segment)
+            delete_nve_member = self._postcommit_action('delete_nve_member')
             vni = self._port_action_vxlan(context.current, vxlan_segment,
-                             self._delete_nve_member) if vxlan_segment else 0
+                             delete_nve_member) if vxlan_segment else 0
             self._port_action_vlan(context.current, vlan_segment,
-                                   self._delete_switch_entry, vni)
+                        self._postcommit_action('delete_switch_entry'), vni)
 
     def bind_port(self, context):
         LOG.debug("Attempting to bind port %(port)s on network %(network)s",
@@ -14,12 +14,21 @@
 #    under the License.
 #
 
+import collections
+import time
+
+from oslo_db import exception as db_exc
 from oslo_log import log as logging
+from oslo_serialization import jsonutils
+from oslo_utils import timeutils
+import sqlalchemy as sa
 import sqlalchemy.orm.exc as sa_exc
 
 import neutron.db.api as db
 from neutron.i18n import _LW
 
+from networking_cisco.plugins.ml2.drivers.cisco.nexus import (
+    constants as const)
 from networking_cisco.plugins.ml2.drivers.cisco.nexus import (
     exceptions as c_exc)
 from networking_cisco.plugins.ml2.drivers.cisco.nexus import (
@@ -27,11 +36,121 @@ from networking_cisco.plugins.ml2.drivers.cisco.nexus import (
 
 LOG = logging.getLogger(__name__)
 
+# Optional in-process index of NexusPortBinding rows.
+_binding_cache = None
+
+
+class NexusBindingCache(object):
+    """In-process index of Nexus port bindings.
+
+    Rows are indexed by switch, VLAN, port and instance so the lookups
+    on the port create/delete path do not need a database query.  The
+    cache is written through by the add/remove helpers of this module
+    and is reloaded from the database every refresh_interval seconds
+    to pick up changes made by other neutron servers.
+    """
+
+    INDEXED_FIELDS = ('switch_ip', 'vlan_id', 'port_id', 'instance_id')
+
+    def __init__(self, refresh_interval):
+        self.refresh_interval = refresh_interval
+        self._bindings = {}
+        self._index = self._new_index()
+        self._loaded_at = None
+
+    def _new_index(self):
+        return dict((field, collections.defaultdict(set))
+                    for field in self.INDEXED_FIELDS)
+
+    @staticmethod
+    def _normalize(field, value):
+        if value is not None and field in ('vlan_id', 'vni'):
+            return int(value)
+        return value
+
+    def _index_binding(self, index, binding):
+        for field in self.INDEXED_FIELDS:
+            index[field][self._normalize(
+                field, getattr(binding, field))].add(binding.binding_id)
+
+    def load(self):
+        """Rebuild the index from the database."""
+        session = db.get_session()
+        bindings = session.query(nexus_models_v2.NexusPortBinding).all()
+        index = self._new_index()
+        for binding in bindings:
+            self._index_binding(index, binding)
+        self._bindings = dict((binding.binding_id, binding)
+                              for binding in bindings)
+        self._index = index
+        self._loaded_at = time.time()
+        LOG.debug("Loaded %d Nexus port bindings into the binding cache",
+                  len(bindings))
+
+    def invalidate(self):
+        """Force a reload on the next lookup."""
+        self._loaded_at = None
+
+    def is_stale(self):
+        return (self._loaded_at is None or
+                time.time() - self._loaded_at > self.refresh_interval)
+
+    def add(self, binding):
+        self._bindings[binding.binding_id] = binding
+        self._index_binding(self._index, binding)
+
+    def remove(self, binding):
+        cached = self._bindings.pop(binding.binding_id, None)
+        if cached is None:
+            return
+        for field in self.INDEXED_FIELDS:
+            value = self._normalize(field, getattr(cached, field))
+            binding_ids = self._index[field].get(value)
+            if binding_ids is not None:
+                binding_ids.discard(cached.binding_id)
+                if not binding_ids:
+                    del self._index[field][value]
+
+    def lookup(self, **bfilter):
+        """Return the cached bindings matching the filter."""
+        if self.is_stale():
+            self.load()
+        bfilter = dict((field, self._normalize(field, value))
+                       for field, value in bfilter.items())
+
+        # Start from the smallest matching index bucket.
+        binding_ids = None
+        for field in self.INDEXED_FIELDS:
+            if field in bfilter:
+                ids = self._index[field].get(bfilter[field], ())
+                if binding_ids is None or len(ids) < len(binding_ids):
+                    binding_ids = ids
+        if binding_ids is None:
+            binding_ids = self._bindings.keys()
+        bindings = [self._bindings[binding_id]
+                    for binding_id in sorted(binding_ids)]
+        return [binding for binding in bindings
+                if all(self._normalize(field, getattr(binding, field)) ==
+                       value for field, value in bfilter.items())]
+
+
+def enable_binding_cache(refresh_interval):
+    """Serve Nexus port binding lookups from an in-process index."""
+    global _binding_cache
+    _binding_cache = NexusBindingCache(refresh_interval)
+    _binding_cache.load()
+
+
+def disable_binding_cache():
+    global _binding_cache
+    _binding_cache = None
+
 
 def get_nexusport_binding(port_id, vlan_id, switch_ip, instance_id):
     """Lists a nexusport binding."""
     LOG.debug("get_nexusport_binding() called")
-    return _lookup_all_nexus_bindings(port_id=port_id,
+    return _lookup_all_nexus_bindings(cached=False,
+                                      port_id=port_id,
                                       vlan_id=vlan_id,
                                       switch_ip=switch_ip,
                                       instance_id=instance_id)
@@ -46,7 +165,7 @@ def get_nexusvlan_binding(vlan_id, switch_ip):
 def get_nexusport_switch_bindings(switch_ip):
     """Lists all Nexus port switch bindings."""
     LOG.debug("get_nexusport_switch_bindings() called")
-    return _lookup_all_nexus_bindings(switch_ip=switch_ip)
+    return _lookup_all_nexus_bindings(cached=False, switch_ip=switch_ip)
 
 
 def add_nexusport_binding(port_id, vlan_id, vni, switch_ip, instance_id,
@@ -60,8 +179,11 @@ def add_nexusport_binding(port_id, vlan_id, vni, switch_ip, instance_id,
                   switch_ip=switch_ip,
                   instance_id=instance_id,
                   is_provider_vlan=is_provider_vlan)
-    session.add(binding)
-    session.flush()
+    with session.begin(subtransactions=True):
+        session.add(binding)
+        _update_vlan_refs(session, [binding], 1)
+    if _binding_cache:
+        _binding_cache.add(binding)
     return binding
 
 
@@ -77,12 +199,58 @@ def remove_nexusport_binding(port_id, vlan_id, vni, switch_ip, instance_id,
                                          port_id=port_id,
                                          instance_id=instance_id,
                                          is_provider_vlan=is_provider_vlan)
-    for bind in binding:
-        session.delete(bind)
-    session.flush()
+    with session.begin(subtransactions=True):
+        for bind in binding:
+            session.delete(bind)
+        _update_vlan_refs(session, binding, -1)
+    if _binding_cache:
+        for bind in binding:
+            _binding_cache.remove(bind)
     return binding
 
 
+def add_nexusport_bindings(bindings):
+    """Adds a list of nexusport bindings in a single transaction.
+
+    :param bindings: list of dicts holding the add_nexusport_binding
+                     arguments
+    :return: the added bindings
+    """
+    LOG.debug("add_nexusport_bindings() called")
+    session = db.get_session()
+    rows = [nexus_models_v2.NexusPortBinding(**binding)
+            for binding in bindings]
+    with session.begin(subtransactions=True):
+        session.add_all(rows)
+        _update_vlan_refs(session, rows, 1)
+    if _binding_cache:
+        for row in rows:
+            _binding_cache.add(row)
+    return rows
+
+
+def remove_nexusport_bindings(bindings):
+    """Removes a list of nexusport bindings with a single DELETE.
+
+    :param bindings: binding rows previously read from the database
+    """
+    LOG.debug("remove_nexusport_bindings() called")
+    binding_ids = [binding.binding_id for binding in bindings]
+    if not binding_ids:
+        return
+    session = db.get_session()
+    with session.begin(subtransactions=True):
+        query = (session.query(nexus_models_v2.NexusPortBinding).
+                 filter(nexus_models_v2.NexusPortBinding.binding_id.in_(
+                     binding_ids)))
+        # Only count down the rows this transaction really deletes.
+        _update_vlan_refs(session, query.with_lockmode('update').all(), -1)
+        query.delete(synchronize_session=False)
+    if _binding_cache:
+        for binding in bindings:
+            _binding_cache.remove(binding)
+
+
 def update_nexusport_binding(port_id, new_vlan_id):
     """Updates nexusport binding."""
     if not new_vlan_id:
@@ -90,17 +258,137 @@ def update_nexusport_binding(port_id, new_vlan_id):
         return
     LOG.debug("update_nexusport_binding called")
     session = db.get_session()
-    binding = _lookup_one_nexus_binding(session=session, port_id=port_id)
-    binding.vlan_id = new_vlan_id
-    session.merge(binding)
-    session.flush()
+    with session.begin(subtransactions=True):
+        binding = _lookup_one_nexus_binding(session=session, port_id=port_id)
+        _update_vlan_refs(session, [binding], -1)
+        binding.vlan_id = new_vlan_id
+        session.merge(binding)
+        _update_vlan_refs(session, [binding], 1)
+    if _binding_cache:
+        _binding_cache.invalidate()
     return binding
 
 
+def _update_vlan_refs(session, bindings, delta):
+    """Adjust the VLAN reference counts for added or removed bindings.
+
+    Must be called within the transaction changing the bindings so that
+    the counts never drift from the bindings table.  The counts are
+    changed with UPDATE statements so that concurrent transactions do not
+    overwrite each other's change.  A switch count added by this call
+    records the instance of its first binding as the VLAN owner, see
+    get_vlan_ref_owner.
+    """
+    ref_model = nexus_models_v2.NexusVlanRef
+    deltas = collections.Counter()
+    owners = {}
+    for binding in bindings:
+        if binding.switch_ip is None or binding.port_id is None:
+            continue
+        vlan_id = int(binding.vlan_id)
+        deltas[(binding.switch_ip, vlan_id, binding.port_id)] += delta
+        deltas[(binding.switch_ip, vlan_id, '')] += delta
+        owners.setdefault((binding.switch_ip, vlan_id, ''),
+                          binding.instance_id)
+    for key, count in sorted(deltas.items()):
+        switch_ip, vlan_id, port_id = key
+        query = session.query(ref_model).filter_by(
+            switch_ip=switch_ip, vlan_id=vlan_id, port_id=port_id)
+        while count > 0 and not query.update(
+                {'ref_count': ref_model.ref_count + count},
+                synchronize_session=False):
+            try:
+                with session.begin_nested():
+                    session.add(ref_model(switch_ip=switch_ip,
+                                          vlan_id=vlan_id,
+                                          port_id=port_id,
+                                          ref_count=count,
+                                          instance_id=owners.get(key)))
+                break
+            except db_exc.DBDuplicateEntry:
+                # Added by a concurrent transaction, update it instead.
+                LOG.debug("VLAN reference %s added concurrently", key)
+        if count < 0:
+            query.update({'ref_count': ref_model.ref_count + count},
+                         synchronize_session=False)
+            query.filter(ref_model.ref_count <= 0).delete(
+                synchronize_session=False)
+
+
+def get_vlan_ref_count(switch_ip, vlan_id, port_id=''):
+    """Return how many port bindings use a VLAN.
+
+    :param port_id: count only the bindings of this switch interface;
+                    by default count all the bindings of the switch
+    """
+    session = db.get_session()
+    ref = (session.query(nexus_models_v2.NexusVlanRef).
+           filter_by(switch_ip=switch_ip, vlan_id=int(vlan_id),
+                     port_id=port_id).first())
+    return ref.ref_count if ref else 0
+
+
+def get_vlan_ref_owner(switch_ip, vlan_id):
+    """Return the instance whose binding first used a VLAN on a switch.
+
+    The owner is recorded by the transaction taking the switch count
+    from 0 to 1, so exactly one port event sees itself as the owner.
+    """
+    session = db.get_session()
+    ref = (session.query(nexus_models_v2.NexusVlanRef).
+           filter_by(switch_ip=switch_ip, vlan_id=int(vlan_id),
+                     port_id='').first())
+    return ref.instance_id if ref else None
+
+
+def reconcile_vlan_refs(switch_ip):
+    """Recount the VLAN references of a switch from its port bindings.
+
+    :return: the number of corrected reference counts
+    """
+    ref_model = nexus_models_v2.NexusVlanRef
+    binding = nexus_models_v2.NexusPortBinding
+    session = db.get_session()
+    with session.begin(subtransactions=True):
+        # Lock the counts before reading the bindings they count.
+        refs = dict(((ref.vlan_id, ref.port_id), ref) for ref in
+                    session.query(ref_model).filter_by(switch_ip=switch_ip).
+                    with_lockmode('update'))
+        counts = collections.Counter()
+        for vlan_id, port_id, count in (
+                session.query(binding.vlan_id, binding.port_id,
+                              sa.func.count(binding.binding_id)).
+                filter(binding.switch_ip == switch_ip,
+                       binding.port_id.isnot(None)).
+                group_by(binding.vlan_id, binding.port_id)):
+            counts[(int(vlan_id), port_id)] += count
+            counts[(int(vlan_id), '')] += count
+        corrected = 0
+        for (vlan_id, port_id), count in counts.items():
+            ref = refs.pop((vlan_id, port_id), None)
+            if ref is None:
+                session.add(ref_model(switch_ip=switch_ip, vlan_id=vlan_id,
+                                      port_id=port_id, ref_count=count))
+            elif ref.ref_count != count:
+                ref.ref_count = count
+            else:
+                continue
+            corrected += 1
+        for ref in refs.values():
+            session.delete(ref)
+            corrected += 1
+    if corrected:
+        LOG.warning(_LW("Corrected %(count)d VLAN reference counts of "
+                        "switch %(switch_ip)s"),
+                    {'count': corrected, 'switch_ip': switch_ip})
+    return corrected
+
+
 def get_nexusvm_bindings(vlan_id, instance_id):
     """Lists nexusvm bindings."""
     LOG.debug("get_nexusvm_bindings() called")
-    return _lookup_all_nexus_bindings(instance_id=instance_id,
+    return _lookup_all_nexus_bindings(cached=False,
+                                      instance_id=instance_id,
                                       vlan_id=vlan_id)
 
 
@@ -130,16 +418,27 @@ def get_nexussvi_bindings():
     return _lookup_all_nexus_bindings(port_id='router')
 
 
-def _lookup_nexus_bindings(query_type, session=None, **bfilter):
+def _lookup_nexus_bindings(query_type, session=None, cached=True,
+                           **bfilter):
     """Look up 'query_type' Nexus bindings matching the filter.
 
     :param query_type: 'all', 'one' or 'first'
     :param session: db session
+    :param cached: whether the lookup may be served from the binding
+                   cache; lookups deciding a database write or delete
+                   pass False, since the cache does not see rows removed
+                   by other processes until its next reload
     :param bfilter: filter for bindings query
     :return: bindings if query gave a result, else
              raise NexusPortBindingNotFound.
     """
     if session is None:
+        if cached and _binding_cache and query_type != 'one':
+            # Bindings added by other processes are missing from the
+            # cache until its next reload, so a miss is checked in the DB.
+            bindings = _binding_cache.lookup(**bfilter)
+            if bindings:
+                return bindings if query_type == 'all' else bindings[0]
         session = db.get_session()
     query_method = getattr(session.query(
         nexus_models_v2.NexusPortBinding).filter_by(**bfilter), query_type)
@@ -152,8 +451,8 @@ def _lookup_nexus_bindings(query_type, session=None, **bfilter):
     raise c_exc.NexusPortBindingNotFound(**bfilter)
 
 
-def _lookup_all_nexus_bindings(session=None, **bfilter):
-    return _lookup_nexus_bindings('all', session, **bfilter)
+def _lookup_all_nexus_bindings(session=None, cached=True, **bfilter):
+    return _lookup_nexus_bindings('all', session, cached, **bfilter)
 
 
 def _lookup_one_nexus_binding(session=None, **bfilter):
@@ -190,6 +489,36 @@ def remove_nexusnve_binding(vni, switch_ip, device_id):
         return binding
 
 
+def add_nexusnve_bindings(vni, switch_ips, device_id, mcast_group):
+    """Adds the nexus nve binding of a device on several switches.
+
+    All rows are added in a single transaction.
+    """
+    LOG.debug("add_nexusnve_bindings() called")
+    session = db.get_session()
+    rows = [nexus_models_v2.NexusNVEBinding(vni=vni,
+                                            switch_ip=switch_ip,
+                                            device_id=device_id,
+                                            mcast_group=mcast_group)
+            for switch_ip in switch_ips]
+    with session.begin(subtransactions=True):
+        session.add_all(rows)
+    return rows
+
+
+def remove_nexusnve_bindings(vni, device_id):
+    """Remove the nexus nve bindings of a device on all switches.
+
+    :return: the number of bindings removed
+    """
+    LOG.debug("remove_nexusnve_bindings() called")
+    session = db.get_session()
+    with session.begin(subtransactions=True):
+        return (session.query(nexus_models_v2.NexusNVEBinding).
+                filter_by(vni=vni, device_id=device_id).
+                delete(synchronize_session=False))
+
+
 def get_nve_vni_switch_bindings(vni, switch_ip):
     """Return the nexus nve binding(s) per switch."""
     LOG.debug("get_nve_vni_switch_bindings() called")
@@ -233,3 +562,136 @@ def get_nve_vni_deviceid_bindings(vni, device_id):
                 filter_by(vni=vni, device_id=device_id).all())
     except sa_exc.NoResultFound:
         return None
+
+
+def add_journal_entries(operation, switch_ips, args):
+    """Queue a switch config operation for several switches.
+
+    All entries are added in a single transaction.
+
+    :param operation: name of the mechanism driver operation
+    :param switch_ips: switches the operation applies to
+    :param args: JSON serializable arguments of the operation
+    """
+    LOG.debug("add_journal_entries() called")
+    session = db.get_session()
+    now = timeutils.utcnow()
+    data = jsonutils.dumps(args)
+    rows = [nexus_models_v2.NexusJournalEntry(switch_ip=switch_ip,
+                                              operation=operation,
+                                              data=data,
+                                              state=const.JOURNAL_PENDING,
+                                              retry_count=0,
+                                              created_at=now,
+                                              updated_at=now)
+            for switch_ip in switch_ips]
+    with session.begin(subtransactions=True):
+        session.add_all(rows)
+    return rows
+
+
+def get_next_journal_entry(switch_ip):
+    """Return the oldest unfinished journal entry of a switch.
+
+    A failed entry is returned too, it blocks the entries after it.
+    """
+    session = db.get_session()
+    return (session.query(nexus_models_v2.NexusJournalEntry).
+            filter_by(switch_ip=switch_ip).
+            order_by(nexus_models_v2.NexusJournalEntry.id).first())
+
+
+def claim_journal_entry(entry, stale_before):
+    """Mark a journal entry as being processed by the caller.
+
+    An entry left processing since before stale_before, e.g. by a server
+    which died, can be claimed again.
+
+    :return: True if the caller now owns the entry
+    """
+    session = db.get_session()
+    journal = nexus_models_v2.NexusJournalEntry
+    with session.begin(subtransactions=True):
+        claimed = (session.query(journal).
+                   filter_by(id=entry.id).
+                   filter(sa.or_(journal.state == const.JOURNAL_PENDING,
+                                 sa.and_(journal.state ==
+                                         const.JOURNAL_PROCESSING,
+                                         journal.updated_at <
+                                         stale_before))).
+                   update({'state': const.JOURNAL_PROCESSING,
+                           'updated_at': timeutils.utcnow()},
+                          synchronize_session=False))
+    return claimed == 1
+
+
+def get_journal_args(entry):
+    return jsonutils.loads(entry.data)
+
+
+def complete_journal_entry(entry):
+    """Remove a processed journal entry."""
+    session = db.get_session()
+    with session.begin(subtransactions=True):
+        (session.query(nexus_models_v2.NexusJournalEntry).
+         filter_by(id=entry.id).delete(synchronize_session=False))
+
+
+def fail_journal_entry(entry, error, max_retries):
+    """Record a failed attempt to process a journal entry.
+
+    The entry is retried until it has failed max_retries times.
+
+    :return: True if the entry will not be retried
+    """
+    session = db.get_session()
+    retry_count = entry.retry_count + 1
+    state = (const.JOURNAL_FAILED if retry_count >= max_retries
+             else const.JOURNAL_PENDING)
+    with session.begin(subtransactions=True):
+        (session.query(nexus_models_v2.NexusJournalEntry).
+         filter_by(id=entry.id).
+         update({'state': state,
+                 'retry_count': retry_count,
+                 'last_error': error,
+                 'updated_at': timeutils.utcnow()},
+                synchronize_session=False))
+    return state == const.JOURNAL_FAILED
+
+
+def retry_failed_journal_entries(switch_ip):
+    """Make the failed journal entries of a switch pending again.
+
+    :return: the number of entries to retry
+    """
+    session = db.get_session()
+    with session.begin(subtransactions=True):
+        return (session.query(nexus_models_v2.NexusJournalEntry).
+                filter_by(switch_ip=switch_ip,
+                          state=const.JOURNAL_FAILED).
+                update({'state': const.JOURNAL_PENDING,
+                        'retry_count': 0,
+                        'updated_at': timeutils.utcnow()},
+                       synchronize_session=False))
+
+
+def get_journal_switches():
+    """Return the switches with unfinished journal entries."""
+    session = db.get_session()
+    journal = nexus_models_v2.NexusJournalEntry
+    return [row.switch_ip for row in
+            session.query(journal.switch_ip).
+            filter(journal.state != const.JOURNAL_FAILED).distinct()]
+
+
+def get_journal_summary():
+    """Return {switch_ip: {state: count}} for all journal entries."""
+    session = db.get_session()
+    journal = nexus_models_v2.NexusJournalEntry
+    summary = {}
+    for switch_ip, state, count in (
+            session.query(journal.switch_ip, journal.state,
+                          sa.func.count(journal.id)).
+            group_by(journal.switch_ip, journal.state)):
+        summary.setdefault(switch_ip, {})[state] = count
+    return summary
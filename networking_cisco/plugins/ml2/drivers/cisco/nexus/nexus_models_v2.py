@@ -24,6 +24,15 @@ class NexusPortBinding(model_base.BASEV2):
     """Represents a binding of VM's to nexus ports."""
 
     __tablename__ = "cisco_ml2_nexusport_bindings"
+    __table_args__ = (
+        sa.Index('ix_cisco_ml2_nexusport_bindings_switch_vlan_port',
+                 'switch_ip', 'vlan_id', 'port_id'),
+        sa.Index('ix_cisco_ml2_nexusport_bindings_instance_vlan',
+                 'instance_id', 'vlan_id'),
+        sa.Index('ix_cisco_ml2_nexusport_bindings_port_switch',
+                 'port_id', 'switch_ip'),
+        model_base.BASEV2.__table_args__
+    )
 
     binding_id = sa.Column(sa.Integer, primary_key=True, autoincrement=True)
     port_id = sa.Column(sa.String(255))
@@ -53,10 +62,34 @@ class NexusPortBinding(model_base.BASEV2):
         )
 
 
+class NexusVlanRef(model_base.BASEV2):
+    """Counts the port bindings using a VLAN on a switch or interface.
+
+    The row with an empty port_id holds the count for the whole switch,
+    and the instance of the binding which created it.
+    """
+
+    __tablename__ = "cisco_ml2_nexus_vlan_refs"
+
+    switch_ip = sa.Column(sa.String(255), primary_key=True)
+    vlan_id = sa.Column(sa.Integer, primary_key=True, autoincrement=False)
+    port_id = sa.Column(sa.String(255), primary_key=True)
+    ref_count = sa.Column(sa.Integer, nullable=False, default=0)
+    instance_id = sa.Column(sa.String(255))
+
+    def __repr__(self):
+        return ("<NexusVlanRef(%s,%s,%s,%s)>" %
+                (self.switch_ip, self.vlan_id, self.port_id, self.ref_count))
+
+
 class NexusNVEBinding(model_base.BASEV2):
     """Represents Network Virtualization Endpoint configuration."""
 
     __tablename__ = "cisco_ml2_nexus_nve"
+    __table_args__ = (
+        sa.Index('ix_cisco_ml2_nexus_nve_switch_vni', 'switch_ip', 'vni'),
+        model_base.BASEV2.__table_args__
+    )
 
     vni = sa.Column(sa.Integer, primary_key=True, nullable=False)
     device_id = sa.Column(sa.String(255), primary_key=True)
@@ -78,6 +111,25 @@ class NexusVxlanAllocation(model_base.BASEV2):
                           server_default=sa.sql.false())
 
 
+class NexusVxlanFreeRange(model_base.BASEV2):
+    """Represents a range of VNIs available for allocation."""
+
+    __tablename__ = 'ml2_nexus_vxlan_free_ranges'
+    __table_args__ = (
+        sa.Index('ix_ml2_nexus_vxlan_free_ranges_first_vni', 'first_vni'),
+        sa.Index('ix_ml2_nexus_vxlan_free_ranges_last_vni', 'last_vni'),
+        model_base.BASEV2.__table_args__
+    )
+
+    id = sa.Column(sa.Integer, primary_key=True, autoincrement=True)
+    first_vni = sa.Column(sa.Integer, nullable=False)
+    last_vni = sa.Column(sa.Integer, nullable=False)
+
+    def __repr__(self):
+        return ("<NexusVxlanFreeRange(%s,%s)>" %
+                (self.first_vni, self.last_vni))
+
+
 class NexusMcastGroup(model_base.BASEV2, models_v2.HasId):
 
     __tablename__ = 'ml2_nexus_vxlan_mcast_groups'
@@ -88,3 +140,27 @@ class NexusMcastGroup(model_base.BASEV2, models_v2.HasId):
                                    'ml2_nexus_vxlan_allocations.vxlan_vni',
                                    ondelete="CASCADE"),
                                nullable=False)
+
+
+class NexusJournalEntry(model_base.BASEV2):
+    """Represents switch configuration work queued by a port event."""
+
+    __tablename__ = 'cisco_ml2_nexus_journal'
+    __table_args__ = (
+        sa.Index('ix_cisco_ml2_nexus_journal_switch_id', 'switch_ip', 'id'),
+        model_base.BASEV2.__table_args__
+    )
+
+    id = sa.Column(sa.Integer, primary_key=True, autoincrement=True)
+    switch_ip = sa.Column(sa.String(255), nullable=False)
+    operation = sa.Column(sa.String(64), nullable=False)
+    data = sa.Column(sa.Text, nullable=False)
+    state = sa.Column(sa.String(16), nullable=False)
+    retry_count = sa.Column(sa.Integer, nullable=False, default=0)
+    last_error = sa.Column(sa.Text)
+    created_at = sa.Column(sa.DateTime, nullable=False)
+    updated_at = sa.Column(sa.DateTime, nullable=False)
+
+    def __repr__(self):
+        return ("<NexusJournalEntry(%s,%s,%s,%s)>" %
+                (self.id, self.switch_ip, self.operation, self.state))
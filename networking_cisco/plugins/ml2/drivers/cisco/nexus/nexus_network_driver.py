@@ -17,14 +17,20 @@
 Implements a Nexus-OS NETCONF over SSHv2 API Client
 """
 
+import os
+import random
 import re
+import time
 
+import eventlet
+from eventlet import event
+from eventlet import semaphore
 from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_utils import excutils
 from oslo_utils import importutils
 
-from neutron.i18n import _LW
+from neutron.i18n import _LE, _LI, _LW
 
 from networking_cisco.plugins.ml2.drivers.cisco.nexus import (
     config as conf)
@@ -37,17 +43,430 @@ from networking_cisco.plugins.ml2.drivers.cisco.nexus import (
 
 LOG = logging.getLogger(__name__)
 
+# Switch errors which can be ignored when creating a VLAN.  Some versions
+# of Nexus switch do not allow state changes for the extended VLAN range
+# (1006-4094), but the default values are appropriate.
+VLAN_CREATE_ALLOWED_EXC = ["VLAN with the same name exists"]
+VLAN_STATE_ALLOWED_EXC = ["Can't modify state for extended",
+                          "Command is only allowed on VLAN"]
+
+TRUNK_ALLOWED_VLAN_RE = re.compile(
+    "switchport trunk allowed vlan\s+(?:add\s+)?([0-9,\-]+)")
+RUNNING_INTF_RE = re.compile("^interface\s+([A-Za-z\-]+)(\d\S*)\s*$",
+                             re.M)
+RUNNING_VLAN_RE = re.compile("^\s*vlan\s+([0-9,\-]+)\s*$", re.M)
+RUNNING_VLAN_NAME_RE = re.compile("^\s*vlan\s+(\d+)\s*\n\s+name\s+(\S+)",
+                                  re.M)
+RUNNING_NVE_MEMBER_RE = re.compile("member vni\s+(\d+)")
+
+
+def parse_vlan_ranges(vlan_ranges):
+    """Expand NX-OS VLAN range syntax such as '10-12,20' into a set."""
+    vlans = set()
+    for vlan_range in vlan_ranges.split(','):
+        if not vlan_range:
+            continue
+        first, sep, last = vlan_range.partition('-')
+        vlans.update(range(int(first), int(last or first) + 1))
+    return vlans
+
+
+def format_vlan_ranges(vlan_ids, max_len=const.NEXUS_MAX_VLAN_RANGE_LEN):
+    """Compress VLAN IDs into NX-OS range syntax such as '10-12,20'.
+
+    :param vlan_ids: iterable of VLAN IDs
+    :param max_len: longest range list returned in one string
+    :returns: list of range lists, each at most max_len characters
+    """
+    ranges = []
+    for vlan_id in sorted(set(int(vlan_id) for vlan_id in vlan_ids)):
+        if ranges and ranges[-1][1] == vlan_id - 1:
+            ranges[-1][1] = vlan_id
+        else:
+            ranges.append([vlan_id, vlan_id])
+
+    chunks = []
+    chunk = ''
+    for first, last in ranges:
+        token = str(first) if first == last else '%d-%d' % (first, last)
+        if chunk and len(chunk) + 1 + len(token) > max_len:
+            chunks.append(chunk)
+            chunk = token
+        else:
+            chunk = chunk + ',' + token if chunk else token
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+class NexusSessionPool(object):
+    """Bounded pool of NETCONF sessions to a single Nexus switch.
+
+    Sessions are checked out for the duration of one RPC and checked back
+    in afterwards.  At most max_sessions are open (or being opened) at any
+    time, so green threads block at checkout, for at most
+    checkout_timeout seconds, rather than exceed the switch's SSH session
+    limit.  Idle sessions are validated before reuse and closed by a
+    timer once they have been idle longer than idle_timeout.
+    """
+
+    def __init__(self, nexus_host, max_sessions, idle_timeout, connect,
+                 checkout_timeout=0):
+        self.nexus_host = nexus_host
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self._connect = connect
+        # Sessions can't be shared with processes forked from this one.
+        self.pid = os.getpid()
+        self._slots = semaphore.Semaphore(max_sessions)
+        # Most recently used session last, each entry is [mgr, last_used].
+        self._idle = []
+        self._reaper = None
+
+    def _close(self, mgr):
+        try:
+            mgr.close_session()
+        except Exception:
+            pass
+
+    def _reap_idle(self):
+        """Close sessions which have been idle for too long."""
+        if self.idle_timeout <= 0:
+            return
+        expiry = time.time() - self.idle_timeout
+        while self._idle and self._idle[0][1] < expiry:
+            mgr, last_used = self._idle.pop(0)
+            LOG.debug("Closing idle session to Nexus %s", self.nexus_host)
+            self._close(mgr)
+
+    def _start_reaper(self):
+        """Close the idle sessions once they expire, even without traffic."""
+        if self.idle_timeout > 0 and self._reaper is None and self._idle:
+            wait = self._idle[0][1] + self.idle_timeout - time.time()
+            self._reaper = eventlet.spawn_after(max(0, wait),
+                                                self._run_reaper)
+
+    def _run_reaper(self):
+        self._reaper = None
+        self._reap_idle()
+        self._start_reaper()
+
+    def checkout(self):
+        """Return a connected session, opening one if none are idle.
+
+        :raises: NexusConnectFailed: if no session became available within
+                                     checkout_timeout seconds
+        """
+        if not self._slots.acquire(timeout=self.checkout_timeout or None):
+            raise cexc.NexusConnectFailed(
+                nexus_host=self.nexus_host,
+                exc="all %(count)d sessions stayed in use for "
+                    "%(timeout)d seconds" %
+                {'count': self.max_sessions,
+                 'timeout': self.checkout_timeout})
+        try:
+            self._reap_idle()
+            while self._idle:
+                mgr, last_used = self._idle.pop()
+                if getattr(mgr, 'connected', None):
+                    return mgr
+                self._close(mgr)
+            return self._connect(self.nexus_host)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def checkin(self, mgr):
+        """Return a session to the pool for reuse."""
+        if getattr(mgr, 'connected', None):
+            self._idle.append([mgr, time.time()])
+        self._reap_idle()
+        self._start_reaper()
+        self._slots.release()
+
+    def discard(self, mgr):
+        """Give up the slot of a session which has been closed."""
+        self._slots.release()
+
+    def flush(self):
+        """Close all idle sessions, e.g. when they are likely stale."""
+        while self._idle:
+            mgr, last_used = self._idle.pop()
+            self._close(mgr)
+
+    def idle_count(self):
+        return len(self._idle)
+
+
+class NexusCircuitBreaker(object):
+    """Fast-fails requests to a Nexus switch after repeated failures.
+
+    After threshold consecutive failed requests the breaker opens and
+    requests fail immediately for cooldown seconds.  Then a single
+    request is let through; its success closes the breaker, its failure
+    re-opens it.  A threshold of 0 disables the breaker.
+    """
+
+    def __init__(self, nexus_host, threshold, cooldown):
+        self.nexus_host = nexus_host
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def is_open(self):
+        return self.opened_at is not None
+
+    def check(self):
+        """Raise NexusSwitchUnavailable if requests must not be sent."""
+        if self.opened_at is None:
+            return
+        retry_after = self.opened_at + self.cooldown - time.time()
+        if retry_after > 0 or self._probing:
+            raise cexc.NexusSwitchUnavailable(
+                nexus_host=self.nexus_host, failures=self.failures,
+                retry_after=max(0, retry_after))
+        self._probing = True
+
+    def success(self):
+        if self.opened_at is not None:
+            LOG.info(_LI("Nexus %s is responding, resuming requests"),
+                     self.nexus_host)
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.threshold > 0 and self.failures >= self.threshold:
+            if self.opened_at is None:
+                LOG.warn(_LW("Nexus %(nexus_host)s failed %(failures)d "
+                             "consecutive requests, failing requests for "
+                             "%(cooldown)d seconds"),
+                         {'nexus_host': self.nexus_host,
+                          'failures': self.failures,
+                          'cooldown': self.cooldown})
+            self.opened_at = time.time()
+
+
+class NexusConfigSaveScheduler(object):
+    """Coalesces 'copy running-config startup-config' per Nexus switch.
+
+    Configuration changes only mark their switch dirty.  A green thread
+    per dirty switch saves the running config once no change has been
+    made for quiet_period seconds, or at the latest max_delay seconds
+    after the first unsaved change, so a burst of changes costs a single
+    save.
+    """
+
+    def __init__(self, save, quiet_period, max_delay):
+        self._save = save
+        self.quiet_period = quiet_period
+        self.max_delay = max_delay
+        # nexus_host -> [first unsaved change, last unsaved change]
+        self._dirty = {}
+        self._workers = {}
+        # nexus_host -> event sent when the save in progress completes
+        self._saving = {}
+        self.last_save_lag = {}
+
+    def mark_dirty(self, nexus_host):
+        now = time.time()
+        changes = self._dirty.get(nexus_host)
+        if changes is None:
+            self._dirty[nexus_host] = [now, now]
+        else:
+            changes[1] = now
+        if nexus_host not in self._workers:
+            self._workers[nexus_host] = eventlet.spawn(self._run, nexus_host)
+
+    def _due(self, nexus_host):
+        first, last = self._dirty[nexus_host]
+        return min(last + self.quiet_period, first + self.max_delay)
+
+    def _run(self, nexus_host):
+        try:
+            while nexus_host in self._dirty:
+                wait = self._due(nexus_host) - time.time()
+                if wait > 0:
+                    eventlet.sleep(wait)
+                    continue
+                self._save_now(nexus_host)
+        finally:
+            self._workers.pop(nexus_host, None)
+
+    def _save_now(self, nexus_host):
+        done = self._saving[nexus_host] = event.Event()
+        try:
+            self._save_dirty(nexus_host)
+        finally:
+            del self._saving[nexus_host]
+            done.send()
+
+    def _save_dirty(self, nexus_host):
+        first, last = self._dirty.pop(nexus_host)
+        try:
+            self._save(nexus_host)
+        except Exception as e:
+            # Changes made meanwhile are kept; retry after a quiet period.
+            LOG.error(_LE("Failed to save the config of Nexus "
+                          "%(nexus_host)s. Reason: %(reason)s"),
+                      {'nexus_host': nexus_host, 'reason': e})
+            changes = self._dirty.setdefault(nexus_host, [first, last])
+            changes[0] = min(changes[0], first)
+            changes[1] = max(changes[1], time.time())
+            return
+        lag = time.time() - first
+        self.last_save_lag[nexus_host] = lag
+        LOG.info(_LI("Saved the config of Nexus %(nexus_host)s "
+                     "%(lag).1f seconds after the first unsaved change"),
+                 {'nexus_host': nexus_host, 'lag': lag})
+
+    def flush(self):
+        """Save the config of every dirty switch now.
+
+        A switch whose save fails stays scheduled for a later retry.  A
+        save already in progress is waited for rather than interrupted,
+        since killing it would leak its checked out session.
+        """
+        for nexus_host in set(self._dirty) | set(self._saving):
+            while nexus_host in self._saving:
+                self._saving[nexus_host].wait()
+            worker = self._workers.pop(nexus_host, None)
+            if worker is not None:
+                worker.kill()
+            if nexus_host in self._dirty:
+                self._save_now(nexus_host)
+            if nexus_host in self._dirty:
+                self._workers[nexus_host] = eventlet.spawn(self._run,
+                                                           nexus_host)
+
+    def get_status(self):
+        """Return the unsaved change age and last save lag per switch."""
+        now = time.time()
+        status = {}
+        for nexus_host in set(self._dirty) | set(self.last_save_lag):
+            changes = self._dirty.get(nexus_host)
+            status[nexus_host] = {
+                'unsaved_for': now - changes[0] if changes else 0,
+                'last_save_lag': self.last_save_lag.get(nexus_host)}
+        return status
+
+
+class NexusConfigTransaction(object):
+    """Batch of Nexus configuration snippets sent as one edit_config.
+
+    Fragments added to the transaction are merged into a single <config>
+    payload.  If the switch rejects the merged payload, the fragments are
+    re-sent one at a time so that each fragment's ignorable errors are
+    honoured and a failure is attributed to the fragment which caused it.
+    """
+
+    def __init__(self, driver, nexus_host):
+        self.driver = driver
+        self.nexus_host = nexus_host
+        self.fragments = []
+
+    def add(self, snippet, description='', allowed_exc_strs=None):
+        """Add a nexus_snippets CMD fragment to the transaction."""
+        self.fragments.append((snippet, description, allowed_exc_strs or []))
+
+    def commit(self):
+        """Send all fragments to the switch."""
+        if not self.fragments:
+            return
+        try:
+            if len(self.fragments) == 1:
+                self._commit_each()
+            elif not self._commit_merged():
+                self._commit_each(check_breaker=False)
+        finally:
+            self.fragments = []
+
+    def _commit_merged(self):
+        """Send the merged fragments in a single attempt.
+
+        A rejected payload is resent fragment by fragment, so it is not
+        retried here, its session is kept and the circuit breaker does not
+        count it.  The resent fragments report the outcome to the breaker
+        instead; they skip its check, which a half-open breaker let
+        through for this attempt only.
+
+        :return: True if the switch accepted the merged payload
+        """
+        driver = self.driver
+        confstr = driver.create_xml_snippet(
+            ''.join(fragment[0] for fragment in self.fragments))
+        breaker = driver._get_circuit_breaker(self.nexus_host)
+        breaker.check()
+        mgr = driver._connect_with_breaker(self.nexus_host, breaker)
+        LOG.debug("NexusDriver edit config: %s", confstr)
+        try:
+            mgr.edit_config(target='running', config=confstr)
+        except Exception as e:
+            driver._release_session(mgr, self.nexus_host)
+            LOG.warn(_LW("Nexus %(nexus_host)s rejected batched config, "
+                         "resending %(count)d fragments individually. "
+                         "Reason: %(reason)s"),
+                     {'nexus_host': self.nexus_host,
+                      'count': len(self.fragments), 'reason': e})
+            return False
+        breaker.success()
+        if driver.save_scheduler:
+            driver.save_scheduler.mark_dirty(self.nexus_host)
+        if driver._get_close_ssh_session():
+            driver._discard_session(mgr, self.nexus_host)
+        else:
+            driver._release_session(mgr, self.nexus_host)
+        return True
+
+    def _commit_each(self, check_breaker=True):
+        last = len(self.fragments) - 1
+        for index, (snippet, description, allowed_exc_strs) in enumerate(
+                self.fragments):
+            confstr = self.driver.create_xml_snippet(snippet)
+            try:
+                self.driver._edit_config(
+                    self.nexus_host, target='running', config=confstr,
+                    allowed_exc_strs=allowed_exc_strs,
+                    check_to_close_session=(index == last),
+                    check_breaker=check_breaker)
+            except cexc.NexusConfigFailed as e:
+                LOG.error(_LE("Nexus %(nexus_host)s config transaction "
+                              "failed at fragment %(index)d (%(fragment)s)"),
+                          {'nexus_host': self.nexus_host, 'index': index,
+                           'fragment': description})
+                raise cexc.NexusConfigFragmentFailed(
+                    nexus_host=self.nexus_host, fragment=description,
+                    config=confstr, exc=e)
+
 
 class CiscoNexusDriver(object):
     """Nexus Driver Main Class."""
     def __init__(self):
         self.ncclient = None
         self.nexus_switches = conf.ML2MechCiscoConfig.nexus_dict
-        self.connections = {}
-        self._close_ssh_session = True if (
-            cfg.CONF.ml2_cisco.never_cache_ssh_connection or
-            (cfg.CONF.rpc_workers + cfg.CONF.api_workers) >=
-            const.MAX_NEXUS_SSH_SESSIONS) else False
+        self.session_pools = {}
+        self.circuit_breakers = {}
+        self.save_scheduler = None
+        if (cfg.CONF.ml2_cisco.persistent_switch_config and
+                cfg.CONF.ml2_cisco.switch_config_save_delay > 0):
+            self.save_scheduler = NexusConfigSaveScheduler(
+                self.save_config,
+                cfg.CONF.ml2_cisco.switch_config_save_delay,
+                max(cfg.CONF.ml2_cisco.switch_config_save_delay,
+                    cfg.CONF.ml2_cisco.switch_config_save_max_delay))
+        # VLANs allowed on trunk interfaces, keyed by
+        # (nexus_host, intf_type, interface).  Only interfaces known to
+        # have 'switchport trunk allowed vlan' configured are cached.
+        self.trunk_vlans = {}
+        # With many workers each process keeps fewer sessions, see
+        # _get_session_pool_size, rather than closing them after use.
+        self._close_ssh_session = (
+            cfg.CONF.ml2_cisco.never_cache_ssh_connection)
 
     def _import_ncclient(self):
         """Import the NETCONF client (ncclient) module.
@@ -63,12 +482,97 @@ class CiscoNexusDriver(object):
     def _get_close_ssh_session(self):
         return self._close_ssh_session
 
+    def _get_session_pool_size(self):
+        """Return the per-switch session limit for this process.
+
+        Unless configured explicitly, the switch's session limit is
+        shared evenly between the neutron-server parent process and its
+        api and rpc workers.
+        """
+        pool_size = cfg.CONF.ml2_cisco.switch_session_pool_size
+        if pool_size <= 0:
+            processes = (cfg.CONF.rpc_workers + cfg.CONF.api_workers) + 1
+            pool_size = max(1, const.MAX_NEXUS_SSH_SESSIONS // processes)
+        return pool_size
+
+    def _get_session_pool(self, nexus_host):
+        pool = self.session_pools.get(nexus_host)
+        if pool is None or pool.pid != os.getpid():
+            # A pool inherited from the parent process is left alone,
+            # closing its sessions would close them for the parent too.
+            pool = NexusSessionPool(
+                nexus_host, self._get_session_pool_size(),
+                cfg.CONF.ml2_cisco.switch_session_idle_timeout,
+                self._nxos_connect,
+                cfg.CONF.ml2_cisco.switch_session_checkout_timeout)
+            self.session_pools[nexus_host] = pool
+        return pool
+
     def _close_session(self, mgr, nexus_host):
         """Close the connection to the nexus switch."""
         if mgr:
-            self.connections.pop(nexus_host, None)
             mgr.close_session()
 
+    def _release_session(self, mgr, nexus_host):
+        """Check a session back into its switch pool."""
+        self._get_session_pool(nexus_host).checkin(mgr)
+
+    def _discard_session(self, mgr, nexus_host, flush=False):
+        """Close a session and give up its slot in the switch pool.
+
+        :param flush: Also close the idle sessions of this switch. Used
+                      after a failed RPC since the other sessions are then
+                      likely stale as well (e.g. after a switch reboot).
+        """
+        pool = self._get_session_pool(nexus_host)
+        try:
+            self._close_session(mgr, nexus_host)
+        except Exception:
+            pass
+        finally:
+            pool.discard(mgr)
+        if flush:
+            pool.flush()
+            # The switch may have been reloaded so cached state is suspect.
+            self.invalidate_trunk_vlans(nexus_host)
+
+    def _get_circuit_breaker(self, nexus_host):
+        breaker = self.circuit_breakers.get(nexus_host)
+        if breaker is None:
+            breaker = NexusCircuitBreaker(
+                nexus_host, cfg.CONF.ml2_cisco.switch_failure_threshold,
+                cfg.CONF.ml2_cisco.switch_failure_cooldown)
+            self.circuit_breakers[nexus_host] = breaker
+        return breaker
+
+    def _connect_with_breaker(self, nexus_host, breaker):
+        """Check out a session, counting connect failures on the breaker."""
+        try:
+            return self.nxos_connect(nexus_host)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                breaker.failure()
+
+    def _get_retry_count(self):
+        return max(1, cfg.CONF.ml2_cisco.switch_retry_count)
+
+    def _retry_backoff(self, nexus_host, retry):
+        """Sleep before a retry, using exponential backoff with jitter.
+
+        The jitter keeps the workers of all neutron servers from retrying
+        against a struggling switch at the same moment.
+        """
+        interval = cfg.CONF.ml2_cisco.switch_retry_interval
+        if interval <= 0:
+            return
+        delay = random.uniform(0, min(
+            cfg.CONF.ml2_cisco.switch_retry_max_interval,
+            interval * 2 ** (retry - 1)))
+        LOG.debug("Retrying request to Nexus %(nexus_host)s in "
+                  "%(delay).2f seconds",
+                  {'nexus_host': nexus_host, 'delay': delay})
+        time.sleep(delay)
+
     def _get_config(self, nexus_host, filter=''):
         """Get Nexus Host Configuration:
 
@@ -79,43 +583,46 @@ class CiscoNexusDriver(object):
 
            """
 
-        # For loop added to handle stale ncclient handle after switch reboot.
-        # If the attempt fails,
+        # Retry loop added to handle stale ncclient handle after switch
+        # reboot.  If the attempt fails,
         #     close the session, save first exception
-        #     loop back around
+        #     back off, loop back around
         #     try again
         #     then quit
-        for retry_count in (1, 2):
-            mgr = self.nxos_connect(nexus_host)
+        # if transaction is snipp.EXEC_GET_INVENTORY_SNIPPET or
+        # snipp.EXEC_GET_HOSTNAME_SNIPPET, don't retry since this is
+        # used as a ping to validate connection and retry is already
+        # built into replay code.  The ping also bypasses the circuit
+        # breaker so the switch monitor can detect its recovery.
+        is_ping = filter in (snipp.EXEC_GET_INVENTORY_SNIPPET,
+                             snipp.EXEC_GET_HOSTNAME_SNIPPET)
+        breaker = self._get_circuit_breaker(nexus_host)
+        if not is_ping:
+            breaker.check()
+        attempts = 1 if is_ping else self._get_retry_count()
+        for retry_count in range(1, attempts + 1):
+            if retry_count > 1:
+                self._retry_backoff(nexus_host, retry_count - 1)
+            mgr = self._connect_with_breaker(nexus_host, breaker)
             try:
                 data_xml = mgr.get(filter=('subtree', filter)).data_xml
             except Exception as e:
-                try:
-                    self._close_session(mgr, nexus_host)
-                except Exception:
-                    pass
-
-                # if transaction is snipp.EXEC_GET_INVENTORY_SNIPPET,
-                # don't retry since this is used as a ping to
-                # validate connection and retry is already built
-                # into replay code.
-                if snipp.EXEC_GET_INVENTORY_SNIPPET == filter:
-                    raise cexc.NexusConfigFailed(nexus_host=nexus_host,
-                                                 config=filter,
-                                                 exc=e)
-
-                # if first try, save first exception and retry
+                self._discard_session(mgr, nexus_host, flush=True)
                 if retry_count == 1:
                     first_exc = e
-                else:
+                if retry_count == attempts:
+                    breaker.failure()
                     raise cexc.NexusConfigFailed(nexus_host=nexus_host,
                                                  config=filter,
                                                  exc=first_exc)
             else:
+                self._release_session(mgr, nexus_host)
+                breaker.success()
                 return data_xml
 
     def _edit_config(self, nexus_host, target='running', config='',
-                     allowed_exc_strs=None, check_to_close_session=True):
+                     allowed_exc_strs=None, check_to_close_session=True,
+                     mark_dirty=True, check_breaker=True):
         """Modify switch config for a target config type.
 
         :param nexus_host: IP address of switch to configure
@@ -126,6 +633,10 @@ class CiscoNexusDriver(object):
                                  (str(exception)) can be ignored
         :param check_to_close_session: Set to False when configured to close
                                        the ssh session is not to be checked.
+        :param mark_dirty: Set to False when the change does not need to be
+                           saved to the startup config.
+        :param check_breaker: Set to False when the caller already passed
+                              the circuit breaker check for this request.
 
         :raises: NexusConfigFailed: if _edit_config() encountered an exception
                                     not containing one of allowed_exc_strs
@@ -134,14 +645,20 @@ class CiscoNexusDriver(object):
         if not allowed_exc_strs:
             allowed_exc_strs = []
 
-        # For loop added to handle stale ncclient handle after switch reboot.
-        # If the attempt fails and not an allowed exception,
+        # Retry loop added to handle stale ncclient handle after switch
+        # reboot.  If the attempt fails and not an allowed exception,
         #     close the session, save first exception
-        #     loop back around
+        #     back off, loop back around
         #     try again
         #     then quit
-        for retry_count in (1, 2):
-            mgr = self.nxos_connect(nexus_host)
+        breaker = self._get_circuit_breaker(nexus_host)
+        if check_breaker:
+            breaker.check()
+        attempts = self._get_retry_count()
+        for retry_count in range(1, attempts + 1):
+            if retry_count > 1:
+                self._retry_backoff(nexus_host, retry_count - 1)
+            mgr = self._connect_with_breaker(nexus_host, breaker)
             LOG.debug("NexusDriver edit config: %s", config)
             try:
                 mgr.edit_config(target=target, config=config)
@@ -149,29 +666,53 @@ class CiscoNexusDriver(object):
             except Exception as e:
                 for exc_str in allowed_exc_strs:
                     if exc_str in unicode(e):
+                        self._release_session(mgr, nexus_host)
+                        breaker.success()
                         return
-                try:
-                    self._close_session(mgr, nexus_host)
-                except Exception:
-                    pass
+                self._discard_session(mgr, nexus_host, flush=True)
                 if retry_count == 1:
                     first_exc = e
-                else:
+                if retry_count == attempts:
+                    breaker.failure()
                     # Raise a Neutron exception. Include a description of
                     # the original ncclient exception.
                     raise cexc.NexusConfigFailed(nexus_host=nexus_host,
                                                  config=config,
                                                  exc=first_exc)
+        breaker.success()
+        if mark_dirty and self.save_scheduler:
+            self.save_scheduler.mark_dirty(nexus_host)
 
         # if configured, close the ncclient ssh session.
         if check_to_close_session and self._get_close_ssh_session():
-            self._close_session(mgr, nexus_host)
+            self._discard_session(mgr, nexus_host)
+        else:
+            self._release_session(mgr, nexus_host)
+
+    def prewarm_session(self, nexus_host):
+        """Open a session to a switch ahead of its first request.
+
+        :param nexus_host: IP address of Nexus switch
+
+        :returns: time in seconds taken to open the session
+        """
+        start_time = time.time()
+        mgr = self._connect_with_breaker(nexus_host,
+                                         self._get_circuit_breaker(nexus_host))
+        self._release_session(mgr, nexus_host)
+        return time.time() - start_time
 
     def nxos_connect(self, nexus_host):
-        """Make SSH connection to the Nexus Switch."""
-        if getattr(self.connections.get(nexus_host), 'connected', None):
-            return self.connections[nexus_host]
+        """Check out a NETCONF session to the Nexus Switch.
 
+        Blocks while the switch's pool is exhausted, for at most
+        switch_session_checkout_timeout seconds.  The session must be
+        handed back with _release_session() or _discard_session().
+        """
+        return self._get_session_pool(nexus_host).checkout()
+
+    def _nxos_connect(self, nexus_host):
+        """Make SSH connection to the Nexus Switch."""
         if not self.ncclient:
             self.ncclient = self._import_ncclient()
         nexus_ssh_port = int(self.nexus_switches[nexus_host, 'ssh_port'])
@@ -191,8 +732,7 @@ class CiscoNexusDriver(object):
             # the original ncclient exception.
             raise cexc.NexusConnectFailed(nexus_host=nexus_host, exc=e)
 
-        self.connections[nexus_host] = man
-        return self.connections[nexus_host]
+        return man
 
     def create_xml_snippet(self, customized_config):
         """Create XML snippet.
@@ -202,12 +742,24 @@ class CiscoNexusDriver(object):
         latter command allows configuration to persist on the switch after
         reboot.
         """
-        if conf.cfg.CONF.ml2_cisco.persistent_switch_config:
+        if (conf.cfg.CONF.ml2_cisco.persistent_switch_config and
+                not self.save_scheduler):
             customized_config += (snipp.EXEC_SAVE_CONF_SNIPPET)
 
         conf_xml_snippet = snipp.EXEC_CONF_SNIPPET % (customized_config)
         return conf_xml_snippet
 
+    def save_config(self, nexus_host):
+        """Copy the running config of a switch to its startup config."""
+        confstr = snipp.EXEC_CONF_SNIPPET % snipp.EXEC_SAVE_CONF_SNIPPET
+        self._edit_config(nexus_host, target='running', config=confstr,
+                          mark_dirty=False)
+
+    def flush_config_saves(self):
+        """Save the config of switches with unsaved changes now."""
+        if self.save_scheduler:
+            self.save_scheduler.flush()
+
     def get_interface_switch_trunk_allowed(self, nexus_host,
                                            intf_type, interface):
         """Given the nexus host and specific interface data, get the
@@ -223,14 +775,142 @@ class CiscoNexusDriver(object):
            :returns False:     On error or when config CLI not present.
                     True:      When config CLI is present.
            """
+        return self.get_interface_switch_trunk_vlans(
+            nexus_host, intf_type, interface) is not None
+
+    def get_interface_switch_trunk_vlans(self, nexus_host,
+                                         intf_type, interface):
+        """Get the VLANs allowed on a trunk interface from the switch.
+
+           :param nexus_host: IP address of Nexus switch
+           :param intf_type:  String which specifies interface type.
+                              example: ethernet
+           :param interface:  String indicating which interface.
+                              example: 1/19
+
+           :returns None:      On error or when config CLI not present.
+                    set:       VLAN ids found in the config CLI.
+           """
 
         confstr = snipp.EXEC_GET_INTF_SNIPPET % (intf_type, interface)
         response = self._get_config(nexus_host, confstr)
         LOG.debug("GET call returned interface %(if_type)s %(interface)s "
             "config", {'if_type': intf_type, 'interface': interface})
-        if response and re.search("switchport trunk allowed vlan", response):
+        if not response or not re.search("switchport trunk allowed vlan",
+                                         response):
+            return None
+        vlans = set()
+        for vlan_ranges in TRUNK_ALLOWED_VLAN_RE.findall(response):
+            vlans.update(parse_vlan_ranges(vlan_ranges))
+        return vlans
+
+    def _get_cache_trunk_vlans(self):
+        return cfg.CONF.ml2_cisco.cache_trunk_allowed_vlans
+
+    def _is_trunk_allowed_configured(self, nexus_host, intf_type, interface):
+        """Determine if 'switchport trunk allowed vlan' is configured.
+
+        The switch is only asked when the interface is not in the trunk
+        VLAN cache.  Interfaces without the CLI are not cached since
+        another neutron-server process may configure them at any time.
+        """
+        key = (nexus_host, intf_type, interface)
+        if key in self.trunk_vlans:
             return True
-        return False
+        vlans = self.get_interface_switch_trunk_vlans(nexus_host,
+                                                      intf_type, interface)
+        if vlans is None:
+            return False
+        if self._get_cache_trunk_vlans():
+            self.trunk_vlans[key] = vlans
+        return True
+
+    def _update_trunk_vlans(self, nexus_host, intf_type, interface, vlanid,
+                            allowed):
+        """Record a successful trunk edit in the trunk VLAN cache.
+
+        :param vlanid: VLAN ID or range list such as '10-12,20'
+        """
+        if not self._get_cache_trunk_vlans():
+            return
+        vlans = self.trunk_vlans.setdefault(
+            (nexus_host, intf_type, interface), set())
+        if allowed:
+            vlans.update(parse_vlan_ranges(str(vlanid)))
+        else:
+            vlans.difference_update(parse_vlan_ranges(str(vlanid)))
+
+    def invalidate_trunk_vlans(self, nexus_host, intf_type=None,
+                               interface=None):
+        """Forget cached trunk state of a switch or one of its interfaces."""
+        if intf_type is not None:
+            self.trunk_vlans.pop((nexus_host, intf_type, interface), None)
+            return
+        for key in list(self.trunk_vlans):
+            if key[0] == nexus_host:
+                del self.trunk_vlans[key]
+
+    def get_switch_trunk_vlans(self, nexus_host):
+        """Get the VLANs allowed on all trunk interfaces of a switch.
+
+        Reads the running config of every interface in one request and
+        refreshes the trunk VLAN cache with it.
+
+        :param nexus_host: IP address of Nexus switch
+
+        :returns dict: {(intf_type, interface): set of VLAN ids} for the
+                       interfaces with 'switchport trunk allowed vlan'
+        """
+        response = self._get_config(nexus_host,
+                                    snipp.EXEC_GET_ALL_INTF_SNIPPET) or ''
+        matches = list(RUNNING_INTF_RE.finditer(response))
+        trunks = {}
+        for index, match in enumerate(matches):
+            end = (matches[index + 1].start() if index + 1 < len(matches)
+                   else len(response))
+            config = response[match.end():end]
+            if not re.search("switchport trunk allowed vlan", config):
+                continue
+            vlans = set()
+            for vlan_ranges in TRUNK_ALLOWED_VLAN_RE.findall(config):
+                vlans.update(parse_vlan_ranges(vlan_ranges))
+            trunks[(match.group(1).lower(), match.group(2))] = vlans
+        if self._get_cache_trunk_vlans():
+            self.invalidate_trunk_vlans(nexus_host)
+            for (intf_type, interface), vlans in trunks.items():
+                self.trunk_vlans[(nexus_host, intf_type, interface)] = (
+                    set(vlans))
+        return trunks
+
+    def get_switch_vlans(self, nexus_host):
+        """Get the VLANs configured on a switch.
+
+        :param nexus_host: IP address of Nexus switch
+
+        :returns dict: {VLAN id: VLAN name, or None when not named}
+        """
+        response = self._get_config(nexus_host,
+                                    snipp.EXEC_GET_VLAN_SNIPPET) or ''
+        vlans = {}
+        for vlan_ranges in RUNNING_VLAN_RE.findall(response):
+            for vlan_id in parse_vlan_ranges(vlan_ranges):
+                vlans.setdefault(vlan_id, None)
+        for vlan_id, vlan_name in RUNNING_VLAN_NAME_RE.findall(response):
+            vlans[int(vlan_id)] = vlan_name
+        return vlans
+
+    def get_nve_members(self, nexus_host, nve_int_num):
+        """Get the VNIs which are members of a switch NVE interface.
+
+        :param nexus_host: IP address of Nexus switch
+        :param nve_int_num: NVE interface number
+
+        :returns set: member VNIs
+        """
+        response = self._get_config(nexus_host,
+                                    snipp.EXEC_GET_NVE_SNIPPET % nve_int_num)
+        return set(int(vni) for vni in
+                   RUNNING_NVE_MEMBER_RE.findall(response or ''))
 
     def get_version(self, nexus_host):
         """Given the nexus host, get the version data.
@@ -249,6 +929,15 @@ class CiscoNexusDriver(object):
                 "\<sys_ver_str\>([\x20-\x7e]+)\<\/sys_ver_str\>", response)
         return version
 
+    def ping(self, nexus_host):
+        """Check a switch answers with a small get request.
+
+        :param nexus_host: IP address of Nexus switch
+
+        :raises NexusConfigFailed: when the switch does not answer
+        """
+        self._get_config(nexus_host, snipp.EXEC_GET_HOSTNAME_SNIPPET)
+
     def get_nexus_type(self, nexus_host):
         """Given the nexus host, get the type of Nexus switch.
 
@@ -271,11 +960,44 @@ class CiscoNexusDriver(object):
         LOG.warn(_LW("GET call failed to return Nexus type"))
         return -1
 
+    def begin_transaction(self, nexus_host):
+        """Start a batch of configuration changes for one switch."""
+        return NexusConfigTransaction(self, nexus_host)
+
+    def _get_batch_switch_config(self):
+        return cfg.CONF.ml2_cisco.batch_switch_config
+
+    def _add_vlan_fragments(self, transaction, vlanid, vlanname, vni):
+        """Add the VLAN create, active and no-shutdown commands."""
+        if vni:
+            snippet = (snipp.CMD_VLAN_CONF_VNSEGMENT_SNIPPET %
+                       (vlanid, vlanname, vni))
+        else:
+            snippet = snipp.CMD_VLAN_CONF_SNIPPET % (vlanid, vlanname)
+        transaction.add(snippet, 'vlan %s name %s' % (vlanid, vlanname),
+                        VLAN_CREATE_ALLOWED_EXC)
+        transaction.add(snipp.CMD_VLAN_ACTIVE_SNIPPET % vlanid,
+                        'vlan %s state active' % vlanid,
+                        VLAN_STATE_ALLOWED_EXC)
+        transaction.add(snipp.CMD_VLAN_NO_SHUTDOWN_SNIPPET % vlanid,
+                        'vlan %s no shutdown' % vlanid,
+                        VLAN_STATE_ALLOWED_EXC)
+
     def create_vlan(self, nexus_host, vlanid, vlanname, vni):
         """Create a VLAN on a Nexus Switch.
 
         Creates a VLAN given the VLAN ID, name and possible VxLAN ID.
         """
+        if self._get_batch_switch_config():
+            transaction = self.begin_transaction(nexus_host)
+            self._add_vlan_fragments(transaction, vlanid, vlanname, vni)
+            try:
+                transaction.commit()
+            except cexc.NexusConfigFailed:
+                with excutils.save_and_reraise_exception():
+                    self.delete_vlan(nexus_host, vlanid)
+            return
+
         if vni:
             snippet = (snipp.CMD_VLAN_CONF_VNSEGMENT_SNIPPET %
                        (vlanid, vlanname, vni))
@@ -287,7 +1009,7 @@ class CiscoNexusDriver(object):
         LOG.debug("NexusDriver: ")
 
         self._edit_config(nexus_host, target='running', config=confstr,
-                          allowed_exc_strs=["VLAN with the same name exists"],
+                          allowed_exc_strs=VLAN_CREATE_ALLOWED_EXC,
                           check_to_close_session=False)
 
         # Enable VLAN active and no-shutdown states. Some versions of
@@ -304,13 +1026,39 @@ class CiscoNexusDriver(object):
                     nexus_host,
                     target='running',
                     config=confstr,
-                    allowed_exc_strs=["Can't modify state for extended",
-                                      "Command is only allowed on VLAN"],
+                    allowed_exc_strs=VLAN_STATE_ALLOWED_EXC,
                     check_to_close_session=check_to_close_session)
             except cexc.NexusConfigFailed:
                 with excutils.save_and_reraise_exception():
                     self.delete_vlan(nexus_host, vlanid)
 
+    def create_vlans(self, nexus_host, vlans):
+        """Create several VLANs without VN segment on a Nexus Switch.
+
+        The VLANs are named in batches of up to NEXUS_MAX_VLANS_PER_EDIT
+        and their states are set per VLAN range.
+
+        :param vlans: list of (vlanid, vlanname)
+        """
+        for start in range(0, len(vlans), const.NEXUS_MAX_VLANS_PER_EDIT):
+            transaction = self.begin_transaction(nexus_host)
+            for vlanid, vlanname in (
+                    vlans[start:start + const.NEXUS_MAX_VLANS_PER_EDIT]):
+                transaction.add(
+                    snipp.CMD_VLAN_CONF_SNIPPET % (vlanid, vlanname),
+                    'vlan %s name %s' % (vlanid, vlanname),
+                    VLAN_CREATE_ALLOWED_EXC)
+            transaction.commit()
+
+        for vlan_range in format_vlan_ranges(vlanid for vlanid, vlanname
+                                             in vlans):
+            for snippet in [snipp.CMD_VLAN_ACTIVE_SNIPPET,
+                            snipp.CMD_VLAN_NO_SHUTDOWN_SNIPPET]:
+                confstr = self.create_xml_snippet(snippet % vlan_range)
+                self._edit_config(nexus_host, target='running',
+                                  config=confstr,
+                                  allowed_exc_strs=VLAN_STATE_ALLOWED_EXC)
+
     def delete_vlan(self, nexus_host, vlanid):
         """Delete a VLAN on Nexus Switch given the VLAN ID."""
         confstr = snipp.CMD_NO_VLAN_CONF_SNIPPET % vlanid
@@ -324,12 +1072,26 @@ class CiscoNexusDriver(object):
         confstr = self.create_xml_snippet(confstr)
         return confstr
 
+    def _get_trunk_vlan_snippet(self, nexus_host, intf_type, interface):
+        """Return the command template adding a VLAN to a trunk."""
+        response = self._is_trunk_allowed_configured(nexus_host,
+            intf_type, interface)
+        #
+        # If 'switchport trunk allowed vlan' not configured on the
+        # switch, configure the VLAN onto the interface without the
+        # 'add' keyword to define initial vlan config; otherwise
+        # include the 'add' keyword.
+        #
+        return (snipp.CMD_INT_VLAN_SNIPPET if (response is False)
+            else snipp.CMD_INT_VLAN_ADD_SNIPPET)
+
     def enable_vlan_on_trunk_int(self, nexus_host, vlanid, intf_type,
                                  interface):
         """Enable a VLAN on a trunk interface.
 
            :param nexus_host: IP address of Nexus switch
-           :param vlanid:     Vlanid to add to interface
+           :param vlanid:     Vlanid, or VLAN range list such as
+                              '10-12,20', to add to interface
            :param intf_type:  String which specifies interface type.
                               example: ethernet
            :param interface:  String indicating which interface.
@@ -338,24 +1100,21 @@ class CiscoNexusDriver(object):
            :returns None: if config was successfully
                     Exception object: See _edit_config for details
            """
-        response = self.get_interface_switch_trunk_allowed(nexus_host,
-            intf_type, interface)
-        #
-        # If 'switchport trunk allowed vlan' not configured on the
-        # switch, configure the VLAN onto the interface without the
-        # 'add' keyword to define initial vlan config; otherwise
-        # include the 'add' keyword.
-        #
-        snippet = (snipp.CMD_INT_VLAN_SNIPPET if (response is False)
-            else snipp.CMD_INT_VLAN_ADD_SNIPPET)
         confstr = self.build_intf_confstr(
-            snippet=snippet,
+            snippet=self._get_trunk_vlan_snippet(nexus_host, intf_type,
+                                                 interface),
             intf_type=intf_type,
             interface=interface,
             vlanid=vlanid
         )
-        self._edit_config(nexus_host, target='running',
-                          config=confstr)
+        try:
+            self._edit_config(nexus_host, target='running',
+                              config=confstr)
+        except cexc.NexusConfigFailed:
+            with excutils.save_and_reraise_exception():
+                self.invalidate_trunk_vlans(nexus_host, intf_type, interface)
+        self._update_trunk_vlans(nexus_host, intf_type, interface, vlanid,
+                                 True)
         LOG.debug("Successfully added switchport trunk vlan %(vlanid)s "
             "on int %(if_type)s %(interface)s.",
             {'vlanid': vlanid, 'if_type': intf_type,
@@ -367,11 +1126,42 @@ class CiscoNexusDriver(object):
         confstr = (snipp.CMD_NO_VLAN_INT_SNIPPET %
                    (intf_type, interface, vlanid, intf_type))
         confstr = self.create_xml_snippet(confstr)
-        self._edit_config(nexus_host, target='running', config=confstr)
+        try:
+            self._edit_config(nexus_host, target='running', config=confstr)
+        except cexc.NexusConfigFailed:
+            with excutils.save_and_reraise_exception():
+                self.invalidate_trunk_vlans(nexus_host, intf_type, interface)
+        if (nexus_host, intf_type, interface) in self.trunk_vlans:
+            self._update_trunk_vlans(nexus_host, intf_type, interface,
+                                     vlanid, False)
 
     def create_and_trunk_vlan(self, nexus_host, vlan_id, vlan_name,
                               intf_type, nexus_port, vni):
         """Create VLAN and trunk it on the specified ports."""
+        if self._get_batch_switch_config():
+            transaction = self.begin_transaction(nexus_host)
+            self._add_vlan_fragments(transaction, vlan_id, vlan_name, vni)
+            if nexus_port:
+                snippet = self._get_trunk_vlan_snippet(nexus_host,
+                                                       intf_type, nexus_port)
+                transaction.add(
+                    snippet % (intf_type, nexus_port, vlan_id, intf_type),
+                    'trunk vlan %s on %s %s' % (vlan_id, intf_type,
+                                                nexus_port))
+            try:
+                transaction.commit()
+            except cexc.NexusConfigFailed:
+                with excutils.save_and_reraise_exception():
+                    if nexus_port:
+                        self.invalidate_trunk_vlans(nexus_host, intf_type,
+                                                    nexus_port)
+                    self.delete_vlan(nexus_host, vlan_id)
+            if nexus_port:
+                self._update_trunk_vlans(nexus_host, intf_type, nexus_port,
+                                         vlan_id, True)
+            LOG.debug("NexusDriver created and trunked VLAN: %s", vlan_id)
+            return
+
         self.create_vlan(nexus_host, vlan_id, vlan_name, vni)
         LOG.debug("NexusDriver created VLAN: %s", vlan_id)
         if nexus_port:
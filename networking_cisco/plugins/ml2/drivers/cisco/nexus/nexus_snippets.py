@@ -33,6 +33,18 @@ EXEC_GET_INTF_SNIPPET = """
     <cmd>show running-config interface %s %s</cmd>
 """
 
+EXEC_GET_ALL_INTF_SNIPPET = """
+    <cmd>show running-config interface</cmd>
+"""
+
+EXEC_GET_VLAN_SNIPPET = """
+    <cmd>show running-config vlan</cmd>
+"""
+
+EXEC_GET_NVE_SNIPPET = """
+    <cmd>show running-config interface nve %s</cmd>
+"""
+
 EXEC_GET_VERSION_SNIPPET = """
     <cmd>show version</cmd>
 """
@@ -41,6 +53,10 @@ EXEC_GET_INVENTORY_SNIPPET = """
     <cmd>show inventory</cmd>
 """
 
+EXEC_GET_HOSTNAME_SNIPPET = """
+    <cmd>show hostname</cmd>
+"""
+
 EXEC_SAVE_CONF_SNIPPET = """
             <cmd>copy running-config startup-config</cmd>
 """
@@ -14,13 +14,15 @@
 #    under the License.
 #
 
+import heapq
 import netaddr
+import time
 
 from oslo_config import cfg
 from oslo_log import log
-from oslo_utils import excutils
 import six
 import sqlalchemy as sa
+from sqlalchemy import event
 
 from networking_cisco.plugins.ml2.drivers.cisco.nexus import (
     constants as const)
@@ -32,6 +34,7 @@ from neutron.db import api as db_api
 from neutron.i18n import _LE, _LI, _LW
 from neutron.plugins.common import constants as p_const
 from neutron.plugins.ml2 import driver_api as api
+from neutron.plugins.ml2.drivers import helpers
 from neutron.plugins.ml2.drivers import type_tunnel
 
 LOG = log.getLogger(__name__)
@@ -39,6 +42,9 @@ LOG = log.getLogger(__name__)
 # Nexus switches start VNI at 4096 = max VLAN + 2 (2 for reserved VLAN 0, 4095)
 MIN_NEXUS_VNI = p_const.MAX_VLAN_TAG + 2
 
+# Number of rows read or inserted at a time when syncing the allocations.
+VNI_SYNC_BULK_SIZE = 5000
+
 nexus_vxlan_opts = [
     cfg.ListOpt('vni_ranges',
                 default=[],
@@ -47,16 +53,102 @@ nexus_vxlan_opts = [
     cfg.ListOpt('mcast_ranges',
                 default=[],
                 help=_("List of multicast groups to be used for global VNIDs"
-                       "in the format - a:b,c,e:f."))
+                       "in the format - a:b,c,e:f.")),
+    cfg.IntOpt('mcast_group_resync_interval',
+               default=300,
+               help=_("Seconds after which the in-memory multicast group "
+                      "usage counts are reloaded from the database.")),
+    cfg.BoolOpt('vni_range_allocation',
+                default=False,
+                help=_("Keep the free VNIs as ranges instead of one "
+                       "allocation row per VNI. Only allocated VNIs then "
+                       "have a row."))
 ]
 
 cfg.CONF.register_opts(nexus_vxlan_opts, "ml2_type_nexus_vxlan")
 
 
+def _merge_vni_ranges(vni_ranges):
+    """Return the sorted union of (first, last) VNI ranges."""
+    merged = []
+    for first, last in sorted(vni_ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+    return [tuple(vni_range) for vni_range in merged]
+
+
+def _subtract_vnis(vni_ranges, vnis):
+    """Yield the (first, last) parts of sorted ranges not in sorted vnis."""
+    vnis = iter(vnis)
+    vni = next(vnis, None)
+    for first, last in vni_ranges:
+        while vni is not None and vni <= last:
+            if vni >= first:
+                if vni > first:
+                    yield first, vni - 1
+                first = vni + 1
+            vni = next(vnis, None)
+        if first <= last:
+            yield first, last
+
+
+class McastGroupUsage(object):
+    """Counts the VNIs associated with each configured multicast group.
+
+    The groups are kept in a heap ordered by usage, then by configuration
+    order, so the least used group is found in O(log n).  Heap entries
+    are only valid while they hold the current count of their group, the
+    others are dropped when they reach the top.
+    """
+
+    def __init__(self, groups, usage):
+        self.groups = list(groups)
+        self._index = dict((group, index)
+                           for index, group in enumerate(self.groups))
+        self._counts = [usage.get(group, 0) for group in self.groups]
+        self._build_heap()
+        self.loaded = time.time()
+
+    def _build_heap(self):
+        self._heap = [(count, index)
+                      for index, count in enumerate(self._counts)]
+        heapq.heapify(self._heap)
+
+    def least_used(self):
+        """Return the least used group, or None if none is configured."""
+        while self._heap:
+            count, index = self._heap[0]
+            if count == self._counts[index]:
+                return self.groups[index]
+            heapq.heappop(self._heap)
+
+    def _update(self, group, delta):
+        index = self._index.get(group)
+        if index is None:
+            return
+        self._counts[index] = max(0, self._counts[index] + delta)
+        heapq.heappush(self._heap, (self._counts[index], index))
+        if len(self._heap) > 2 * len(self._counts) + 16:
+            self._build_heap()
+
+    def add(self, group):
+        self._update(group, 1)
+
+    def remove(self, group):
+        self._update(group, -1)
+
+    def get_count(self, group):
+        index = self._index.get(group)
+        return self._counts[index] if index is not None else 0
+
+
 class NexusVxlanTypeDriver(type_tunnel.TunnelTypeDriver):
     def __init__(self):
         super(NexusVxlanTypeDriver, self).__init__(
             nexus_models_v2.NexusVxlanAllocation)
+        self._mcast_usage = None
 
     def _get_mcast_group_for_vni(self, session, vni):
         mcast_grp = (session.query(nexus_models_v2.NexusMcastGroup).
@@ -126,36 +218,150 @@ class NexusVxlanTypeDriver(type_tunnel.TunnelTypeDriver):
                 if mcast_ip.is_multicast():
                     yield str(mcast_ip)
 
+    def _get_mcast_usage(self, session):
+        """Return the multicast group usage, reloading it when due."""
+        usage = self._mcast_usage
+        if (usage is None or time.time() - usage.loaded >
+                cfg.CONF.ml2_type_nexus_vxlan.mcast_group_resync_interval):
+            mcast = nexus_models_v2.NexusMcastGroup
+            counts = dict(session.query(mcast.mcast_group,
+                                        sa.func.count(mcast.mcast_group)).
+                          group_by(mcast.mcast_group).all())
+            usage = McastGroupUsage(self._parse_mcast_ranges(), counts)
+            self._mcast_usage = usage
+        return usage
+
     def _allocate_mcast_group(self, session, vni):
-        allocs = dict(session.query(nexus_models_v2.
-                                    NexusMcastGroup.mcast_group,
-                      sa.func.count(nexus_models_v2.
-                                    NexusMcastGroup.mcast_group)).
-                      group_by(nexus_models_v2.
-                               NexusMcastGroup.mcast_group).all())
-
-        mcast_for_vni = None
-        for mcast_ip in self._parse_mcast_ranges():
-            if not unicode(mcast_ip) in allocs:
-                mcast_for_vni = mcast_ip
-                break
-        try:
-            if not mcast_for_vni:
-                mcast_for_vni = min(allocs, key=allocs.get)
-        except ValueError:
-            with excutils.save_and_reraise_exception():
-                LOG.exception(_LE("Unable to allocate a multicast group for "
-                                  "VNID:%s"), vni)
+        usage = self._get_mcast_usage(session)
+        mcast_for_vni = usage.least_used()
+        if not mcast_for_vni:
+            LOG.error(_LE("Unable to allocate a multicast group for "
+                          "VNID:%s"), vni)
+            raise ValueError(_("No multicast group configured"))
 
         alloc = nexus_models_v2.NexusMcastGroup(mcast_group=mcast_for_vni,
                                 associated_vni=vni)
 
         session.add(alloc)
         session.flush()
+        self._watch_mcast_usage(session)
+        usage.add(mcast_for_vni)
         return mcast_for_vni
 
+    def _release_mcast_group(self, session, vni):
+        """Remove the multicast group association of a VNI."""
+        mcast_rows = (session.query(nexus_models_v2.NexusMcastGroup).
+                      filter_by(associated_vni=vni).all())
+        for mcast_row in mcast_rows:
+            session.delete(mcast_row)
+            if self._mcast_usage:
+                self._watch_mcast_usage(session)
+                self._mcast_usage.remove(mcast_row.mcast_group)
+
+    def _watch_mcast_usage(self, session):
+        """Reload the multicast group usage if the session rolls back.
+
+        The usage counts are updated before the transaction commits, so
+        they are dropped and rebuilt from the database on a rollback.
+        """
+        if not event.contains(session, 'after_rollback',
+                              self._reset_mcast_usage):
+            event.listen(session, 'after_rollback', self._reset_mcast_usage)
+
+    def _reset_mcast_usage(self, session):
+        self._mcast_usage = None
+
+    def _use_vni_ranges(self):
+        return cfg.CONF.ml2_type_nexus_vxlan.vni_range_allocation
+
+    def _allocate_vni(self, session, vni=None):
+        """Allocate a VNI from the free VNI ranges.
+
+        :param vni: VNI to allocate, by default the lowest free VNI
+        :returns: the allocation row, or None if no VNI is available or
+                  the VNI is already allocated
+        """
+        free = nexus_models_v2.NexusVxlanFreeRange
+        with session.begin(subtransactions=True):
+            select = session.query(free.id, free.first_vni, free.last_vni)
+            if vni is None:
+                select = select.order_by(free.first_vni)
+            else:
+                select = select.filter(free.first_vni <= vni,
+                                       free.last_vni >= vni)
+
+            # The selected range can be changed by someone else before it
+            # is updated, so retry until the update succeeds.
+            for attempt in range(1, helpers.DB_MAX_ATTEMPTS + 1):
+                free_range = select.first()
+                if not free_range:
+                    if vni is None or self.get_allocation(session, vni):
+                        return
+                    alloc_vni = vni
+                    break
+                alloc_vni = free_range.first_vni if vni is None else vni
+                if self._take_vni(session, free_range, alloc_vni):
+                    break
+                LOG.debug("Allocate VNI %(vni)s from range %(first)s-%(last)s,"
+                          " attempt %(attempt)s failed",
+                          {'vni': alloc_vni, 'first': free_range.first_vni,
+                           'last': free_range.last_vni, 'attempt': attempt})
+            else:
+                LOG.warning(_LW("Allocate VNI from ranges failed after "
+                                "%(number)s failed attempts"),
+                            {'number': helpers.DB_MAX_ATTEMPTS})
+                raise exc.NoNetworkFoundInMaximumAllowedAttempts()
+
+            alloc = nexus_models_v2.NexusVxlanAllocation(vxlan_vni=alloc_vni,
+                                                         allocated=True)
+            session.add(alloc)
+        return alloc
+
+    def _take_vni(self, session, free_range, vni):
+        """Remove a VNI from a free range unless the range has changed.
+
+        Only the range holding the VNI is changed.
+
+        :returns: True if the VNI was removed
+        """
+        free = nexus_models_v2.NexusVxlanFreeRange
+        first_vni, last_vni = free_range.first_vni, free_range.last_vni
+        query = session.query(free).filter_by(id=free_range.id,
+                                              first_vni=first_vni,
+                                              last_vni=last_vni)
+        if first_vni == last_vni:
+            return query.delete() == 1
+        if vni == first_vni:
+            return query.update({'first_vni': vni + 1}) == 1
+        if vni == last_vni:
+            return query.update({'last_vni': vni - 1}) == 1
+        if query.update({'last_vni': vni - 1}) != 1:
+            return False
+        session.add(free(first_vni=vni + 1, last_vni=last_vni))
+        return True
+
+    def _free_vni(self, session, vni):
+        """Return a VNI to the free VNI ranges, merging adjacent ranges."""
+        free = nexus_models_v2.NexusVxlanFreeRange
+        before = (session.query(free).filter_by(last_vni=vni - 1).
+                  with_lockmode('update').first())
+        after = (session.query(free).filter_by(first_vni=vni + 1).
+                 with_lockmode('update').first())
+        if before and after:
+            before.last_vni = after.last_vni
+            session.delete(after)
+        elif before:
+            before.last_vni = vni
+        elif after:
+            after.first_vni = vni
+        else:
+            session.add(free(first_vni=vni, last_vni=vni))
+
     def allocate_tenant_segment(self, session):
-        alloc = self.allocate_partially_specified_segment(session)
+        if self._use_vni_ranges():
+            alloc = self._allocate_vni(session)
+        else:
+            alloc = self.allocate_partially_specified_segment(session)
         if not alloc:
             return
         vni = alloc.vxlan_vni
@@ -169,53 +375,93 @@ class NexusVxlanTypeDriver(type_tunnel.TunnelTypeDriver):
         Synchronize vxlan_allocations table with configured tunnel ranges.
         """
 
-        # determine current configured allocatable vnis
-        vxlan_vnis = set()
-        for tun_min, tun_max in self.tunnel_ranges:
-            vxlan_vnis |= set(six.moves.range(tun_min, tun_max + 1))
+        if self._use_vni_ranges():
+            self._sync_vni_ranges()
+            return
 
+        alloc_model = nexus_models_v2.NexusVxlanAllocation
+        vxlan_ranges = _merge_vni_ranges(self.tunnel_ranges)
         session = db_api.get_session()
         with session.begin(subtransactions=True):
-            # remove from table unallocated tunnels not currently allocatable
-            # fetch results as list via all() because we'll be iterating
-            # through them twice
-            allocs = (session.query(nexus_models_v2.NexusVxlanAllocation).
-                      with_lockmode("update").all())
-            # collect all vnis present in db
-            existing_vnis = set(alloc.vxlan_vni for alloc in allocs)
-            # collect those vnis that needs to be deleted from db
-            vnis_to_remove = [alloc.vxlan_vni for alloc in allocs
-                              if (alloc.vxlan_vni not in vxlan_vnis and
-                                  not alloc.allocated)]
-            # Immediately delete vnis in chunks. This leaves no work for
-            # flush at the end of transaction
-            bulk_size = 100
-            chunked_vnis = (vnis_to_remove[i:i + bulk_size] for i in
-                            range(0, len(vnis_to_remove), bulk_size))
-            for vni_list in chunked_vnis:
-                session.query(nexus_models_v2.NexusVxlanAllocation).filter(
-                    nexus_models_v2.NexusVxlanAllocation.
-                    vxlan_vni.in_(vni_list)).delete(
-                        synchronize_session=False)
-            # collect vnis that need to be added
-            vnis = list(vxlan_vnis - existing_vnis)
-            chunked_vnis = (vnis[i:i + bulk_size] for i in
-                            range(0, len(vnis), bulk_size))
-            for vni_list in chunked_vnis:
-                bulk = [{'vxlan_vni': vni, 'allocated': False}
-                        for vni in vni_list]
-                session.execute(nexus_models_v2.NexusVxlanAllocation.
-                                __table__.insert(), bulk)
+            # Stream the existing vnis in order and work out the gaps of
+            # the configured ranges which have no row yet.  Only the gaps
+            # are kept, as (first, last) ranges.  The stream is read to
+            # its end before the next statement is sent.
+            gaps = []
+            if vxlan_ranges:
+                existing_vnis = (
+                    row.vxlan_vni for row in
+                    session.query(alloc_model.vxlan_vni).
+                    filter(alloc_model.vxlan_vni.between(
+                        vxlan_ranges[0][0], vxlan_ranges[-1][1])).
+                    order_by(alloc_model.vxlan_vni).
+                    with_lockmode("update").
+                    execution_options(stream_results=True).
+                    yield_per(VNI_SYNC_BULK_SIZE))
+                gaps = list(_subtract_vnis(vxlan_ranges, existing_vnis))
+
+            # remove from table unallocated tunnels not currently
+            # allocatable with a single statement
+            stale = session.query(alloc_model).filter_by(allocated=False)
+            if vxlan_ranges:
+                stale = stale.filter(~sa.or_(*[
+                    alloc_model.vxlan_vni.between(first, last)
+                    for first, last in vxlan_ranges]))
+            stale.delete(synchronize_session=False)
+
+            # add the missing vnis in large bulk inserts
+            for first, last in gaps:
+                for bulk_first in six.moves.range(first, last + 1,
+                                                  VNI_SYNC_BULK_SIZE):
+                    bulk_last = min(last, bulk_first + VNI_SYNC_BULK_SIZE - 1)
+                    bulk = [{'vxlan_vni': vni, 'allocated': False}
+                            for vni in six.moves.range(bulk_first,
+                                                       bulk_last + 1)]
+                    session.execute(alloc_model.__table__.insert(), bulk)
+            # free VNI ranges are only used by vni_range_allocation
+            session.query(nexus_models_v2.NexusVxlanFreeRange).delete(
+                synchronize_session=False)
+
+    def _sync_vni_ranges(self):
+        """Rebuild the free VNI ranges from the configured tunnel ranges.
+
+        Only allocated VNIs keep a row in the allocations table, so the
+        free ranges are the configured ranges minus the allocated VNIs.
+        """
+        alloc_model = nexus_models_v2.NexusVxlanAllocation
+        free = nexus_models_v2.NexusVxlanFreeRange
+        session = db_api.get_session()
+        with session.begin(subtransactions=True):
+            session.query(free).with_lockmode('update').all()
+            session.query(alloc_model).filter_by(allocated=False).delete(
+                synchronize_session=False)
+            allocated = (row.vxlan_vni for row in
+                         session.query(alloc_model.vxlan_vni).
+                         order_by(alloc_model.vxlan_vni))
+            free_ranges = [
+                {'first_vni': first, 'last_vni': last}
+                for first, last in _subtract_vnis(
+                    _merge_vni_ranges(self.tunnel_ranges), allocated)]
+            session.query(free).delete(synchronize_session=False)
+            if free_ranges:
+                session.execute(free.__table__.insert(), free_ranges)
 
     def reserve_provider_segment(self, session, segment):
+        use_vni_ranges = self._use_vni_ranges()
         if self.is_partial_segment(segment):
-            alloc = self.allocate_partially_specified_segment(session)
+            if use_vni_ranges:
+                alloc = self._allocate_vni(session)
+            else:
+                alloc = self.allocate_partially_specified_segment(session)
             if not alloc:
                 raise exc.NoNetworkAvailable
         else:
             segmentation_id = segment.get(api.SEGMENTATION_ID)
-            alloc = self.allocate_fully_specified_segment(
-                session, vxlan_vni=segmentation_id)
+            if use_vni_ranges:
+                alloc = self._allocate_vni(session, int(segmentation_id))
+            else:
+                alloc = self.allocate_fully_specified_segment(
+                    session, vxlan_vni=segmentation_id)
             if not alloc:
                 raise exc.TunnelIdInUse(tunnel_id=segmentation_id)
         return {api.NETWORK_TYPE: p_const.TYPE_VXLAN,
@@ -230,16 +476,21 @@ class NexusVxlanTypeDriver(type_tunnel.TunnelTypeDriver):
         with session.begin(subtransactions=True):
             query = (session.query(nexus_models_v2.NexusVxlanAllocation).
                      filter_by(vxlan_vni=vxlan_vni))
-            if inside:
+            if self._use_vni_ranges():
+                self._release_mcast_group(session, vxlan_vni)
+                count = query.delete(synchronize_session=False)
+                if count and inside:
+                    self._free_vni(session, vxlan_vni)
+                    LOG.debug("Releasing vxlan tunnel %s to pool",
+                              vxlan_vni)
+            elif inside:
                 count = query.update({"allocated": False})
                 if count:
-                    mcast_row = (
-                        session.query(nexus_models_v2.NexusMcastGroup)
-                        .filter_by(associated_vni=vxlan_vni).first())
-                    session.delete(mcast_row)
+                    self._release_mcast_group(session, vxlan_vni)
                     LOG.debug("Releasing vxlan tunnel %s to pool",
                               vxlan_vni)
             else:
+                self._release_mcast_group(session, vxlan_vni)
                 count = query.delete()
                 if count:
                     LOG.debug("Releasing vxlan tunnel %s outside pool",
@@ -14,6 +14,7 @@
 
 import copy
 import sys
+import time
 
 import mock
 import netaddr
@@ -586,3 +587,66 @@ class ASR1kRoutingDriver(base.BaseTestCase):
         self.driver._get_running_config = mock.MagicMock()
         self.driver.get_configuration()
         self.driver._get_running_config.assert_called_once_with(split=False)
+
+    def _set_running_config(self, running_cfg):
+        rpc_reply = mock.MagicMock()
+        rpc_reply._raw = ("<rpc-reply><data><cli-config-data-block>%s"
+                          "</cli-config-data-block></data></rpc-reply>" %
+                          running_cfg)
+        self.driver._ncc_connection.get_config.return_value = rpc_reply
+
+    def test_get_running_config_cached(self):
+        self._set_running_config("interface GigabitEthernet0/0/0\n"
+                                 " no ip address\n")
+        get_config = self.driver._ncc_connection.get_config
+        self.assertEqual(['interface GigabitEthernet0/0/0',
+                          ' no ip address', ''],
+                         self.driver._get_running_config())
+        self.assertEqual("interface GigabitEthernet0/0/0\n no ip address\n",
+                         self.driver._get_running_config(split=False))
+        self.assertEqual(1, get_config.call_count)
+        self.assertEqual({'fetches': 1, 'fetches_avoided': 1},
+                         self.driver.get_running_config_cache_stats())
+
+        # Modifying the configuration discards the cached running config
+        self.driver._edit_running_config(csr_snippets.CLEAR_DYN_NAT_TRANS,
+                                         'CLEAR_DYN_NAT_TRANS')
+        self.driver._get_running_config()
+        self.assertEqual(1, get_config.call_count)
+        self.driver._edit_running_config(snippets.EMPTY_SNIPPET,
+                                         'EMPTY_SNIPPET')
+        self.driver._get_running_config()
+        self.assertEqual(2, get_config.call_count)
+
+        with mock.patch.object(iosxe_driver.time, 'time',
+                               return_value=time.time() + 11):
+            self.driver._get_running_config()
+        self.assertEqual(3, get_config.call_count)
+
+    def test_get_running_config_index_cached(self):
+        self._set_running_config("vrf definition %s\n"
+                                 "interface GigabitEthernet0/0/0.%s\n"
+                                 " ip address %s %s\n" %
+                                 (self.vrf, self.vlan_int, self.gw_ip,
+                                  self.gw_ip_mask))
+        itfc = 'GigabitEthernet0/0/0.%s' % self.vlan_int
+        cfg_index = self.driver._get_running_config_index()
+        self.assertIs(cfg_index, self.driver._get_running_config_index())
+        self.assertTrue(self.driver._interface_exists(itfc))
+        self.assertEqual(self.gw_ip, self.driver._get_interface_ip(itfc))
+        self.assertEqual(
+            1, self.driver._ncc_connection.get_config.call_count)
+        # A new connection discards the cached running config
+        self.driver.clear_connection()
+        self.driver._ncc_connection = mock.MagicMock()
+        self._set_running_config("vrf definition %s\n" % self.vrf)
+        self.assertIsNot(cfg_index, self.driver._get_running_config_index())
+        self.assertFalse(self.driver._interface_exists(itfc))
+
+    def test_get_running_config_cache_disabled(self):
+        cfg.CONF.set_override('running_config_cache_max_age', 0, 'cfg_agent')
+        self._set_running_config("interface GigabitEthernet0/0/0\n")
+        self.driver._get_running_config()
+        self.driver._get_running_config()
+        self.assertEqual(2,
+                         self.driver._ncc_connection.get_config.call_count)
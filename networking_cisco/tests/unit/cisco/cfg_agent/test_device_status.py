@@ -14,13 +14,17 @@
 import sys
 
 import datetime
+import eventlet
 import mock
+import time
 from oslo_utils import uuidutils
 
 sys.modules['ncclient'] = mock.MagicMock()
 sys.modules['ciscoconfparse'] = mock.MagicMock()
+from networking_cisco.plugins.cisco.cfg_agent import cfg_exceptions
 from networking_cisco.plugins.cisco.cfg_agent import device_status
 from neutron.tests import base
+from oslo_config import cfg
 
 import networking_cisco.plugins.cisco.common.cisco_constants as cc
 _uuid = uuidutils.generate_uuid
@@ -31,6 +35,12 @@ NOW = 0
 BOOT_TIME = 420
 DEAD_TIME = 300
 BELOW_BOOT_TIME = 100
+PING_OUTPUT = """PING 10.0.0.1 (10.0.0.1) 56(84) bytes of data.
+
+--- 10.0.0.1 ping statistics ---
+5 packets transmitted, 4 received, 20% packet loss, time 803ms
+rtt min/avg/max/mdev = 0.041/0.052/0.067/0.010 ms
+"""
 
 
 def create_timestamp(seconds_from_now, type=TYPE_STRING):
@@ -48,6 +58,10 @@ class TestHostingDevice(base.BaseTestCase):
         super(TestHostingDevice, self).setUp()
         self.status = device_status.DeviceStatus()
         device_status._is_pingable = mock.MagicMock(return_value=True)
+        # The backlog is pinged in one pass, each address answering as
+        # _is_pingable does.
+        mock.patch.object(device_status, 'probe_hosts',
+                          side_effect=self._probe_hosts).start()
 
         self.hosting_device = {'id': 123,
                                'host_type': 'CSR1kv',
@@ -64,6 +78,10 @@ class TestHostingDevice(base.BaseTestCase):
         self.router = {id: self.router_id,
                        'hosting_device': self.hosting_device}
 
+    def _probe_hosts(self, ips):
+        return dict((ip, {'received': int(device_status._is_pingable(ip))})
+                    for ip in ips)
+
     def test_hosting_devices_object(self):
         self.assertEqual({}, self.status.backlog_hosting_devices)
 
@@ -143,6 +161,40 @@ class TestHostingDevice(base.BaseTestCase):
         self.hosting_device['hd_state'] = 'Active'
         self.status.backlog_hosting_devices.clear()
 
+    def test_is_hosting_device_reachable_cached(self):
+        self.assertTrue(self.status.is_hosting_device_reachable(
+            self.hosting_device))
+        device_status._is_pingable.reset_mock()
+        hd = dict(self.hosting_device, created_at=self.created_at_str)
+        self.assertTrue(self.status.is_hosting_device_reachable(hd))
+        self.assertEqual(0, device_status._is_pingable.call_count)
+        self.assertEqual(self.hosting_device['created_at'], hd['created_at'])
+        self.assertEqual({'hits': 1, 'misses': 1},
+                         self.status.get_reachability_cache_stats())
+
+    def test_is_hosting_device_reachable_cache_expired(self):
+        self.assertTrue(self.status.is_hosting_device_reachable(
+            self.hosting_device))
+        device_status._is_pingable.reset_mock()
+        device_status._is_pingable.return_value = False
+        with mock.patch.object(device_status.time, 'time',
+                               return_value=time.time() + 31):
+            self.assertFalse(self.status.is_hosting_device_reachable(
+                self.hosting_device))
+        self.assertEqual(1, device_status._is_pingable.call_count)
+
+    def test_is_hosting_device_reachable_cache_invalidated(self):
+        self.assertTrue(self.status.is_hosting_device_reachable(
+            self.hosting_device))
+        device_status._is_pingable.reset_mock()
+        device_status._is_pingable.return_value = False
+        self.status.invalidate_reachability(self.hosting_device['id'])
+        self.assertFalse(self.status.is_hosting_device_reachable(
+            self.hosting_device))
+        self.assertEqual(1, device_status._is_pingable.call_count)
+        self.assertEqual({'hits': 0, 'misses': 2},
+                         self.status.get_reachability_cache_stats())
+
     def test_check_backlog_empty(self):
 
         expected = {'reachable': [],
@@ -361,6 +413,102 @@ class TestHostingDevice(base.BaseTestCase):
             self.status.backlog_hosting_devices[hd_id]['hd']['hd_state'])
         self.assertEqual(cc.HD_ACTIVE, post_hd_state)
 
+    def test_check_backlog_concurrent(self):
+        """Test that dead hosting devices are checked concurrently.
+
+        A hosting device whose NETCONF check does not complete within the
+        per device deadline must not hold up the check of the others.
+        """
+        cfg.CONF.set_override('backlog_check_timeout', 1, 'cfg_agent')
+
+        def get_driver(hd_id):
+            driver = mock.MagicMock()
+            driver.send_empty_cfg.side_effect = lambda: eventlet.sleep(
+                10 if hd_id == 100 else 0.2)
+            return driver
+
+        for i in range(1, 101):
+            hd = dict(self.hosting_device, id=i,
+                      management_ip_address='10.0.0.%d' % i,
+                      created_at=create_timestamp(BOOT_TIME + 10),
+                      hd_state=cc.HD_DEAD)
+            self.status.backlog_hosting_devices[i] = {'hd': hd}
+        drv_mgr = mock.MagicMock()
+        drv_mgr.get_driver_for_hosting_device.side_effect = get_driver
+        start = time.time()
+        res = self.status.check_backlogged_hosting_devices(drv_mgr)
+        # All devices are pinged in one pass
+        self.assertEqual(1, device_status.probe_hosts.call_count)
+        # 100 devices taking 0.2 seconds each, 16 at a time
+        self.assertLess(time.time() - start, 3)
+        self.assertEqual(list(range(1, 100)), sorted(res['revived']))
+        self.assertEqual(cc.HD_DEAD,
+                         self.status.backlog_hosting_devices[100]['hd'][
+                             'hd_state'])
+
+    def test_check_backlog_time_limit(self):
+        """Test that checking the backlog stops at its time limit."""
+        hd = self.hosting_device
+        hd['created_at'] = create_timestamp(BOOT_TIME + 10)
+        hd['hd_state'] = cc.HD_DEAD
+        self.status.backlog_hosting_devices[hd['id']] = {'hd': hd}
+        drv_mgr = mock.MagicMock()
+        driver = drv_mgr.get_driver_for_hosting_device.return_value
+        driver.send_empty_cfg.side_effect = lambda: eventlet.sleep(10)
+        start = time.time()
+        res = self.status.check_backlogged_hosting_devices(drv_mgr,
+                                                           time_limit=0.5)
+        self.assertLess(time.time() - start, 2)
+        self.assertEqual([], res['revived'])
+        self.assertEqual(cc.HD_DEAD, hd['hd_state'])
+
+    def test_check_backlog_dead_hosting_device_spacing(self):
+        cfg.CONF.set_override('dead_device_max_probe_interval', 4,
+                              'cfg_agent')
+        hd = self.hosting_device
+        hd['created_at'] = create_timestamp(BOOT_TIME + DEAD_TIME + 10)
+        hd['hd_state'] = cc.HD_DEAD
+        hd_id = hd['id']
+        self.status.backlog_hosting_devices[hd_id] = {'hd': hd}
+        device_status._is_pingable.return_value = False
+        drv_mgr = mock.MagicMock()
+        driver = drv_mgr.get_driver_for_hosting_device.return_value
+        driver.send_empty_cfg.side_effect = cfg_exceptions.DriverException()
+        now = time.time()
+        # An unreachable dead hosting device is pinged on every check
+        for offset in range(3):
+            device_status._is_pingable.reset_mock()
+            with mock.patch.object(device_status.time, 'time',
+                                   return_value=now + offset):
+                self.status.check_backlogged_hosting_devices(drv_mgr)
+            self.assertTrue(device_status._is_pingable.called)
+        self.assertEqual(0, driver.send_empty_cfg.call_count)
+
+        # Once it answers pings, its NETCONF readiness is checked after
+        # 0, 2, 6 and 10 seconds, not in between
+        device_status._is_pingable.return_value = True
+        now += 3
+        for offset, checked in ((0, True), (1, False), (2, True),
+                                (5, False), (6, True), (9, False),
+                                (10, True)):
+            device_status._is_pingable.reset_mock()
+            driver.send_empty_cfg.reset_mock()
+            with mock.patch.object(device_status.time, 'time',
+                                   return_value=now + offset):
+                res = self.status.check_backlogged_hosting_devices(drv_mgr)
+            self.assertTrue(device_status._is_pingable.called)
+            self.assertEqual(checked, driver.send_empty_cfg.called)
+            self.assertEqual([], res['revived'])
+
+        # A dead hosting device which is NETCONF ready is revived
+        driver.send_empty_cfg.side_effect = None
+        with mock.patch.object(device_status.time, 'time',
+                               return_value=now + 14):
+            res = self.status.check_backlogged_hosting_devices(drv_mgr)
+        self.assertEqual([hd_id], res['revived'])
+        self.assertNotIn('next_probe',
+                         self.status.backlog_hosting_devices[hd_id])
+
     def test_get_dead_hosting_devices_info(self):
 
         hd1 = {'id': 'fakeid1', 'hd_state': 'Active'}
@@ -371,3 +519,38 @@ class TestHostingDevice(base.BaseTestCase):
         }
         self.assertEqual(['fakeid2'],
                          self.status.get_dead_hosting_devices_info())
+
+
+class TestIcmpProbe(base.BaseTestCase):
+
+    def test_probe_hosts_loopback(self):
+        sock, raw = device_status._open_icmp_socket()
+        if sock is None:
+            self.skipTest("Not permitted to open ICMP sockets")
+        sock.close()
+        targets = ['127.0.%d.%d' % (i // 250, i % 250 + 1)
+                   for i in range(500)]
+        start = time.time()
+        result = device_status.probe_hosts(targets, count=1, timeout=1)
+        # All targets are probed in one pass, not one timeout per target
+        self.assertLess(time.time() - start, 2)
+        self.assertEqual(set(targets), set(result))
+        for stats in result.values():
+            self.assertEqual(1, stats['sent'])
+            self.assertEqual(1, stats['received'])
+            self.assertEqual(0.0, stats['loss'])
+            self.assertIsNotNone(stats['rtt_avg'])
+
+    def test_probe_hosts_ping_fallback(self):
+        with mock.patch.object(device_status, '_open_icmp_socket',
+                               return_value=(None, False)):
+            with mock.patch.object(device_status.linux_utils, 'execute',
+                                   return_value=PING_OUTPUT) as execute:
+                result = device_status.probe_hosts(['10.0.0.1'], count=5,
+                                                   timeout=1, interval=0.2)
+        execute.assert_called_once_with(
+            ['ping', '-c', '5', '-W', '1', '-i', '0.2', '10.0.0.1'],
+            check_exit_code=True)
+        self.assertEqual({'sent': 5, 'received': 4, 'loss': 20.0,
+                          'rtt_min': 0.041, 'rtt_avg': 0.052,
+                          'rtt_max': 0.067}, result['10.0.0.1'])
@@ -0,0 +1,137 @@
+# Copyright 2016 Cisco Systems, Inc.  All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from oslo_serialization import jsonutils
+
+from networking_cisco.tests import base
+
+from networking_cisco.plugins.cisco.cfg_agent.device_drivers.csr1kv import (
+    iosxe_running_config)
+
+CFG_FILES = ['asr_basic_running_cfg.json',
+             'asr_basic_running_cfg_no_multi_region.json',
+             'asr_running_cfg.json',
+             'asr_running_cfg_no_R2.json',
+             'asr_running_cfg_with_invalid_intfs.json']
+
+
+class IosXeRunningConfig(base.TestCase):
+
+    def _read_asr_running_cfg(self, file_name='asr_running_cfg.json'):
+        """
+        helper function for reading sample asr running cfg files (json format)
+        """
+        asr_running_cfg = (
+            '/unit/cisco/etc/cfg_syncer/%s' % (file_name))
+
+        with open(base.ROOTDIR + asr_running_cfg, 'r') as fp:
+            asr_running_cfg_json = jsonutils.load(fp)
+            return asr_running_cfg_json
+
+    def setUp(self):
+        super(IosXeRunningConfig, self).setUp()
+        self.cfg_index = iosxe_running_config.IosXeRunningConfig(
+            self._read_asr_running_cfg())
+
+    def test_interfaces(self):
+        self.assertTrue(self.cfg_index.has_interface('Port-channel10.2005'))
+        self.assertFalse(self.cfg_index.has_interface('Port-channel10.200'))
+        self.assertEqual(
+            '192.168.3.15',
+            self.cfg_index.get_interface_ip('Port-channel10.2005'))
+        self.assertIsNone(self.cfg_index.get_interface_ip('Port-channel10'))
+        self.assertEqual(['interface Port-channel10.2499',
+                          ' ip nat outside'],
+                         self.cfg_index.get_interface_cfg(
+                             'Port-channel10.2499'))
+        self.assertEqual([], self.cfg_index.get_interface_cfg('Loopback0'))
+
+    def test_vrfs(self):
+        self.assertEqual(['Mgmt-intf',
+                          'nrouter-3ea5f9-0000002',
+                          'nrouter-92740e-0000002',
+                          'nrouter-9ad979-0000001',
+                          'nrouter-bdc5b5-0000002'], self.cfg_index.vrfs)
+
+    def test_acls(self):
+        self.assertEqual([' permit 192.168.3.0 0.0.0.255'],
+                         self.cfg_index.get_acl(
+                             'neutron_acl_0000001_2005_xxxxxxxx'))
+        self.assertIsNone(self.cfg_index.get_acl('neutron_acl_0000001_2005'))
+
+    def test_nat_rules(self):
+        self.assertEqual(
+            'ip nat inside source list neutron_acl_0000002_2577_3f70129a '
+            'pool nrouter-bdc5b5-0000002_nat_pool vrf nrouter-bdc5b5-0000002 '
+            'overload',
+            self.cfg_index.get_nat_rule('neutron_acl_0000002_2577_3f70129a',
+                                        'nrouter-bdc5b5-0000002'))
+        self.assertIsNone(self.cfg_index.get_nat_rule(
+            'neutron_acl_0000002_2577_3f70129a', 'nrouter-9ad979-0000001'))
+        self.assertEqual(6, len(self.cfg_index.static_nats))
+
+    def test_static_routes(self):
+        self.assertEqual(['ip route vrf nrouter-9ad979-0000001 0.0.0.0 '
+                          '0.0.0.0 Port-channel10.165 10.23.229.145'],
+                         self.cfg_index.get_static_routes(
+                             'nrouter-9ad979-0000001'))
+        self.assertEqual(5, len(self.cfg_index.get_static_routes()))
+        self.assertTrue(self.cfg_index.cfg_exists(
+            'ip route vrf nrouter-9ad979-0000001 0.0.0.0 0.0.0.0 '
+            'Port-channel10.165'))
+        self.assertFalse(self.cfg_index.cfg_exists(
+            'ip route vrf nrouter-9ad979-0000001 0.0.0.0 0.0.0.0 '
+            'Port-channel10.3000'))
+
+    def test_string_config(self):
+        cfg_index = iosxe_running_config.IosXeRunningConfig(
+            "interface GigabitEthernet1\r\n"
+            " ip address 10.0.0.10 255.255.255.0\r\n"
+            "ip route 0.0.0.0 0.0.0.0 GigabitEthernet1 10.0.0.1\r\n")
+        self.assertEqual('10.0.0.10',
+                         cfg_index.get_interface_ip('GigabitEthernet1'))
+        self.assertEqual(['ip route 0.0.0.0 0.0.0.0 GigabitEthernet1 '
+                          '10.0.0.1'], cfg_index.static_routes[None])
+
+    def test_all_asr_configs(self):
+        for cfg_file in CFG_FILES:
+            running_cfg = self._read_asr_running_cfg(cfg_file)
+            cfg_index = iosxe_running_config.IosXeRunningConfig(running_cfg)
+
+            itfcs = [line.split()[1] for line in running_cfg
+                     if line.startswith('interface ')]
+            self.assertEqual(sorted(itfcs), sorted(cfg_index.interfaces))
+            for itfc in itfcs:
+                start = running_cfg.index('interface ' + itfc)
+                end = start + 1
+                while (end < len(running_cfg) and
+                       running_cfg[end].startswith(' ')):
+                    end += 1
+                self.assertEqual(running_cfg[start:end],
+                                 cfg_index.get_interface_cfg(itfc))
+            self.assertEqual([line.split()[2] for line in running_cfg
+                              if line.startswith('vrf definition ')],
+                             cfg_index.vrfs)
+            self.assertEqual(
+                [line for line in running_cfg
+                 if line.startswith('ip nat inside source static ')],
+                cfg_index.static_nats)
+            self.assertEqual(
+                sorted(line for line in running_cfg
+                       if line.startswith('ip route ')),
+                sorted(cfg_index.get_static_routes()))
+            self.assertEqual(
+                sorted(line for line in running_cfg
+                       if line.startswith('ip nat inside source list ')),
+                sorted(cfg_index.nat_rules.values()))
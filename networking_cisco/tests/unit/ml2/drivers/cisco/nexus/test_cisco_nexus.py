@@ -14,6 +14,8 @@
 # limitations under the License.
 
 import collections
+import eventlet
+from eventlet import event
 import mock
 import os
 from oslo_config import cfg
@@ -29,6 +31,7 @@ from networking_cisco.plugins.ml2.drivers.cisco.nexus import constants
 from networking_cisco.plugins.ml2.drivers.cisco.nexus import exceptions
 from networking_cisco.plugins.ml2.drivers.cisco.nexus import mech_cisco_nexus
 from networking_cisco.plugins.ml2.drivers.cisco.nexus import nexus_db_v2
+from networking_cisco.plugins.ml2.drivers.cisco.nexus import nexus_snippets
 
 from neutron.common import constants as n_const
 from neutron.extensions import portbindings
@@ -688,6 +691,593 @@ class TestCiscoNexusDevice(testlib_api.SqlTestCase):
         # then be successful on the 2nd pass.
         self.assertEqual(self.mock_ncclient.connect.call_count, 2)
 
+    def test_create_port_batched_config(self):
+        """Verifies VLAN create and trunk are sent in one edit_config."""
+        cfg.CONF.set_override('batch_switch_config', True, 'ml2_cisco')
+        batched_add_port_driver_result = [
+            '\<vlan\-name\>q\-267\<\/vlan\-name>[\s\S]+'
+            '\<vstate\>active\<\/vstate>[\s\S]+'
+            '\<no\>\s+\<shutdown\/\>\s+\<\/no\>[\s\S]+'
+            '\<interface\>1\/10\<\/interface\>\s+'
+            '[\x20-\x7e]+\s+\<switchport\>\s+\<trunk\>\s+'
+            '\<allowed\>\s+\<vlan\>\s+\<vlan_id\>267',
+        ]
+
+        self._create_port(
+            TestCiscoNexusDevice.test_configs['test_config1'])
+        self._verify_results(batched_add_port_driver_result)
+
+    def test_batched_config_fragment_failure(self):
+        """Verifies a batch failure is attributed to its fragment."""
+        cfg.CONF.set_override('batch_switch_config', True, 'ml2_cisco')
+        config = {'connect.return_value.edit_config.side_effect':
+                  self._config_side_effects_on_count(
+                      'switchport trunk allowed vlan_id 267',
+                      Exception(__name__))}
+        self.mock_ncclient.configure_mock(**config)
+
+        e = self.assertRaises(
+                exceptions.NexusConfigFragmentFailed,
+                self._create_port,
+                TestCiscoNexusDevice.test_configs['test_config1'])
+        self.assertIn('trunk vlan 267 on ethernet 1/10', unicode(e))
+        self.assertIn(__name__, unicode(e))
+        # The VLAN created by the transaction is removed again.
+        edit_config = self.mock_ncclient.connect.return_value.edit_config
+        self.assertIsNotNone(re.search(
+            '\<no\>\s+\<vlan\>\s+\<vlan\-id\-create\-delete\>\s+'
+            '\<__XML__PARAM_value\>267',
+            edit_config.mock_calls[-1][2]['config']))
+
+    def test_trunk_vlan_cache(self):
+        """Verifies trunk state is read once per interface."""
+        driver = self._cisco_mech_driver.driver
+        get = self.mock_ncclient.connect.return_value.get
+        get.return_value.data_xml = (
+            'interface Ethernet1/10\nswitchport trunk allowed vlan 10-12\n')
+
+        driver.enable_vlan_on_trunk_int(NEXUS_IP_ADDRESS, 20, 'ethernet',
+                                        '1/10')
+        driver.enable_vlan_on_trunk_int(NEXUS_IP_ADDRESS, 30, 'ethernet',
+                                        '1/10')
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(
+            set([10, 11, 12, 20, 30]),
+            driver.trunk_vlans[NEXUS_IP_ADDRESS, 'ethernet', '1/10'])
+
+        driver.disable_vlan_on_trunk_int(NEXUS_IP_ADDRESS, 11, 'ethernet',
+                                         '1/10')
+        self.assertEqual(
+            set([10, 12, 20, 30]),
+            driver.trunk_vlans[NEXUS_IP_ADDRESS, 'ethernet', '1/10'])
+
+        # Losing the switch forgets its trunk state.
+        self._cisco_mech_driver._switch_state = {}
+        self._cisco_mech_driver.set_switch_ip_and_active_state(
+            NEXUS_IP_ADDRESS, False)
+        self.assertEqual({}, driver.trunk_vlans)
+
+    def test_session_pool_reuse(self):
+        """Verifies pooled sessions are checked in and reused."""
+        driver = self._cisco_mech_driver.driver
+        for i in range(3):
+            driver.get_nexus_type(NEXUS_IP_ADDRESS)
+
+        self.assertEqual(self.mock_ncclient.connect.call_count, 1)
+        pool = driver.session_pools[NEXUS_IP_ADDRESS]
+        self.assertEqual(pool.idle_count(), 1)
+
+    def test_session_pool_limit(self):
+        """Verifies no more sessions than the pool size are checked out."""
+        cfg.CONF.set_override('switch_session_pool_size', 2, 'ml2_cisco')
+        driver = self._cisco_mech_driver.driver
+        sessions = [driver.nxos_connect(NEXUS_IP_ADDRESS) for i in range(2)]
+        pool = driver.session_pools[NEXUS_IP_ADDRESS]
+
+        # A third checkout would block until a session is checked in.
+        self.assertFalse(pool._slots.acquire(blocking=False))
+
+        for mgr in sessions:
+            driver._release_session(mgr, NEXUS_IP_ADDRESS)
+        self.assertEqual(pool.idle_count(), 2)
+        self.assertTrue(pool._slots.acquire(blocking=False))
+
+    def test_session_pool_checkout_timeout(self):
+        """Verifies a checkout from an exhausted pool fails in time."""
+        cfg.CONF.set_override('switch_session_pool_size', 1, 'ml2_cisco')
+        cfg.CONF.set_override('switch_session_checkout_timeout', 1,
+                              'ml2_cisco')
+        driver = self._cisco_mech_driver.driver
+        mgr = driver.nxos_connect(NEXUS_IP_ADDRESS)
+        pool = driver.session_pools[NEXUS_IP_ADDRESS]
+
+        with mock.patch.object(pool._slots, 'acquire',
+                               return_value=False) as acquire:
+            self.assertRaises(exceptions.NexusConnectFailed,
+                              driver.nxos_connect, NEXUS_IP_ADDRESS)
+        acquire.assert_called_once_with(timeout=1)
+
+        # The slot of the failed checkout is not lost.
+        driver._release_session(mgr, NEXUS_IP_ADDRESS)
+        driver._release_session(driver.nxos_connect(NEXUS_IP_ADDRESS),
+                                NEXUS_IP_ADDRESS)
+        self.assertEqual(1, pool.idle_count())
+
+    def test_session_pool_idle_reaper(self):
+        """Verifies idle sessions are closed without further requests."""
+        cfg.CONF.set_override('switch_session_idle_timeout', 30, 'ml2_cisco')
+        driver = self._cisco_mech_driver.driver
+        with mock.patch.object(nexus_network_driver.eventlet,
+                               'spawn_after') as spawn_after:
+            driver.get_nexus_type(NEXUS_IP_ADDRESS)
+            driver.get_nexus_type(NEXUS_IP_ADDRESS)
+        pool = driver.session_pools[NEXUS_IP_ADDRESS]
+        self.assertEqual(1, spawn_after.call_count)
+        self.assertEqual(1, pool.idle_count())
+
+        pool._idle[0][1] -= 31
+        pool._run_reaper()
+        self.assertEqual(0, pool.idle_count())
+        self.assertTrue(self.mock_ncclient.connect.return_value.
+                        close_session.called)
+        self.assertIsNone(pool._reaper)
+
+    def test_session_prewarm(self):
+        """Verifies a session is opened to every switch and kept idle."""
+        mdriver = self._cisco_mech_driver
+        driver = mdriver.driver
+        mdriver._switch_state = {}
+        switch_ips = mdriver.get_switch_ips()
+        mdriver._prewarm_switch_sessions()
+
+        self.assertEqual(len(switch_ips),
+                         self.mock_ncclient.connect.call_count)
+        for switch_ip in switch_ips:
+            self.assertIsNotNone(mdriver.get_switch_prewarm_time(switch_ip))
+            self.assertEqual(1, driver.session_pools[switch_ip].idle_count())
+
+        # A forked process doesn't reuse the sessions of its parent.
+        self.mock_ncclient.connect.reset_mock()
+        with mock.patch.object(nexus_network_driver.os, 'getpid',
+                               return_value=-1):
+            driver.get_nexus_type(NEXUS_IP_ADDRESS)
+        self.assertEqual(1, self.mock_ncclient.connect.call_count)
+
+    def test_session_prewarm_per_process(self):
+        """Verifies each process starts opening its sessions once."""
+        cfg.CONF.set_override('switch_session_prewarm', True, 'ml2_cisco')
+        mdriver = self._cisco_mech_driver
+        with mock.patch.object(mech_cisco_nexus.eventlet,
+                               'spawn_n') as spawn_n:
+            mdriver._check_session_prewarm()
+            mdriver._check_session_prewarm()
+            self.assertEqual(1, spawn_n.call_count)
+
+            with mock.patch.object(mech_cisco_nexus.os, 'getpid',
+                                   return_value=-1):
+                mdriver._check_session_prewarm()
+            self.assertEqual(2, spawn_n.call_count)
+
+    def test_port_lock_names(self):
+        """Verifies port locks only overlap on shared switch resources."""
+        mech = self._cisco_mech_driver
+
+        def lock_names(host_name, vlan_id):
+            segment = FakeNetworkContext(vlan_id,
+                                         NETWORK_TYPE).network_segments
+            port = {portbindings.HOST_ID: host_name}
+            return mech._get_port_lock_names(port, segment, None)
+
+        host1 = lock_names(HOST_NAME_1, VLAN_ID_1)
+        self.assertEqual(2, len(host1))
+
+        # Different interface and VLAN on the same switch run concurrently.
+        self.assertFalse(host1 & lock_names(HOST_NAME_2, VLAN_ID_2))
+
+        # A different switch never shares a lock.
+        self.assertFalse(host1 & lock_names(HOST_NAME_PC, VLAN_ID_1))
+
+        # The same VLAN on another interface of the switch is serialized.
+        self.assertTrue(host1 & lock_names(HOST_NAME_2, VLAN_ID_1))
+
+        # An unknown host takes no locks.
+        self.assertEqual(set(), lock_names('unknown_host', VLAN_ID_1))
+
+    def test_host_index(self):
+        """Verifies host and switch lookups served from the host index."""
+        mech = self._cisco_mech_driver
+        self.assertEqual(
+            [(NEXUS_IP_ADDRESS_DUAL, 'ethernet', '1/3'),
+             (NEXUS_IP_ADDRESS_DUAL, 'portchannel', '2')],
+            mech._get_switch_info(HOST_NAME_DUAL))
+        self.assertEqual([NEXUS_IP_ADDRESS_DUAL],
+                         mech._get_switch_nve_info(HOST_NAME_DUAL))
+        self.assertEqual([], mech._get_switch_info('unknown_host'))
+        self.assertEqual(
+            sorted([NEXUS_IP_ADDRESS, NEXUS_IP_ADDRESS_PC,
+                    NEXUS_IP_ADDRESS_DUAL]),
+            sorted(mech.get_switch_ips()))
+        self.assertEqual(sorted([HOST_NAME_1, HOST_NAME_2]),
+                         sorted(mech.get_switch_hosts(NEXUS_IP_ADDRESS)))
+
+        # A large switch config is indexed once and then only looked up.
+        mech._nexus_switches = {}
+        for switch in range(50):
+            switch_ip = '10.0.0.%d' % switch
+            mech._nexus_switches[switch_ip, constants.USERNAME] = 'admin'
+            for host in range(40):
+                mech._nexus_switches[switch_ip, 'host%d-%d' % (
+                    switch, host)] = 'ethernet:1/%d' % host
+        with mock.patch.object(mech, '_build_host_index',
+                               wraps=mech._build_host_index) as build:
+            for switch in range(50):
+                self.assertEqual(
+                    [('10.0.0.%d' % switch, 'ethernet', '1/7')],
+                    mech._get_switch_info('host%d-7' % switch))
+            self.assertEqual(1, build.call_count)
+        self.assertEqual(40, len(mech.get_switch_hosts('10.0.0.3')))
+
+    def test_host_index_switch_attributes(self):
+        """Verifies switch attributes are not parsed as host ports."""
+        mech = self._cisco_mech_driver
+        mech._nexus_switches = {
+            (NEXUS_IP_ADDRESS, constants.USERNAME): 'admin:x',
+            (NEXUS_IP_ADDRESS, constants.PASSWORD): 'a:b:c',
+            (NEXUS_IP_ADDRESS, constants.PHYSNET): 'physnet1',
+            (NEXUS_IP_ADDRESS, constants.SSH_PORT): 22,
+            (NEXUS_IP_ADDRESS, HOST_NAME_1): 'ethernet:1/10',
+        }
+        mech._build_host_index()
+        self.assertEqual([(NEXUS_IP_ADDRESS, 'ethernet', '1/10')],
+                         mech._get_switch_info(HOST_NAME_1))
+        self.assertEqual([], mech._get_switch_info('physnet1'))
+        self.assertEqual([HOST_NAME_1],
+                         mech.get_switch_hosts(NEXUS_IP_ADDRESS))
+        self.assertEqual([NEXUS_IP_ADDRESS], mech.get_switch_ips())
+
+    def test_deferred_config_save(self):
+        """Verifies a burst of changes is saved once per switch."""
+        cfg.CONF.set_override('persistent_switch_config', True, 'ml2_cisco')
+        cfg.CONF.set_override('switch_config_save_delay', 5, 'ml2_cisco')
+        driver = importutils.import_object(NEXUS_DRIVER)
+        driver.nexus_switches = self._cisco_mech_driver._nexus_switches
+        self._cisco_mech_driver.driver = driver
+
+        with mock.patch.object(nexus_network_driver.eventlet,
+                               'spawn') as spawn:
+            for config in ('test_config1', 'test_config2'):
+                self._create_port(TestCiscoNexusDevice.test_configs[config])
+        self.assertEqual(1, spawn.call_count)
+
+        edit_config = self.mock_ncclient.connect.return_value.edit_config
+        configs = [call[2]['config'] for call in edit_config.mock_calls]
+        self.assertFalse([config for config in configs
+                          if 'startup-config' in config])
+        self.assertIn(NEXUS_IP_ADDRESS, driver.save_scheduler.get_status())
+
+        driver.flush_config_saves()
+        configs = [call[2]['config'] for call in edit_config.mock_calls]
+        self.assertEqual(1, len([config for config in configs
+                                 if 'startup-config' in config]))
+        self.assertIn('startup-config', configs[-1])
+        status = driver.save_scheduler.get_status()[NEXUS_IP_ADDRESS]
+        self.assertEqual(0, status['unsaved_for'])
+        self.assertIsNotNone(status['last_save_lag'])
+
+    def test_deferred_config_save_failure(self):
+        """Verifies a switch whose save fails stays scheduled."""
+        save = mock.Mock(side_effect=Exception('timed out'))
+        scheduler = nexus_network_driver.NexusConfigSaveScheduler(save, 5, 60)
+        with mock.patch.object(nexus_network_driver.eventlet,
+                               'spawn') as spawn:
+            scheduler.mark_dirty(NEXUS_IP_ADDRESS)
+            scheduler.flush()
+        save.assert_called_once_with(NEXUS_IP_ADDRESS)
+        self.assertEqual(2, spawn.call_count)
+        self.assertIn(NEXUS_IP_ADDRESS, scheduler._workers)
+        self.assertIn(NEXUS_IP_ADDRESS, scheduler.get_status())
+
+    def test_deferred_config_save_flush_in_progress(self):
+        """Verifies flush waits for a save in progress to complete."""
+        saved = event.Event()
+        save = mock.Mock(side_effect=lambda nexus_host: saved.wait())
+        scheduler = nexus_network_driver.NexusConfigSaveScheduler(save, 0, 60)
+        scheduler.mark_dirty(NEXUS_IP_ADDRESS)
+        eventlet.sleep(0)
+        self.assertIn(NEXUS_IP_ADDRESS, scheduler._saving)
+
+        # A change made during the save is saved by the flush as well.
+        scheduler.mark_dirty(NEXUS_IP_ADDRESS)
+        eventlet.spawn_after(0, saved.send)
+        scheduler.flush()
+        eventlet.sleep(0)
+
+        self.assertEqual(2, save.call_count)
+        self.assertEqual({}, scheduler._saving)
+        self.assertEqual({}, scheduler._dirty)
+        self.assertEqual({}, scheduler._workers)
+        self.assertEqual(0, scheduler.get_status()[NEXUS_IP_ADDRESS][
+            'unsaved_for'])
+
+    def test_async_switch_config(self):
+        """Verifies journaled postcommit work is applied by the worker."""
+        cfg.CONF.set_override('async_switch_config', True, 'ml2_cisco')
+        mech = self._cisco_mech_driver
+        mech._journal_workers = {}
+        edit_config = self.mock_ncclient.connect.return_value.edit_config
+
+        with mock.patch.object(mech_cisco_nexus.eventlet, 'spawn') as spawn:
+            self._create_port(
+                TestCiscoNexusDevice.test_configs['test_config1'])
+        spawn.assert_called_once_with(mech._run_journal, NEXUS_IP_ADDRESS)
+        self.assertEqual(0, edit_config.call_count)
+        self.assertEqual({NEXUS_IP_ADDRESS: {constants.JOURNAL_PENDING: 1}},
+                         mech.get_journal_status())
+
+        mech._journal_workers = {}
+        mech._run_journal(NEXUS_IP_ADDRESS)
+        self._verify_results([
+            '\<vlan\-name\>q\-267\<\/vlan\-name>',
+            '\<vstate\>active\<\/vstate>',
+            '\<no\>\s+\<shutdown\/\>\s+\<\/no\>',
+            '\<interface\>1\/10\<\/interface\>\s+'
+            '[\x20-\x7e]+\s+\<switchport\>\s+\<trunk\>\s+'
+            '\<allowed\>\s+\<vlan\>\s+\<vlan_id\>267',
+        ])
+        self.assertEqual({}, mech.get_journal_status())
+
+    def test_async_switch_config_failure(self):
+        """Verifies failing journaled work is retried, then blocks."""
+        cfg.CONF.set_override('async_switch_config', True, 'ml2_cisco')
+        cfg.CONF.set_override('switch_journal_retries', 2, 'ml2_cisco')
+        mech = self._cisco_mech_driver
+        mech._journal_workers = {}
+        edit_config = self.mock_ncclient.connect.return_value.edit_config
+        edit_config.side_effect = Exception(__name__)
+
+        with mock.patch.object(mech_cisco_nexus.eventlet, 'spawn'):
+            self._create_port(
+                TestCiscoNexusDevice.test_configs['test_config1'])
+        mech.set_switch_ip_and_active_state(NEXUS_IP_ADDRESS, True)
+        with mock.patch.object(mech_cisco_nexus.eventlet,
+                               'sleep') as sleep:
+            mech._run_journal(NEXUS_IP_ADDRESS)
+
+        self.assertEqual(1, sleep.call_count)
+        self.assertEqual({NEXUS_IP_ADDRESS: {constants.JOURNAL_FAILED: 1}},
+                         mech.get_journal_status())
+        # The switch gets replayed and the failed entry holds back the
+        # entries after it until then.
+        self.assertFalse(
+            mech.get_switch_ip_and_active_state(NEXUS_IP_ADDRESS))
+        edit_config.reset_mock()
+        mech._run_journal(NEXUS_IP_ADDRESS)
+        self.assertEqual(0, edit_config.call_count)
+
+        self.assertEqual(
+            1, nexus_db_v2.retry_failed_journal_entries(NEXUS_IP_ADDRESS))
+        self.assertEqual({NEXUS_IP_ADDRESS: {constants.JOURNAL_PENDING: 1}},
+                         mech.get_journal_status())
+
+    def test_async_switch_config_requires_heartbeat(self):
+        """Verifies the journal is not enabled without the switch monitor."""
+        cfg.CONF.set_override('async_switch_config', True, 'ml2_cisco')
+        cfg.CONF.set_override('switch_heartbeat_time', 0, 'ml2_cisco')
+        mech = mech_cisco_nexus.CiscoNexusMechanismDriver()
+        self.assertRaises(cfg.Error, mech.initialize)
+
+    def test_format_vlan_ranges(self):
+        """Verifies VLAN IDs are compressed into chunked range lists."""
+        format_ranges = nexus_network_driver.format_vlan_ranges
+        self.assertEqual(['10-12,20,30-31'],
+                         format_ranges([31, 10, 11, 12, 20, 30, 11]))
+        self.assertEqual([], format_ranges([]))
+        self.assertEqual(['1,3', '5,7', '9'],
+                         format_ranges([1, 3, 5, 7, 9], max_len=4))
+        ranges = format_ranges(range(2, 4000, 2))
+        self.assertTrue(all(len(chunk) <= 256 for chunk in ranges))
+        self.assertEqual(
+            set(range(2, 4000, 2)),
+            set().union(*[nexus_network_driver.parse_vlan_ranges(chunk)
+                          for chunk in ranges]))
+
+    def test_replay_vlan_ranges(self):
+        """Verifies replay sends VLANs and trunks as range lists."""
+        cfg.CONF.set_override('replay_vlan_ranges', True, 'ml2_cisco')
+        Binding = collections.namedtuple(
+            'Binding', 'port_id vlan_id vni is_provider_vlan')
+        bindings = [Binding('ethernet:1/10', vlan_id, 0, False)
+                    for vlan_id in (10, 11, 12, 20)]
+        bindings += [Binding('ethernet:1/20', vlan_id, 0, False)
+                     for vlan_id in (11, 12)]
+
+        self._cisco_mech_driver._switch_state = {}
+        self._cisco_mech_driver.configure_switch_entries(NEXUS_IP_ADDRESS,
+                                                         bindings)
+        self._verify_results([
+            '\<vlan\-name\>q\-10\<\/vlan\-name>[\s\S]+'
+            '\<vlan\-name\>q\-11\<\/vlan\-name>[\s\S]+'
+            '\<vlan\-name\>q\-12\<\/vlan\-name>[\s\S]+'
+            '\<vlan\-name\>q\-20\<\/vlan\-name>',
+            '\<__XML__PARAM_value\>10\-12,20\<[\s\S]+'
+            '\<vstate\>active\<\/vstate>',
+            '\<__XML__PARAM_value\>10\-12,20\<[\s\S]+'
+            '\<no\>\s+\<shutdown\/\>\s+\<\/no\>',
+            '\<interface\>1\/10\<\/interface\>\s+'
+            '[\x20-\x7e]+\s+\<switchport\>\s+\<trunk\>\s+'
+            '\<allowed\>\s+\<vlan\>\s+\<vlan_id\>10\-12,20\<',
+            '\<interface\>1\/20\<\/interface\>\s+'
+            '[\x20-\x7e]+\s+\<switchport\>\s+\<trunk\>\s+'
+            '\<allowed\>\s+\<vlan\>\s+\<vlan_id\>11\-12\<',
+        ])
+        self.assertEqual(
+            (6, 6),
+            self._cisco_mech_driver.get_switch_replay_progress(
+                NEXUS_IP_ADDRESS))
+
+    def test_monitor_probe(self):
+        """Verifies active switches of known type get a small probe."""
+        self._cisco_mech_driver._switch_state = {}
+        monitor = mech_cisco_nexus.CiscoNexusCfgMonitor(
+            self._cisco_mech_driver.driver, self._cisco_mech_driver)
+        self._cisco_mech_driver.set_switch_ip_and_active_state(
+            NEXUS_IP_ADDRESS, True)
+        self._cisco_mech_driver.set_switch_nexus_type(
+            NEXUS_IP_ADDRESS, constants.NEXUS_9K)
+        self.assertIsNone(
+            self._cisco_mech_driver.get_switch_probe_latency(
+                NEXUS_IP_ADDRESS))
+
+        get = self.mock_ncclient.connect.return_value.get
+        get.reset_mock()
+        monitor.check_switch_connection(NEXUS_IP_ADDRESS)
+        get.assert_called_once_with(
+            filter=('subtree', nexus_snippets.EXEC_GET_HOSTNAME_SNIPPET))
+        self.assertIsNotNone(
+            self._cisco_mech_driver.get_switch_probe_latency(
+                NEXUS_IP_ADDRESS))
+
+        # An unreachable switch is marked inactive.
+        get.side_effect = Exception('timed out')
+        monitor.check_switch_connection(NEXUS_IP_ADDRESS)
+        self.assertFalse(
+            self._cisco_mech_driver.get_switch_ip_and_active_state(
+                NEXUS_IP_ADDRESS))
+
+    def test_replay_reconcile(self):
+        """Verifies reconcile pushes missing and removes stale config."""
+        cfg.CONF.set_override('replay_reconcile', True, 'ml2_cisco')
+        cfg.CONF.set_override('replay_reconcile_remove_stale', True,
+                              'ml2_cisco')
+        for port_id, vlan_id in (('ethernet:1/10', 10),
+                                 ('ethernet:1/10', 11),
+                                 ('ethernet:1/20', 11)):
+            nexus_db_v2.add_nexusport_binding(
+                port_id, vlan_id, 0, NEXUS_IP_ADDRESS,
+                'instance_%s' % vlan_id, False)
+
+        running_config = {
+            'vlan': 'vlan 1,10,30\nvlan 10\n  name q-10\n'
+                    'vlan 30\n  name q-30\n',
+            'interface ethernet 1/10': ('interface Ethernet1/10\n'
+                                        '  switchport trunk allowed vlan '
+                                        '1,10,30\n'),
+            'interface ethernet 1/20': ('interface Ethernet1/20\n'
+                                        '  switchport mode trunk\n'),
+        }
+        # The uplink is not connected to a host, so its trunk is left
+        # alone.
+        running_config['interface'] = (
+            running_config['interface ethernet 1/10'] +
+            running_config['interface ethernet 1/20'] +
+            'interface Ethernet1/48\n'
+            '  switchport trunk allowed vlan 1,10,30\n')
+
+        def get_config(filter):
+            cmd = re.search('show running-config (.*?)</cmd>', filter[1])
+            return mock.Mock(data_xml=running_config[cmd.group(1).strip()])
+        self.mock_ncclient.connect.return_value.get.side_effect = get_config
+
+        self._cisco_mech_driver._switch_state = {}
+        monitor = mech_cisco_nexus.CiscoNexusCfgMonitor(
+            self._cisco_mech_driver.driver, self._cisco_mech_driver)
+        monitor.replay_config(NEXUS_IP_ADDRESS)
+        self._verify_results([
+            '\<vlan\-name\>q\-11\<\/vlan\-name>',
+            '\<__XML__PARAM_value\>11\<[\s\S]+'
+            '\<vstate\>active\<\/vstate>',
+            '\<__XML__PARAM_value\>11\<[\s\S]+'
+            '\<no\>\s+\<shutdown\/\>\s+\<\/no\>',
+            '\<interface\>1\/10\<\/interface\>\s+'
+            '[\x20-\x7e]+\s+\<switchport\>\s+\<trunk\>\s+'
+            '\<allowed\>\s+\<vlan\>\s+\<add\>\s+\<vlan_id\>11\<',
+            '\<interface\>1\/20\<\/interface\>\s+'
+            '[\x20-\x7e]+\s+\<switchport\>\s+\<trunk\>\s+'
+            '\<allowed\>\s+\<vlan\>\s+\<vlan_id\>11\<',
+            '\<interface\>1\/10\<\/interface\>\s+'
+            '[\x20-\x7e\s]+\<switchport\>\s+\<trunk\>\s+'
+            '\<allowed\>\s+\<vlan\>\s+\<remove\>\s+\<vlan\>30',
+            '\<no\>\s+\<vlan\>\s+<vlan-id-create-delete\>'
+            '\s+\<__XML__PARAM_value\>30',
+        ])
+        self.assertEqual(
+            (3, 3),
+            self._cisco_mech_driver.get_switch_replay_progress(
+                NEXUS_IP_ADDRESS))
+
+    def test_retry_backoff(self):
+        """Verifies failed requests are retried with growing delays."""
+        cfg.CONF.set_override('switch_retry_count', 3, 'ml2_cisco')
+        cfg.CONF.set_override('switch_retry_interval', 1.0, 'ml2_cisco')
+        cfg.CONF.set_override('switch_retry_max_interval', 1.5, 'ml2_cisco')
+        edit_config = self.mock_ncclient.connect.return_value.edit_config
+        edit_config.side_effect = Exception(__name__)
+        driver = self._cisco_mech_driver.driver
+
+        with mock.patch.object(nexus_network_driver.random, 'uniform',
+                               side_effect=lambda low, high: high), \
+                mock.patch.object(nexus_network_driver.time,
+                                  'sleep') as sleep:
+            self.assertRaises(exceptions.NexusConfigFailed,
+                              driver._edit_config, NEXUS_IP_ADDRESS,
+                              config='config')
+
+        self.assertEqual(3, edit_config.call_count)
+        self.assertEqual([mock.call(1.0), mock.call(1.5)],
+                         sleep.call_args_list)
+
+    def test_circuit_breaker(self):
+        """Verifies a failing switch is fast-failed until it recovers."""
+        cfg.CONF.set_override('switch_failure_threshold', 2, 'ml2_cisco')
+        edit_config = self.mock_ncclient.connect.return_value.edit_config
+        edit_config.side_effect = Exception(__name__)
+        driver = self._cisco_mech_driver.driver
+
+        for i in range(2):
+            self.assertRaises(exceptions.NexusConfigFailed,
+                              driver._edit_config, NEXUS_IP_ADDRESS,
+                              config='config')
+        self.assertEqual(4, edit_config.call_count)
+
+        # Further requests fail without contacting the switch.
+        self.assertRaises(exceptions.NexusSwitchUnavailable,
+                          driver._edit_config, NEXUS_IP_ADDRESS,
+                          config='config')
+        self.assertEqual(4, edit_config.call_count)
+
+        # Other switches are not affected.
+        edit_config.side_effect = None
+        driver._edit_config(NEXUS_IP_ADDRESS_PC, config='config')
+
+        # The switch monitor's ping is let through and closes the breaker.
+        driver.get_nexus_type(NEXUS_IP_ADDRESS)
+        driver._edit_config(NEXUS_IP_ADDRESS, config='config')
+        self.assertEqual(6, edit_config.call_count)
+
+    def test_circuit_breaker_half_open_batch_rejected(self):
+        """Verifies a rejected batch probe is resent as fragments."""
+        cfg.CONF.set_override('switch_failure_threshold', 1, 'ml2_cisco')
+        cfg.CONF.set_override('switch_failure_cooldown', 0, 'ml2_cisco')
+        edit_config = self.mock_ncclient.connect.return_value.edit_config
+        edit_config.side_effect = [Exception(__name__), None, None]
+        driver = self._cisco_mech_driver.driver
+        breaker = driver._get_circuit_breaker(NEXUS_IP_ADDRESS)
+        breaker.failure()
+        self.assertTrue(breaker.is_open())
+
+        # The merged payload is the half-open probe; the fragments resent
+        # after its rejection complete the probe rather than being
+        # fast-failed by the breaker.
+        transaction = nexus_network_driver.NexusConfigTransaction(
+            driver, NEXUS_IP_ADDRESS)
+        transaction.add('<fragment1/>', 'fragment 1')
+        transaction.add('<fragment2/>', 'fragment 2')
+        transaction.commit()
+
+        self.assertEqual(3, edit_config.call_count)
+        self.assertFalse(breaker.is_open())
+        driver._edit_config(NEXUS_IP_ADDRESS, config='config')
+
 RP_NEXUS_IP_ADDRESS_1 = '1.1.1.1'
 RP_NEXUS_IP_ADDRESS_2 = '2.2.2.2'
 RP_NEXUS_IP_ADDRESS_3 = '3.3.3.3'
@@ -784,13 +1374,14 @@ class TestCiscoNexusReplay(testlib_api.SqlTestCase):
         '[\x20-\x7e]+\s+\<switchport\>\s+\<trunk\>\s+'
         '\<allowed\>\s+\<vlan\>\s+\<vlan_id\>267',
     ]
+    # Second VLAN on the same interface is added to the trunk.
     driver_result_unique_add2 = [
         '\<vlan\-name\>q\-265\<\/vlan\-name>',
         '\<vstate\>active\<\/vstate>',
         '\<no\>\s+\<shutdown\/\>\s+\<\/no\>',
         '\<interface\>1\/10\<\/interface\>\s+'
         '[\x20-\x7e]+\s+\<switchport\>\s+\<trunk\>\s+'
-        '\<allowed\>\s+\<vlan\>\s+\<vlan_id\>265',
+        '\<allowed\>\s+\<vlan\>\s+\<add\>\s+\<vlan_id\>265',
     ]
     driver_result_unique_del1 = [
         '\<interface\>1\/10\<\/interface\>\s+'
@@ -1171,11 +1762,23 @@ class TestCiscoNexusReplay(testlib_api.SqlTestCase):
                       driver_result_unique_del2,
                       'nbr_db_entries': 0}
 
+        # Replay re-reads the trunk so the lowest VLAN is replayed
+        # without 'add' and the next VLAN with it.
+        replay_result = (
+            self.driver_result_unique_add2[:3] +
+            ['\<interface\>1\/10\<\/interface\>\s+'
+             '[\x20-\x7e]+\s+\<switchport\>\s+\<trunk\>\s+'
+             '\<allowed\>\s+\<vlan\>\s+\<vlan_id\>265'] +
+            self.driver_result_unique_add1[:3] +
+            ['\<interface\>1\/10\<\/interface\>\s+'
+             '[\x20-\x7e]+\s+\<switchport\>\s+\<trunk\>\s+'
+             '\<allowed\>\s+\<vlan\>\s+\<add\>\s+\<vlan_id\>267'])
+
         self._process_replay('test_replay_unique1',
                              'test_replay_unique2',
                              first_add,
                              second_add,
-                             [],
+                             replay_result,
                              first_del,
                              second_del)
 
@@ -1232,6 +1835,52 @@ class TestCiscoNexusReplay(testlib_api.SqlTestCase):
                               driver_result_duplvlan_add2),
                              first_del, second_del)
 
+    def test_skip_redundant_vlan_create(self):
+        """Tests the VLAN is only created by its first binding."""
+        cfg.CONF.set_override('skip_redundant_vlan_create', True,
+                              'ml2_cisco')
+
+        driver_result_duplvlan_add_vlan = [
+            '\<vlan\-name\>q\-267\<\/vlan\-name>',
+            '\<vstate\>active\<\/vstate>',
+            '\<no\>\s+\<shutdown\/\>\s+\<\/no\>',
+        ]
+        driver_result_duplvlan_add = [
+            '\<interface\>1\/10\<\/interface\>\s+'
+            '[\x20-\x7e]+\s+\<switchport\>\s+\<trunk\>\s+'
+            '\<allowed\>\s+\<vlan\>\s+\<vlan_id\>267',
+            '\<interface\>1\/20\<\/interface\>\s+'
+            '[\x20-\x7e]+\s+\<switchport\>\s+\<trunk\>\s+'
+            '\<allowed\>\s+\<vlan\>\s+\<vlan_id\>267',
+        ]
+        driver_result_duplvlan_del = [
+            '\<interface\>1\/10\<\/interface\>\s+'
+            '[\x20-\x7e\s]+\<switchport\>\s+\<trunk\>\s+'
+            '\<allowed\>\s+\<vlan\>\s+\<remove\>\s+\<vlan\>267',
+            '\<no\>\s+\<vlan\>\s+<vlan-id-create-delete\>'
+            '\s+\<__XML__PARAM_value\>267',
+            '\<interface\>1\/20\<\/interface\>\s+'
+            '[\x20-\x7e\s]+\<switchport\>\s+\<trunk\>\s+'
+            '\<allowed\>\s+\<vlan\>\s+\<remove\>\s+\<vlan\>267',
+        ]
+        first_add = {'driver_results': (
+                     driver_result_duplvlan_add_vlan +
+                     driver_result_duplvlan_add),
+                     'nbr_db_entries': 2}
+        second_add = {'driver_results': [],
+                      'nbr_db_entries': 4}
+        first_del = {'driver_results': [],
+                     'nbr_db_entries': 2}
+        second_del = {'driver_results': driver_result_duplvlan_del,
+                      'nbr_db_entries': 0}
+
+        self._process_replay('test_replay_duplvlan1',
+                             'test_replay_duplvlan2',
+                             first_add, second_add,
+                             (driver_result_duplvlan_add_vlan +
+                              driver_result_duplvlan_add),
+                             first_del, second_del)
+
     def test_replay_duplicate_ports(self):
         """Provides replay data and result data for duplicate ports. """
         driver_result_duplport_add1 = [
@@ -1266,6 +1915,30 @@ class TestCiscoNexusReplay(testlib_api.SqlTestCase):
                              [],
                              first_del, second_del)
 
+    def test_replay_multiple_switches(self):
+        """Verifies all inactive switches are replayed in one check."""
+        test_names = ['test_replay_unique1', 'test_replay_duplport1']
+        for test_name in test_names:
+            port_cfg = TestCiscoNexusReplay.test_configs[test_name]
+            self._cisco_mech_driver.set_switch_ip_and_active_state(
+                port_cfg.nexus_ip_addr, False)
+            self._basic_create_verify_port_vlan(
+                test_name, self.driver_result_unique_add1)
+
+        self._cfg_monitor.check_connections()
+        self._verify_replay_results(self.driver_result_unique_add1 * 2)
+
+        for test_name in test_names:
+            switch_ip = TestCiscoNexusReplay.test_configs[
+                test_name].nexus_ip_addr
+            self.assertTrue(
+                self._cisco_mech_driver.get_switch_ip_and_active_state(
+                    switch_ip))
+            self.assertEqual(
+                (1, 1),
+                self._cisco_mech_driver.get_switch_replay_progress(
+                    switch_ip))
+
     def test_replay_get_interface_failure(self):
         """Verifies exception during ncclient get interface. """
 
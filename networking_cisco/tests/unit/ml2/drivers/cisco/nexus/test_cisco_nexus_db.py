@@ -14,10 +14,13 @@
 #    under the License.
 
 import collections
+import mock
+from sqlalchemy import event
 import testtools
 
 from networking_cisco.plugins.ml2.drivers.cisco.nexus import exceptions
 from networking_cisco.plugins.ml2.drivers.cisco.nexus import nexus_db_v2
+from networking_cisco.plugins.ml2.drivers.cisco.nexus import nexus_models_v2
 
 from neutron.tests.unit import testlib_api
 
@@ -205,3 +208,237 @@ class CiscoNexusDbTest(testlib_api.SqlTestCase):
         npb33 = self._npb_test_obj(30, 300, switch='1.1.1.1', instance='test')
         with testtools.ExpectedException(exceptions.NexusPortBindingNotFound):
             nexus_db_v2.update_nexusport_binding(npb33.port, 200)
+
+    def _assert_vlan_refs(self, switch, vlan, switch_refs, port_refs):
+        """Asserts the VLAN reference counts of a switch and its ports."""
+        self.assertEqual(switch_refs,
+                         nexus_db_v2.get_vlan_ref_count(switch, vlan))
+        for port, refs in port_refs.items():
+            self.assertEqual(
+                refs, nexus_db_v2.get_vlan_ref_count(switch, vlan, port))
+
+    def test_nexusbinding_vlan_refs(self):
+        """Tests the VLAN reference counts follow the bindings."""
+        npb11 = self._npb_test_obj(10, 100, switch='1.1.1.1', instance='vm1')
+        npb12 = self._npb_test_obj(10, 100, switch='1.1.1.1', instance='vm2')
+        npb21 = self._npb_test_obj(20, 100, switch='1.1.1.1', instance='vm3')
+        npb31 = self._npb_test_obj(10, 100, switch='2.2.2.2', instance='vm1')
+        self._assert_vlan_refs('1.1.1.1', 100, 0, {'1/10': 0})
+
+        self._add_bindings_to_db([npb11, npb12, npb21, npb31])
+        self._assert_vlan_refs('1.1.1.1', 100, 3, {'1/10': 2, '1/20': 1})
+        self._assert_vlan_refs('2.2.2.2', 100, 1, {'1/10': 1})
+
+        self._remove_binding_from_db(npb12)
+        self._assert_vlan_refs('1.1.1.1', 100, 2, {'1/10': 1, '1/20': 1})
+
+        nexus_db_v2.update_nexusport_binding(npb21.port, 200)
+        self._assert_vlan_refs('1.1.1.1', 100, 1, {'1/10': 1, '1/20': 0})
+        self._assert_vlan_refs('1.1.1.1', 200, 1, {'1/20': 1})
+
+        rows = nexus_db_v2.get_nexusvm_bindings(100, 'vm1')
+        nexus_db_v2.remove_nexusport_bindings(rows)
+        # Removing the same rows again must not count them down twice.
+        nexus_db_v2.remove_nexusport_bindings(rows)
+        self._assert_vlan_refs('1.1.1.1', 100, 0, {'1/10': 0})
+        self._assert_vlan_refs('2.2.2.2', 100, 0, {'1/10': 0})
+        self._assert_vlan_refs('1.1.1.1', 200, 1, {'1/20': 1})
+
+    def test_nexusbinding_vlan_ref_owner(self):
+        """Tests the first binding of a VLAN on a switch owns it."""
+        npb11 = self._npb_test_obj(10, 100, switch='1.1.1.1', instance='vm1')
+        npb21 = self._npb_test_obj(20, 100, switch='1.1.1.1', instance='vm2')
+        self.assertIsNone(nexus_db_v2.get_vlan_ref_owner('1.1.1.1', 100))
+
+        self._add_binding_to_db(npb11)
+        self._add_binding_to_db(npb21)
+        self.assertEqual('vm1',
+                         nexus_db_v2.get_vlan_ref_owner('1.1.1.1', 100))
+
+        self._remove_binding_from_db(npb11)
+        self._remove_binding_from_db(npb21)
+        self._add_binding_to_db(npb21)
+        self.assertEqual('vm2',
+                         nexus_db_v2.get_vlan_ref_owner('1.1.1.1', 100))
+
+    def test_reconcile_vlan_refs(self):
+        """Tests drifted VLAN reference counts are recounted."""
+        npb11 = self._npb_test_obj(10, 100, switch='1.1.1.1', instance='vm1')
+        npb21 = self._npb_test_obj(20, 100, switch='1.1.1.1', instance='vm2')
+        self._add_bindings_to_db([npb11, npb21])
+        self.assertEqual(0, nexus_db_v2.reconcile_vlan_refs('1.1.1.1'))
+
+        session = nexus_db_v2.db.get_session()
+        with session.begin():
+            session.query(nexus_models_v2.NexusVlanRef).filter_by(
+                port_id='1/10').delete()
+            session.query(nexus_models_v2.NexusVlanRef).filter_by(
+                port_id='').update({'ref_count': 1})
+            session.add(nexus_models_v2.NexusVlanRef(
+                switch_ip='1.1.1.1', vlan_id=200, port_id='1/10',
+                ref_count=1))
+        self.assertEqual(3, nexus_db_v2.reconcile_vlan_refs('1.1.1.1'))
+        self._assert_vlan_refs('1.1.1.1', 100, 2, {'1/10': 1, '1/20': 1})
+        self._assert_vlan_refs('1.1.1.1', 200, 0, {'1/10': 0})
+
+    def _count_commits(self):
+        """Returns a list that grows by one entry per DB commit."""
+        commits = []
+        engine = nexus_db_v2.db.get_engine()
+
+        def on_commit(conn):
+            commits.append(conn)
+
+        event.listen(engine, 'commit', on_commit)
+        self.addCleanup(event.remove, engine, 'commit', on_commit)
+        return commits
+
+    def test_nexusportbinding_bulk_add_remove(self):
+        """Tests bulk add and remove use a single commit."""
+        npbs = [self._npb_test_obj(pnum, 100, switch=switch, instance='vm')
+                for pnum in (10, 20, 30) for switch in ('1.1.1.1', '2.2.2.2')]
+
+        commits = self._count_commits()
+        nexus_db_v2.add_nexusport_bindings(
+            [{'port_id': npb.port, 'vlan_id': npb.vlan, 'vni': npb.vni,
+              'switch_ip': npb.switch, 'instance_id': npb.instance,
+              'is_provider_vlan': npb.is_provider_vlan} for npb in npbs])
+        self.assertEqual(1, len(commits))
+
+        rows = nexus_db_v2.get_nexusvm_bindings(100, 'vm')
+        self.assertEqual(len(npbs), len(rows))
+        for npb in npbs:
+            self._assert_bindings_match(self._get_nexusport_binding(npb)[0],
+                                        npb)
+
+        del commits[:]
+        nexus_db_v2.remove_nexusport_bindings(rows)
+        self.assertEqual(1, len(commits))
+        with testtools.ExpectedException(exceptions.NexusPortBindingNotFound):
+            nexus_db_v2.get_nexusvm_bindings(100, 'vm')
+
+    def test_nexusnvebinding_bulk_add_remove(self):
+        """Tests bulk add and remove of NVE bindings."""
+        switches = ['1.1.1.1', '2.2.2.2', '3.3.3.3']
+        commits = self._count_commits()
+        nexus_db_v2.add_nexusnve_bindings(5000, switches, 'vm', '225.1.1.1')
+        self.assertEqual(1, len(commits))
+        self.assertEqual(
+            switches,
+            sorted(row.switch_ip for row in
+                   nexus_db_v2.get_nve_vni_deviceid_bindings(5000, 'vm')))
+
+        del commits[:]
+        self.assertEqual(3, nexus_db_v2.remove_nexusnve_bindings(5000, 'vm'))
+        self.assertEqual(1, len(commits))
+        self.assertEqual(
+            [], nexus_db_v2.get_nve_vni_deviceid_bindings(5000, 'vm'))
+
+    def _query_plan(self, model, **bfilter):
+        """Returns the SQLite query plan of a filter_by query."""
+        session = nexus_db_v2.db.get_session()
+        if session.bind.dialect.name != 'sqlite':
+            self.skipTest("Query plans are only checked on SQLite")
+        query = session.query(model).filter_by(**bfilter)
+        statement = query.statement.compile(
+            dialect=session.bind.dialect,
+            compile_kwargs={'literal_binds': True})
+        rows = session.execute('EXPLAIN QUERY PLAN %s' % statement)
+        return ' '.join(str(row[-1]) for row in rows)
+
+    def test_nexusbinding_lookups_use_index(self):
+        """Tests the binding lookups are not full table scans."""
+        npbs = [self._npb_test_obj(pnum, vnum, switch='1.1.1.%d' % snum)
+                for pnum in range(10) for vnum in range(100, 110)
+                for snum in range(5)]
+        self._add_bindings_to_db(npbs)
+
+        port_binding = nexus_models_v2.NexusPortBinding
+        lookups = [
+            dict(switch_ip='1.1.1.1'),
+            dict(switch_ip='1.1.1.1', vlan_id=100),
+            dict(port_id='1/1', switch_ip='1.1.1.1', vlan_id=100),
+            dict(port_id='1/1', vlan_id=100, switch_ip='1.1.1.1',
+                 instance_id='instance_1_100'),
+            dict(instance_id='instance_1_100', vlan_id=100),
+            dict(port_id='1/1', switch_ip='1.1.1.1'),
+            dict(port_id='router'),
+        ]
+        for bfilter in lookups:
+            plan = self._query_plan(port_binding, **bfilter)
+            self.assertIn('USING INDEX', plan, bfilter)
+
+        plan = self._query_plan(nexus_models_v2.NexusNVEBinding,
+                                switch_ip='1.1.1.1')
+        self.assertIn('USING INDEX', plan)
+
+
+class CiscoNexusBindingCacheTest(CiscoNexusDbTest):
+
+    """Runs the Nexus port binding tests against the binding cache."""
+
+    def setUp(self):
+        super(CiscoNexusBindingCacheTest, self).setUp()
+        nexus_db_v2.enable_binding_cache(60)
+        self.addCleanup(nexus_db_v2.disable_binding_cache)
+
+    def test_nexusbinding_cache_lookup(self):
+        """Tests cached lookups do not query the database."""
+        npb11 = self._npb_test_obj(10, 100)
+        npb21 = self._npb_test_obj(20, 100)
+        self._add_bindings_to_db([npb11, npb21])
+
+        with mock.patch.object(nexus_db_v2.db, 'get_session') as session:
+            npb = self._get_port_vlan_switch_binding(npb21)
+            self._assert_bindings_match(npb[0], npb21)
+            self.assertEqual(2, len(self._get_nexusvlan_binding(npb11)))
+            self.assertEqual(0, session.call_count)
+
+        self._remove_binding_from_db(npb21)
+        with testtools.ExpectedException(exceptions.NexusPortBindingNotFound):
+            self._get_nexusport_binding(npb21)
+
+    def test_nexusbinding_cache_miss(self):
+        """Tests rows written by another server are found on a miss."""
+        npb11 = self._npb_test_obj(10, 100)
+        self._add_binding_to_db(npb11)
+
+        # Drop the row from the index only, as if it had been added by
+        # another neutron server after the cache was loaded.
+        cache = nexus_db_v2._binding_cache
+        cache.remove(self._get_nexusport_binding(npb11)[0])
+        with mock.patch.object(nexus_db_v2.db, 'get_session',
+                               wraps=nexus_db_v2.db.get_session) as session:
+            self._assert_bindings_match(
+                self._get_port_vlan_switch_binding(npb11)[0], npb11)
+            self.assertEqual(1, session.call_count)
+
+        cache.invalidate()
+        self._assert_bindings_match(
+            self._get_port_vlan_switch_binding(npb11)[0], npb11)
+
+    def test_nexusbinding_cache_delete_by_other_worker(self):
+        """Tests rows deleted by another worker are not found for writes."""
+        npb11 = self._npb_test_obj(10, 100)
+        self._add_binding_to_db(npb11)
+
+        # Delete the row behind the cache, as another api or rpc worker
+        # of this neutron server would.
+        session = nexus_db_v2.db.get_session()
+        with session.begin(subtransactions=True):
+            session.query(nexus_models_v2.NexusPortBinding).filter_by(
+                port_id=npb11.port).delete()
+
+        # The existence checks made before adding or removing bindings,
+        # and the switch replay, must not act on the stale index entry.
+        with testtools.ExpectedException(exceptions.NexusPortBindingNotFound):
+            self._get_nexusport_binding(npb11)
+        with testtools.ExpectedException(exceptions.NexusPortBindingNotFound):
+            self._get_nexusvm_binding(npb11)
+        with testtools.ExpectedException(exceptions.NexusPortBindingNotFound):
+            nexus_db_v2.get_nexusport_switch_bindings(npb11.switch)
+
+        # So the binding can be added again by this worker.
+        self._add_binding_to_db(npb11)
+        self._assert_bindings_match(self._get_nexusport_binding(npb11)[0],
+                                    npb11)
@@ -13,10 +13,16 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import mock
+from oslo_config import cfg
+
 from networking_cisco.plugins.ml2.drivers.cisco.nexus import (
     constants as const)
+from networking_cisco.plugins.ml2.drivers.cisco.nexus import (
+    nexus_models_v2)
 from networking_cisco.plugins.ml2.drivers.cisco.nexus import type_nexus_vxlan
 
+from neutron.common import exceptions as exc
 import neutron.db.api as db
 from neutron.plugins.common import constants as p_const
 from neutron.plugins.ml2 import driver_api as api
@@ -62,10 +68,42 @@ class NexusVxlanTypeTest(testlib_api.SqlTestCase):
         self.assertTrue(self.vni_in_range(segments[0][api.SEGMENTATION_ID]))
         self.assertEqual(segments[-1][api.NETWORK_TYPE],
                          const.TYPE_NEXUS_VXLAN)
-        self.assertEqual(segments[-1][api.PHYSICAL_NETWORK], '224.0.0.1')
+        # Once every group is used, the least used groups are reused in
+        # configuration order.
+        self.assertEqual(segments[-1][api.PHYSICAL_NETWORK], '224.0.0.2')
         self.assertTrue(self.vni_in_range(segments[-1][api.SEGMENTATION_ID]))
         self.assertNotEqual(segments[0], segments[-1])
 
+    def test_allocate_least_used_mcast_group(self):
+        segments = [self.driver.allocate_tenant_segment(self.session)
+                    for i in range(5)]
+        self.assertEqual(['224.0.0.1', '224.0.0.2', '224.0.1.1',
+                          '224.0.1.2', '224.0.0.1'],
+                         [segment[api.PHYSICAL_NETWORK]
+                          for segment in segments])
+
+        # A released group is the least used one again.
+        self.driver.release_segment(self.session, segments[2])
+        segment = self.driver.allocate_tenant_segment(self.session)
+        self.assertEqual('224.0.1.1', segment[api.PHYSICAL_NETWORK])
+
+        # Counts reloaded from the database give the same choice.
+        self.driver._mcast_usage = None
+        segment = self.driver.allocate_tenant_segment(self.session)
+        self.assertEqual('224.0.0.2', segment[api.PHYSICAL_NETWORK])
+
+    def test_mcast_usage_reset_on_rollback(self):
+        try:
+            with self.session.begin(subtransactions=True):
+                self.driver.allocate_tenant_segment(self.session)
+                self.assertIsNotNone(self.driver._mcast_usage)
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertIsNone(self.driver._mcast_usage)
+        segment = self.driver.allocate_tenant_segment(self.session)
+        self.assertEqual('224.0.0.1', segment[api.PHYSICAL_NETWORK])
+
     def test_reserve_provider_segment_full_specs(self):
         segment = {api.NETWORK_TYPE: const.TYPE_NEXUS_VXLAN,
                    api.PHYSICAL_NETWORK: '224.0.0.1',
@@ -99,3 +137,125 @@ class NexusVxlanTypeTest(testlib_api.SqlTestCase):
                                                    invalid_vni_range,
                                                    'ml2_type_nexus_vxlan')
             self.assertRaises(SystemExit, self.driver._verify_vni_ranges)
+
+
+class NexusVxlanSyncTest(testlib_api.SqlTestCase):
+
+    def setUp(self):
+        super(NexusVxlanSyncTest, self).setUp()
+        self.driver = type_nexus_vxlan.NexusVxlanTypeDriver()
+        self.driver.conf_mcast_ranges = MCAST_GROUP_RANGES
+        self.driver.tunnel_ranges = VNI_RANGES
+        self.driver.sync_allocations()
+        self.session = db.get_session()
+
+    def _allocations(self):
+        alloc = nexus_models_v2.NexusVxlanAllocation
+        return dict((row.vxlan_vni, row.allocated) for row in
+                    self.session.query(alloc))
+
+    def test_sync_allocations_diff(self):
+        self.driver.reserve_provider_segment(
+            self.session, {api.NETWORK_TYPE: const.TYPE_NEXUS_VXLAN,
+                           api.PHYSICAL_NETWORK: None,
+                           api.SEGMENTATION_ID: 200})
+        self.driver.tunnel_ranges = [(101, 103), (5000, 5024),
+                                     (5020, 5030)]
+        with mock.patch.object(type_nexus_vxlan, 'VNI_SYNC_BULK_SIZE', 10):
+            self.driver.sync_allocations()
+            allocations = self._allocations()
+            self.driver.sync_allocations()
+            self.assertEqual(allocations, self._allocations())
+
+        expected = dict((vni, False) for vni in
+                        list(range(101, 104)) + list(range(5000, 5031)))
+        # Allocated VNIs are kept even outside of the ranges.
+        expected[200] = True
+        self.assertEqual(expected, allocations)
+
+    def test_sync_allocations_no_ranges(self):
+        self.driver.tunnel_ranges = []
+        self.driver.sync_allocations()
+        self.assertEqual({}, self._allocations())
+
+
+class NexusVxlanRangeTypeTest(NexusVxlanTypeTest):
+
+    def setUp(self):
+        super(NexusVxlanRangeTypeTest, self).setUp()
+        cfg.CONF.set_override('vni_range_allocation', True,
+                              'ml2_type_nexus_vxlan')
+        self.driver.sync_allocations()
+
+    def _free_ranges(self):
+        free = nexus_models_v2.NexusVxlanFreeRange
+        return [(row.first_vni, row.last_vni) for row in
+                self.session.query(free).order_by(free.first_vni)]
+
+    def _segment(self, vni):
+        return {api.NETWORK_TYPE: const.TYPE_NEXUS_VXLAN,
+                api.PHYSICAL_NETWORK: None,
+                api.SEGMENTATION_ID: vni}
+
+    def test_sync_vni_ranges(self):
+        self.assertEqual(VNI_RANGES, self._free_ranges())
+        self.assertEqual(0, self.session.query(
+            nexus_models_v2.NexusVxlanAllocation).count())
+
+    def test_allocate_release_vni(self):
+        vnis = [self.driver.allocate_tenant_segment(self.session)[
+                api.SEGMENTATION_ID] for i in range(4)]
+        self.assertEqual([100, 101, 102, 200], vnis)
+        self.assertEqual([(201, 202)], self._free_ranges())
+
+        self.driver.release_segment(self.session, self._segment(101))
+        self.assertEqual([(101, 101), (201, 202)], self._free_ranges())
+        self.driver.release_segment(self.session, self._segment(100))
+        self.driver.release_segment(self.session, self._segment(102))
+        self.assertEqual([(100, 102), (201, 202)], self._free_ranges())
+
+        # A provider VNI splits the range holding it.
+        self.driver.release_segment(self.session, self._segment(200))
+        self.driver.reserve_provider_segment(self.session,
+                                             self._segment(201))
+        self.assertEqual([(100, 102), (200, 200), (202, 202)],
+                         self._free_ranges())
+        self.assertRaises(exc.TunnelIdInUse,
+                          self.driver.reserve_provider_segment,
+                          self.session, self._segment(201))
+
+        # Allocated VNIs stay allocated across a resync.
+        self.driver.sync_allocations()
+        self.assertEqual([(100, 102), (200, 200), (202, 202)],
+                         self._free_ranges())
+
+    def test_allocate_vni_range_changed(self):
+        take_vni = self.driver._take_vni
+        attempts = []
+
+        def take_vni_after_other(session, free_range, vni):
+            attempts.append(vni)
+            if len(attempts) == 1:
+                # Someone else allocates the VNI after it was selected.
+                self.assertTrue(take_vni(session, free_range, vni))
+                return False
+            return take_vni(session, free_range, vni)
+
+        with mock.patch.object(self.driver, '_take_vni',
+                               side_effect=take_vni_after_other):
+            segment = self.driver.allocate_tenant_segment(self.session)
+        self.assertEqual([100, 101], attempts)
+        self.assertEqual(101, segment[api.SEGMENTATION_ID])
+        self.assertEqual([(102, 102), (200, 202)], self._free_ranges())
+
+        with mock.patch.object(self.driver, '_take_vni', return_value=False):
+            self.assertRaises(exc.NoNetworkFoundInMaximumAllowedAttempts,
+                              self.driver.allocate_tenant_segment,
+                              self.session)
+
+    def test_exhausted_vni_ranges(self):
+        for i in range(6):
+            self.assertIsNotNone(
+                self.driver.allocate_tenant_segment(self.session))
+        self.assertIsNone(self.driver.allocate_tenant_segment(self.session))
+        self.assertEqual([], self._free_ranges())